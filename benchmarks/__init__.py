@@ -0,0 +1 @@
+"""Benchmarks for RADIFOX hot paths (not installed with the package)."""
@@ -0,0 +1,103 @@
+"""Time benchmark for encoding large sidecar documents with ``JSONObjectEncoder``.
+
+Compares the single-pass ``JSONObjectEncoder`` (``json.dumps`` and streaming ``json.dump``)
+with the previous placeholder implementation, which encoded each ``NoIndent`` value to a
+``uuid4`` placeholder and replaced the placeholders in the finished document one by one. The
+outputs are checked to be identical.
+
+Run with ``python -m benchmarks.json_encoder``.
+"""
+import argparse
+import json
+import os
+from pathlib import PurePath
+import tempfile
+import time
+from typing import Any, Union
+import uuid
+
+import numpy as np
+
+from radifox.records.json import JSONObjectEncoder, NoIndent
+
+
+class PlaceholderEncoder(json.JSONEncoder):
+    """Reference copy of the previous ``JSONObjectEncoder``."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.kwargs = dict(kwargs)
+        del self.kwargs["indent"]
+        self._replacement_map = {}
+
+    def default(self, o: Any) -> Union[str, dict]:
+        if isinstance(o, NoIndent):
+            key = uuid.uuid4().hex
+            self._replacement_map[key] = json.dumps(o.value, **self.kwargs, cls=PlaceholderEncoder)
+            return "@@%s@@" % (key,)
+        elif isinstance(o, PurePath):
+            return str(o)
+        elif hasattr(o, "__repr_json__") and callable(o.__repr_json__):
+            return o.__repr_json__()
+        else:
+            return super().default(o)
+
+    def encode(self, o: Any) -> str:
+        result = super().encode(o)
+        for k, v in self._replacement_map.items():
+            result = result.replace('"@@%s@@"' % (k,), v)
+        return result
+
+
+def make_sidecar(num_slices: int) -> dict:
+    """A sidecar with per-slice arrays (timing, positions, orientations) as NoIndent values."""
+    rng = np.random.default_rng(0)
+    positions = np.round(rng.normal(0, 100, size=(num_slices, 3)), 4).tolist()
+    return {
+        "SeriesInfo": {
+            "SeriesDescription": "BENCHMARK SERIES",
+            "AcquiredResolution": NoIndent([1.0, 1.0]),
+            "SliceTiming": NoIndent(np.round(rng.random(num_slices), 5).tolist()),
+            "SlicePositions": [NoIndent(position) for position in positions],
+            "SliceOrientations": [
+                NoIndent([1.0, 0.0, 0.0, 0.0, 1.0, 0.0]) for _ in range(num_slices)
+            ],
+        }
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--slices", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parsed = parser.parse_args(args)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_file = os.path.join(tmp_dir, "sidecar.json")
+        for num_slices in parsed.slices:
+            doc = make_sidecar(num_slices)
+            expected = json.dumps(doc, cls=PlaceholderEncoder, indent=4)
+
+            def dump():
+                with open(out_file, "w") as f:
+                    json.dump(doc, f, cls=JSONObjectEncoder, indent=4)
+
+            assert json.dumps(doc, cls=JSONObjectEncoder, indent=4) == expected
+            dump()
+            with open(out_file) as f:
+                assert f.read() == expected
+            for name, func in (
+                ("placeholder dumps", lambda: json.dumps(doc, cls=PlaceholderEncoder, indent=4)),
+                ("single-pass dumps", lambda: json.dumps(doc, cls=JSONObjectEncoder, indent=4)),
+                ("single-pass dump to file", dump),
+            ):
+                times = []
+                for _ in range(parsed.repeats):
+                    start = time.perf_counter()
+                    func()
+                    times.append(time.perf_counter() - start)
+                print(f"{num_slices} slices, {name}: {min(times) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
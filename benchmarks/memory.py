@@ -0,0 +1,155 @@
+"""Peak-memory regression harness for volume-processing paths.
+
+Measures the ``tracemalloc`` peak (Python and NumPy allocations) and the peak RSS increase of
+resizing, reslicing, QA, MEMPRAGE/MP2RAGE staging plugin and header-fix paths on synthetic
+volumes of several sizes. Every measurement runs in a fresh process, so peaks of earlier runs
+do not hide later ones. Measurements are checked against the per-path, per-size budgets in
+``benchmarks/memory_budgets.json`` (``tests/test_memory.py`` checks the small size).
+
+Run with ``python -m benchmarks.memory`` (``--record`` to rewrite the budgets).
+"""
+from __future__ import annotations
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import math
+import os
+from pathlib import Path
+import resource
+import sys
+import tempfile
+import tracemalloc
+
+import nibabel as nib
+
+from radifox.modules.staging import MEMPRAGEPlugin, MP2RAGEPlugin, fix_sform_qform
+from radifox.naming import ImageFile
+from radifox.records.qa import Reslicer, create_qa_image
+from radifox.records.resize import nn_resize_1mmiso
+
+from .project import make_session
+
+SIZES = {"small": (64, 64, 48), "medium": (160, 192, 144), "large": (256, 256, 192)}
+BUDGETS_FILE = Path(__file__).with_name("memory_budgets.json")
+# Recorded budgets are the measured peak times the margin plus the slack
+BUDGET_MARGIN = 1.25
+BUDGET_SLACK_MIB = 4.0
+
+
+def make_inputs(work_dir: Path, shape: tuple[int, int, int]) -> dict[str, list[Path]]:
+    """Write a synthetic session and return its input images by role."""
+    paths = make_session(work_dir / "MEM-0001" / "01", shape)
+    (work_dir / "MEM-0001" / "01" / "stage").mkdir()
+    return {
+        "t1": [paths[0]],
+        "t2": [paths[1]],
+        "echoes": [path for path in paths if "-ECHO" in path.name],
+        "mp2rage": [path for path in paths if "-INV" in path.name],
+    }
+
+
+def reslice(img_path: Path, on_demand: bool = False) -> list:
+    """Reslice the center slice of each plane."""
+    reslicer = Reslicer(nib.load(img_path, keep_file_open=True), on_demand=on_demand)
+    planes = ("axial", "sagittal", "coronal")
+    return reslicer.get_slices([(reslicer.get_num_slices(plane) // 2, plane) for plane in planes])
+
+
+WORKLOADS = {
+    "nn_resize_1mmiso": lambda inputs: nn_resize_1mmiso(nib.load(inputs["t2"][0])),
+    "reslicer": lambda inputs: reslice(inputs["t2"][0]),
+    "reslicer_on_demand": lambda inputs: reslice(inputs["t2"][0], on_demand=True),
+    "create_qa_image": lambda inputs: create_qa_image(
+        inputs["t1"][0], inputs["t1"][0].parent.parent / "qa.png"
+    ),
+    "sum_memprage": lambda inputs: MEMPRAGEPlugin.sum_memprage(
+        [ImageFile(path) for path in inputs["echoes"]]
+    ),
+    "create_uniden": lambda inputs: MP2RAGEPlugin.create_uniden(
+        [ImageFile(path) for path in inputs["mp2rage"]]
+    ),
+    "fix_sform_qform": lambda inputs: fix_sform_qform(ImageFile(inputs["t1"][0])),
+}
+
+
+def measure_tracemalloc(name: str, inputs: dict[str, list[Path]]) -> float:
+    """Return the tracemalloc peak (MiB) of one workload call."""
+    tracemalloc.start()
+    try:
+        WORKLOADS[name](inputs)
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def measure_rss(name: str, inputs: dict[str, list[Path]]) -> float:
+    """Return the peak RSS increase (MiB) of one workload call."""
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    WORKLOADS[name](inputs)
+    # ru_maxrss is in KiB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) / 1024
+
+
+def measure(name: str, inputs: dict[str, list[Path]]) -> dict[str, float]:
+    """Measure the peak RSS increase and tracemalloc peak (MiB) of a workload."""
+    measured = {}
+    # Each in a new process (tracing slows allocations and staging skips up-to-date outputs)
+    for key, func in (("rss_mib", measure_rss), ("tracemalloc_mib", measure_tracemalloc)):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            measured[key] = executor.submit(func, name, inputs).result()
+    return measured
+
+
+def load_budgets(budgets_file: Path = BUDGETS_FILE) -> dict[str, dict[str, dict[str, float]]]:
+    """Return the recorded budgets by workload, size and measure."""
+    return json.loads(budgets_file.read_text())
+
+
+def over_budget(measured: dict[str, float], budget: dict[str, float]) -> list[str]:
+    """List the measures of one workload that exceed their budget."""
+    return [key for key, value in measured.items() if key in budget and value > budget[key]]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Check peak memory against recorded budgets.")
+    parser.add_argument("--sizes", choices=list(SIZES), nargs="+", default=list(SIZES))
+    parser.add_argument("--workloads", choices=list(WORKLOADS), nargs="+", default=None)
+    parser.add_argument("--record", action="store_true", default=False)
+    parser.add_argument("--budgets", type=Path, default=BUDGETS_FILE)
+    parsed = parser.parse_args(args)
+    workloads = list(WORKLOADS) if parsed.workloads is None else parsed.workloads
+
+    budgets = load_budgets(parsed.budgets) if parsed.budgets.exists() else {}
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Keep gzip seek indexes of the outputs out of the user's cache directory
+        os.environ["RADIFOX_GZIP_INDEX_DIR"] = str(Path(tmp_dir) / "gzip-index")
+        for size in parsed.sizes:
+            inputs = make_inputs(Path(tmp_dir) / size, SIZES[size])
+            for name in workloads:
+                measured = measure(name, inputs)
+                budget = budgets.get(name, {}).get(size, {})
+                failed = over_budget(measured, budget)
+                print(
+                    f"{name} ({size}): tracemalloc {measured['tracemalloc_mib']:.1f} MiB "
+                    f"(budget {budget.get('tracemalloc_mib', math.nan):.1f}), "
+                    f"RSS +{measured['rss_mib']:.1f} MiB "
+                    f"(budget {budget.get('rss_mib', math.nan):.1f})"
+                    + (" OVER BUDGET" if failed else "")
+                )
+                failures.extend((name, size, key) for key in failed)
+                if parsed.record:
+                    budgets.setdefault(name, {})[size] = {
+                        key: round(value * BUDGET_MARGIN + BUDGET_SLACK_MIB, 1)
+                        for key, value in measured.items()
+                    }
+    if parsed.record:
+        parsed.budgets.write_text(json.dumps(budgets, indent=2, sort_keys=True) + "\n")
+        print(f"Budgets written to {parsed.budgets}.")
+    elif failures:
+        sys.exit(f"{len(failures)} measurement(s) over budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Synthetic RADIFOX project trees for benchmarks.
+
+Writes ``<project>/<subject>/<session>/nii`` directories of validly named ``.nii.gz`` volumes
+with ``SeriesInfo`` JSON sidecars: single T1/T2/FLAIR series plus (optionally) two-echo
+MEMPRAGE and four-component MP2RAGE sets that the default staging plugins combine.
+
+Run with ``python -m benchmarks.project -o /path/to/project``.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+
+# (image type, slice thickness) of each single-image series
+SERIES = (
+    ("BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE", 1.0),
+    ("BRAIN-T2-FSE-2D-AXIAL-NA", 3.0),
+    ("BRAIN-FLAIR-FSE-3D-SAGITTAL-NA", 1.0),
+)
+MEMPRAGE_TYPE = "BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE-ECHO{echo}"
+MP2RAGE_TYPE = "BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE-INV{inv}-{component}"
+SHAPES = {"small": (32, 32, 24), "large": (256, 256, 176)}
+
+
+def make_volume(shape: tuple[int, int, int], seed: int) -> np.ndarray:
+    """A head-like int16 volume (bright ellipsoid and noise) that compresses like real data."""
+    rng = np.random.default_rng(seed)
+    grid = np.meshgrid(*[np.linspace(-1, 1, dim) for dim in shape], indexing="ij", sparse=True)
+    radius = np.sqrt(sum(axis**2 for axis in grid))
+    data = np.where(radius < 0.8, 800 - 300 * radius, 20).astype(np.float32)
+    data += rng.normal(0, 15, size=shape).astype(np.float32)
+    return np.clip(data, 0, None).astype(np.int16)
+
+
+def write_image(
+    nii_dir: Path,
+    stem: str,
+    data: np.ndarray,
+    thickness: float,
+    description: str,
+) -> Path:
+    """Write a volume as a scanner-converted image (sform and qform code 1) with its sidecar."""
+    affine = np.diag([1.0, 1.0, thickness, 1.0])
+    img = nib.Nifti1Image(data, affine)
+    img.set_sform(affine, 1)
+    img.set_qform(affine, 1)
+    img_path = nii_dir / f"{stem}.nii.gz"
+    img.to_filename(img_path)
+    info = {
+        "SeriesDescription": description,
+        "AcquiredResolution": [1.0, 1.0],
+        "SliceThickness": thickness,
+        "SliceSpacing": None,
+        "ImageShape": list(data.shape),
+    }
+    (nii_dir / f"{stem}.json").write_text(json.dumps({"SeriesInfo": info}, indent=2))
+    return img_path
+
+
+def make_session(
+    session_dir: Path,
+    shape: tuple[int, int, int],
+    memprage: bool = True,
+    mp2rage: bool = True,
+    seed: int = 0,
+) -> list[Path]:
+    """Write the series of one session and return the image paths."""
+    nii_dir = session_dir / "nii"
+    nii_dir.mkdir(parents=True, exist_ok=True)
+    prefix = f"{session_dir.parent.name}_{session_dir.name}"
+    paths = []
+    series = 1
+    for image_type, thickness in SERIES:
+        data = make_volume(shape, seed + series)
+        stem = f"{prefix}_{series:02d}-01_{image_type}"
+        paths.append(write_image(nii_dir, stem, data, thickness, image_type.replace("-", " ")))
+        series += 1
+    if memprage:
+        for echo in (1, 2):
+            image_type = MEMPRAGE_TYPE.format(echo=echo)
+            data = make_volume(shape, seed + series) // echo
+            stem = f"{prefix}_{series:02d}-{echo:02d}_{image_type}"
+            paths.append(write_image(nii_dir, stem, data, 1.0, "MEMPRAGE"))
+        series += 1
+    if mp2rage:
+        for acq, (inv, component) in enumerate(
+            [(1, "REA"), (1, "IMA"), (2, "REA"), (2, "IMA")], start=1
+        ):
+            image_type = MP2RAGE_TYPE.format(inv=inv, component=component)
+            data = make_volume(shape, seed + series * 10 + acq) - 400
+            stem = f"{prefix}_{series:02d}-{acq:02d}_{image_type}"
+            paths.append(write_image(nii_dir, stem, data, 1.0, "MP2RAGE"))
+        series += 1
+    return paths
+
+
+def make_project(
+    project_dir: Path,
+    subjects: int = 2,
+    sessions: int = 2,
+    shape: tuple[int, int, int] = SHAPES["small"],
+    memprage: bool = True,
+    mp2rage: bool = True,
+) -> list[Path]:
+    """Write a project of ``subjects`` x ``sessions`` sessions and return the subject dirs."""
+    subject_dirs = []
+    for i in range(subjects):
+        subject_dir = project_dir / f"BENCH-{i + 1:04d}"
+        for j in range(sessions):
+            make_session(
+                subject_dir / f"{j + 1:02d}", shape, memprage, mp2rage, seed=100 * i + 10 * j
+            )
+        subject_dirs.append(subject_dir)
+    return subject_dirs
+
+
+def make_container_labels(path: Path) -> Path:
+    """Write a stub container labels file (see ``ProcessingModule.container_labels_path``)."""
+    labels = {
+        "ci.image": "localhost/radifox-benchmark",
+        "ci.tag": "latest",
+        "ci.commit": "0000000000000000000000000000000000000000",
+        "ci.builder": "benchmark",
+        "ci.timestamp": "1970-01-01T00:00:00Z",
+        "ci.digest": "sha256:" + "0" * 64,
+    }
+    path.write_text(json.dumps(labels, indent=2))
+    return path
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic RADIFOX project.")
+    parser.add_argument("-o", "--output-dir", type=Path, required=True)
+    parser.add_argument("--subjects", type=int, default=2)
+    parser.add_argument("--sessions", type=int, default=2)
+    parser.add_argument("--size", choices=list(SHAPES), default="small")
+    parser.add_argument("--shape", type=int, nargs=3, default=None)
+    parser.add_argument("--no-memprage", action="store_true", default=False)
+    parser.add_argument("--no-mp2rage", action="store_true", default=False)
+    parsed = parser.parse_args(args)
+
+    shape = SHAPES[parsed.size] if parsed.shape is None else tuple(parsed.shape)
+    subject_dirs = make_project(
+        parsed.output_dir,
+        parsed.subjects,
+        parsed.sessions,
+        shape,
+        not parsed.no_memprage,
+        not parsed.no_mp2rage,
+    )
+    print(f"Wrote {len(subject_dirs)} subject(s) to {parsed.output_dir}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Timing suite for RADIFOX hot paths on a synthetic project.
+
+Generates a project with ``benchmarks.project`` and times image globbing, ``ImageFilter``
+filtering, ``ImageInfo`` sidecar access, file/directory hashing, volume and surface QA images
+and full ``radifox-stage`` runs (QA and provenance included, with stub container labels).
+Results are written as JSON, which ``--compare`` checks against an earlier result file.
+
+Run with ``python -m benchmarks.suite -o results.json``.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+from pathlib import Path
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+
+from radifox import __version__
+from radifox.modules.staging import Staging
+from radifox.naming import ImageFile, ImageFilter, glob
+from radifox.records.hashing import hash_dir, hash_file
+from radifox.records.qa import create_qa_image, create_surface_qa_image
+
+from .project import SHAPES, make_container_labels, make_project
+from .surface_qa import make_ellipsoid
+
+RESULTS_VERSION = 1
+FILTERS = ("modality=T1", "modality=T2;acqdim=2D", "extras=ECHO1", "technique=FSE;extras=NONE")
+STAGE_ARGS = ["--image-types", "modality=T1", "modality=T2", "modality=FLAIR"]
+
+
+def time_calls(func, repeats: int, setup=None) -> list[float]:
+    """Time ``func()`` ``repeats`` times (calling the untimed ``setup()`` before each)."""
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times: list[float], items: int = 1) -> dict:
+    return {
+        "repeats": len(times),
+        "items": items,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "times": times,
+    }
+
+
+def write_surface(img_path: Path, surf_path: Path) -> None:
+    """Write an ellipsoid surface (in tkr RAS) inside the image field of view."""
+    shape = nib.load(img_path).shape
+    vertices, faces = make_ellipsoid(radii=tuple(dim * 0.35 for dim in shape), resolution=96)
+    nib.GiftiImage(
+        darrays=[
+            nib.gifti.GiftiDataArray(vertices.astype(np.float32), intent="NIFTI_INTENT_POINTSET"),
+            nib.gifti.GiftiDataArray(faces.astype(np.int32), intent="NIFTI_INTENT_TRIANGLE"),
+        ]
+    ).to_filename(surf_path)
+
+
+def run_suite(
+    work_dir: Path,
+    subjects: int,
+    sessions: int,
+    shape: tuple[int, int, int],
+    repeats: int,
+    skip: tuple[str, ...] = (),
+) -> dict[str, dict]:
+    """Generate a project in ``work_dir`` and return the timings of each benchmark."""
+    project_dir = work_dir / "project"
+    subject_dirs = make_project(project_dir, subjects, sessions, shape)
+    pattern = project_dir / "*" / "*" / "nii" / "*.nii.gz"
+    img_paths = [img.path for img in glob(pattern)]
+    results = {}
+
+    def record(name, func, items=1, setup=None):
+        if name in skip:
+            return
+        results[name] = summarize(time_calls(func, repeats, setup), items)
+
+    record("glob", lambda: glob(pattern), len(img_paths))
+    filters = [ImageFilter.from_string(filter_str) for filter_str in FILTERS]
+    imgs = [ImageFile(path) for path in img_paths]
+    record("image_filter", lambda: [f.filter(imgs) for f in filters], len(imgs) * len(filters))
+    record(
+        "image_info",
+        lambda: [
+            (img.info.slice_thickness, img.info.acquired_resolution)
+            for img in map(ImageFile, img_paths)
+        ],
+        len(img_paths),
+    )
+    record("hash_file", lambda: [hash_file(path) for path in img_paths], len(img_paths))
+    record("hash_dir", lambda: hash_dir(project_dir), len(img_paths))
+
+    # QA images of the first T1 (alone, with a label overlay and with a surface)
+    qa_dir = work_dir / "qa"
+    qa_dir.mkdir()
+    t1_path = next(path for path in img_paths if "BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE." in path.name)
+    t1_obj = nib.load(t1_path)
+    labels = (np.asarray(t1_obj.dataobj) > 500).astype(np.int16)
+    seg_path = qa_dir / "seg.nii.gz"
+    nib.Nifti1Image(labels, t1_obj.affine).to_filename(seg_path)
+    surf_path = qa_dir / "surf.gii"
+    write_surface(t1_path, surf_path)
+    record("create_qa_image", lambda: create_qa_image(t1_path, qa_dir / "qa.png"))
+    record(
+        "create_qa_image_overlay",
+        lambda: create_qa_image(t1_path, qa_dir / "qa-seg.png", seg_path, "binary"),
+    )
+    record(
+        "create_surface_qa_image",
+        lambda: create_surface_qa_image(surf_path, t1_path, qa_dir / "qa-surf.png"),
+    )
+
+    # Full staging runs of every subject, each on a fresh copy of the project
+    if "staging" not in skip:
+        stage_dir = work_dir / "stage"
+        labels_path = make_container_labels(work_dir / "labels.json")
+
+        def copy_project():
+            shutil.rmtree(stage_dir, ignore_errors=True)
+            shutil.copytree(project_dir, stage_dir)
+
+        def stage_all():
+            for subject_dir in subject_dirs:
+                run_staging(stage_dir / subject_dir.name, labels_path)
+
+        record("staging", stage_all, subjects * sessions, copy_project)
+    return results
+
+
+def run_staging(subject_dir: Path, labels_path: Path) -> None:
+    """Run ``radifox-stage`` on a subject quietly, with stub container labels."""
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    previous = Staging.container_labels_path
+    Staging.container_labels_path = labels_path
+    try:
+        # The module logs to stdout (and log files) through handlers added for each run
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            Staging(["-s", str(subject_dir), *STAGE_ARGS])
+    finally:
+        Staging.container_labels_path = previous
+        for handler in root.handlers[:]:
+            if handler not in handlers:
+                root.removeHandler(handler)
+                handler.close()
+        root.setLevel(level)
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """Print the median time ratio of each benchmark to a baseline result file."""
+    print(f"{'benchmark':<26}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        old, new = baseline["benchmarks"][name]["median"], result["median"]
+        print(f"{name:<26}{old:>11.4f}s{new:>11.4f}s{new / old:>8.2f}")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Time RADIFOX hot paths on a synthetic project.")
+    parser.add_argument("-o", "--output", type=Path, default=None)
+    parser.add_argument("--compare", type=Path, default=None)
+    parser.add_argument("--subjects", type=int, default=2)
+    parser.add_argument("--sessions", type=int, default=2)
+    parser.add_argument("--size", choices=list(SHAPES), default="small")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--skip", type=str, nargs="+", default=[])
+    parser.add_argument("--work-dir", type=Path, default=None)
+    parsed = parser.parse_args(args)
+
+    with tempfile.TemporaryDirectory(dir=parsed.work_dir) as work_dir:
+        benchmarks = run_suite(
+            Path(work_dir),
+            parsed.subjects,
+            parsed.sessions,
+            SHAPES[parsed.size],
+            parsed.repeats,
+            tuple(parsed.skip),
+        )
+    results = {
+        "version": RESULTS_VERSION,
+        "radifox": __version__,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "nibabel": nib.__version__,
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "parameters": {
+            "subjects": parsed.subjects,
+            "sessions": parsed.sessions,
+            "size": parsed.size,
+            "repeats": parsed.repeats,
+        },
+        "benchmarks": benchmarks,
+    }
+    for name, result in benchmarks.items():
+        print(f"{name}: {result['median']:.4f} s (median of {result['repeats']})")
+    if parsed.output is not None:
+        parsed.output.write_text(json.dumps(results, indent=2))
+    if parsed.compare is not None:
+        compare(results, json.loads(parsed.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
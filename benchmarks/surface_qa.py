@@ -0,0 +1,72 @@
+"""Images-per-second benchmark for surface QA rendering.
+
+Run with ``python -m benchmarks.surface_qa``.
+"""
+import argparse
+from pathlib import Path
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+
+from radifox.records.qa import create_surface_qa_image
+
+
+def make_ellipsoid(radii=(40.0, 40.0, 52.0), resolution=128) -> tuple[np.ndarray, np.ndarray]:
+    """Triangulate an ellipsoid on a latitude/longitude grid."""
+    theta = np.linspace(0, np.pi, resolution + 1)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, 2 * resolution, endpoint=False)
+    tt, pp = np.meshgrid(theta, phi, indexing="ij")
+    ring = np.stack([np.sin(tt) * np.cos(pp), np.sin(tt) * np.sin(pp), np.cos(tt)], axis=-1)
+    vertices = np.concatenate([[[0, 0, 1]], ring.reshape(-1, 3), [[0, 0, -1]]]) * radii
+    n_rings, n_phi = tt.shape
+    idx = np.arange(n_rings * n_phi).reshape(n_rings, n_phi) + 1
+    nxt = np.roll(idx, -1, axis=1)
+    faces = [np.stack([np.zeros(n_phi, int), idx[0], nxt[0]], axis=1)]
+    faces.append(np.stack([idx[:-1], idx[1:], nxt[1:]], axis=-1).reshape(-1, 3))
+    faces.append(np.stack([idx[:-1], nxt[1:], nxt[:-1]], axis=-1).reshape(-1, 3))
+    faces.append(np.stack([idx[-1], np.full(n_phi, len(vertices) - 1), nxt[-1]], axis=1))
+    return vertices, np.concatenate(faces)
+
+
+def make_surface_inputs(out_dir: Path, shape=(160, 192, 176), resolution=128) -> tuple[Path, Path]:
+    """Write a smooth synthetic T1 and an ellipsoid surface (in tkr RAS) to ``out_dir``."""
+    grid = np.meshgrid(*[np.arange(dim) - dim / 2 for dim in shape], indexing="ij")
+    radius = np.sqrt(sum(axis**2 for axis in grid))
+    rng = np.random.default_rng(0)
+    data = (np.exp(-radius / 40) * 1000 + rng.random(shape) * 50).astype(np.float32)
+    img_path = out_dir / "t1.nii.gz"
+    nib.Nifti1Image(data, np.eye(4)).to_filename(img_path)
+
+    vertices, faces = make_ellipsoid(resolution=resolution)
+    surf_path = out_dir / "surf.gii"
+    nib.GiftiImage(
+        darrays=[
+            nib.gifti.GiftiDataArray(
+                vertices.astype(np.float32), intent="NIFTI_INTENT_POINTSET"
+            ),
+            nib.gifti.GiftiDataArray(faces.astype(np.int32), intent="NIFTI_INTENT_TRIANGLE"),
+        ]
+    ).to_filename(surf_path)
+    return surf_path, img_path
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--resolution", type=int, default=128)
+    parsed = parser.parse_args(args)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        surf_path, img_path = make_surface_inputs(tmp_dir, resolution=parsed.resolution)
+        start = time.perf_counter()
+        for i in range(parsed.repeats):
+            create_surface_qa_image(surf_path, img_path, tmp_dir / f"qa-{i}.png")
+        elapsed = time.perf_counter() - start
+    print(f"create_surface_qa_image: {parsed.repeats / elapsed:.2f} images/s")
+
+
+if __name__ == "__main__":
+    main()
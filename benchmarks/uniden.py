@@ -0,0 +1,90 @@
+"""Time and peak-memory benchmark for MP2RAGE UNIDEN computation.
+
+Compares the whole-volume complex implementation with the slab-wise float32
+``MP2RAGEPlugin.compute_uniden``. Each run happens in a fresh process so the reported peak RSS
+is not polluted by earlier runs.
+
+Run with ``python -m benchmarks.uniden``.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import resource
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+
+from radifox.modules.staging import MP2RAGEPlugin
+
+
+def make_components(out_dir: Path, shape=(256, 256, 192), components=("REA", "IMA")) -> list[Path]:
+    """Write synthetic INV1/INV2 component images (INV1-a, INV1-b, INV2-a, INV2-b)."""
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(4):
+        if components == ("MAG", "PHA") and i % 2 == 1:
+            data = rng.integers(-4096, 4096, size=shape).astype(np.int16)
+        else:
+            data = (rng.standard_normal(shape) * 3000).astype(np.int16)
+        paths.append(out_dir / f"comp{i}.nii.gz")
+        nib.Nifti1Image(data, np.eye(4)).to_filename(paths[-1])
+    return paths
+
+
+def complex_uniden(paths: list[Path], components=("REA", "IMA"), gamma=1e9) -> np.ndarray:
+    """Reference whole-volume complex implementation."""
+    data = {}
+    for inv, (path_a, path_b) in (("INV1", paths[:2]), ("INV2", paths[2:])):
+        comp_a = nib.Nifti1Image.load(path_a).get_fdata(dtype=np.float32)
+        comp_b = nib.Nifti1Image.load(path_b).get_fdata(dtype=np.float32)
+        if tuple(components) == ("REA", "IMA"):
+            data[inv] = comp_a + comp_b * 1j
+        else:
+            comp_b = (comp_b - comp_b.min()) / (comp_b.max() - comp_b.min()) * (2 * np.pi)
+            data[inv] = comp_a * np.exp(comp_b * 1j)
+    uniden = np.real(
+        ((np.conjugate(data["INV1"]) * data["INV2"]) - gamma)
+        / (np.abs(data["INV1"]) ** 2 + np.abs(data["INV2"]) ** 2 + 2 * gamma)
+    )
+    return np.clip(uniden, -0.5, 0.5) + 0.5
+
+
+def _run(method: str, paths: list[Path], components: tuple[str, str]) -> tuple[float, int]:
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if method == "complex":
+        complex_uniden(paths, components)
+    else:
+        MP2RAGEPlugin.compute_uniden(paths, components)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shape", type=int, nargs=3, default=[256, 256, 192])
+    parser.add_argument("--components", choices=["REA,IMA", "MAG,PHA"], default="REA,IMA")
+    parser.add_argument("--repeats", type=int, default=3)
+    parsed = parser.parse_args(args)
+    components = tuple(parsed.components.split(","))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = make_components(Path(tmp_dir), tuple(parsed.shape), components)
+        for method in ("complex", "slab-wise float32"):
+            times, peaks = [], []
+            for _ in range(parsed.repeats):
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    elapsed, peak = executor.submit(_run, method, paths, components).result()
+                times.append(elapsed)
+                peaks.append(peak)
+            print(
+                f"{method}: {min(times):.2f} s, "
+                f"peak RSS +{max(peaks) / 1024:.0f} MiB (best of {parsed.repeats})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,49 @@
 from __future__ import annotations
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import importlib.metadata
+import json
 import importlib.util
 import inspect
 import logging
+import os
+import shutil
+import threading
+import time
 import warnings
 from abc import ABC, abstractmethod
 from collections import defaultdict
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 
 import nibabel as nib
 import numpy as np
 
-from .._version import __version__
+from .. import __version__
 from ..naming import ImageFile, ImageFilter, glob
 from ..records import ProcessingModule
+from ..records.hashing import hash_file
+from ..records.nifti import (
+    GzipIndex,
+    ParallelGzipWriter,
+    find_nifti,
+    get_intermediate_ext,
+    intermediate_ext,
+    load_nifti,
+    save_nifti,
+)
 
 __all__ = ["Staging", "StagingPlugin"]
 
+PLUGIN_ENTRY_POINT_GROUP = "radifox.staging_plugins"
+STAGING_PLAN_VERSION = 1
+# Sessions (and bytes per session) read ahead of the one being staged
+PREFETCH_SESSIONS = 1
+PREFETCH_BYTES = 2**30
+# Linux ioctl to share a file's extents (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
 
 class Staging(ProcessingModule):
     name = "staging"
@@ -28,17 +54,47 @@ class Staging(ProcessingModule):
 
     @staticmethod
     def cli(args=None):
-        parser = argparse.ArgumentParser()
-        parser.add_argument("-s", "--subject-dir", type=Path, required=True)
-        parser.add_argument("--image-types", type=str, nargs="+", required=True)
+        parser = argparse.ArgumentParser(
+            epilog=(
+                "Gzip seek indexes of compressed images are stored outside the project, in "
+                "$XDG_CACHE_HOME/radifox/gzip-index (~/.cache/radifox/gzip-index by default). "
+                "Set RADIFOX_GZIP_INDEX_DIR to store them elsewhere, or to an empty value to "
+                "disable them."
+            )
+        )
+        parser.add_argument("-s", "--subject-dir", type=Path, default=None)
+        parser.add_argument("--image-types", type=str, nargs="+", default=None)
         parser.add_argument("--reg-filters", type=str, nargs="+", default=None)
         parser.add_argument("--keep-best-res", action="store_true", default=False)
         parser.add_argument("--update", action="store_true", default=False)
         parser.add_argument("--plugin-paths", type=Path, nargs="+", default=None)
         parser.add_argument("--skip-default-plugins", action="store_true", default=False)
+        parser.add_argument("--skip-plugin-discovery", action="store_true", default=False)
         parser.add_argument("--skip-set-sform", action="store_true", default=False)
+        parser.add_argument("-w", "--workers", type=int, default=1)
+        parser.add_argument("--uncompressed", action="store_true", default=False)
+        parser.add_argument("--prefetch-sessions", type=int, default=PREFETCH_SESSIONS)
+        parser.add_argument("--plan", type=Path, default=None)
+        parser.add_argument("--execute", type=Path, default=None)
+        parser.add_argument("--sessions", type=str, nargs="+", default=None)
         parsed = parser.parse_args(args)
 
+        if parsed.execute is not None:
+            # Staging options and session images come from the plan
+            if not parsed.execute.is_file():
+                parser.error(f"Staging plan ({parsed.execute}) does not exist.")
+            try:
+                return Staging.plan_to_args(
+                    json.loads(parsed.execute.read_text()),
+                    parsed.sessions,
+                    parsed.workers,
+                    parsed.prefetch_sessions,
+                )
+            except (KeyError, ValueError) as e:
+                parser.error(f"Invalid staging plan ({parsed.execute}): {e}")
+        if parsed.subject_dir is None or parsed.image_types is None:
+            parser.error("--subject-dir and --image-types are required (unless using --execute).")
+
         parsed.subject_dir = parsed.subject_dir.resolve()
         if not parsed.subject_dir.is_dir():
             parser.error(f"Subject directory ({parsed.subject_dir}) does not exist.")
@@ -71,23 +127,28 @@ class Staging(ProcessingModule):
             if not session.is_dir():
                 continue
             # Return an error if the session has already been staged
-            # If we are updating, skip sessions that already have staged images
+            # If we are updating, sessions with a staging manifest are updated incrementally
+            # and sessions staged without one are skipped
             if (session / "stage").exists():
                 if parsed.update:
                     if subject_target is None:
                         st_path = (session / "stage" / "subject-target")
                         if st_path.exists():
                             subject_target = ImageFile(st_path.resolve())
-                    continue
+                    if not StagingManifest.manifest_path(session).exists():
+                        continue
                 else:
                     parser.error(
                         'Session has already been staged. '
                         'Use "--update" to skip existing.'
                     )
             # Get all images in session "nii" directory, sort by reverse name and skip "ND"
-            # Avoid extra images by first grabbing jsons, then swapping exts
+            # Avoid extra images by first grabbing jsons, then swapping exts (.nii.gz or .nii)
             all_imgs = glob(session / "nii" / "*.json")
-            all_imgs = [img.parent / img.name.replace(".json", ".nii.gz") for img in all_imgs]
+            all_imgs = [
+                ImageFile(find_nifti(img.parent / img.name.replace(".json", "")))
+                for img in all_imgs
+            ]
             all_imgs = sorted(all_imgs, key=lambda x: x.name, reverse=True)
             all_imgs = [img for img in all_imgs if "ND" not in img.extras]
             if all_imgs:
@@ -101,16 +162,29 @@ class Staging(ProcessingModule):
                           "Subject target will be attempted from registration "
                           "filters if provided.")
 
-        return {
+        run_args = {
             "session_filepaths": list(session_imgs.values()),
             "image_types": [parsed.image_types] * len(session_imgs),
             "keep_best_res": [parsed.keep_best_res] * len(session_imgs),
             "reg_filters": [parsed.reg_filters] * len(session_imgs),
             "plugin_paths": [parsed.plugin_paths] * len(session_imgs),
             "skip_default_plugins": [parsed.skip_default_plugins] * len(session_imgs),
+            "skip_plugin_discovery": [parsed.skip_plugin_discovery] * len(session_imgs),
             "skip_set_sform": [parsed.skip_set_sform] * len(session_imgs),
             "subject_target": [subject_target] * len(session_imgs),
+            "workers": [parsed.workers] * len(session_imgs),
+            "uncompressed": [parsed.uncompressed] * len(session_imgs),
+            "prefetch": [parsed.prefetch_sessions] * len(session_imgs),
         }
+        if parsed.plan is not None:
+            # Only write the plan, staging is done later with --execute
+            plan = Staging.plan(**run_args)
+            parsed.plan.write_text(json.dumps(plan, indent=2))
+            logging.info(
+                f"Staging plan for {len(plan['sessions'])} session(s) written to {parsed.plan}."
+            )
+            return None
+        return run_args
 
     @staticmethod
     def run(
@@ -122,89 +196,56 @@ class Staging(ProcessingModule):
         skip_default_plugins: list[bool],
         skip_set_sform: list[bool],
         subject_target: list[ImageFile | None],
+        skip_plugin_discovery: list[bool] | None = None,
+        workers: list[int] | None = None,
+        uncompressed: list[bool] | None = None,
+        prefetch: list[int] | None = None,
     ):
+        if skip_plugin_discovery is None:
+            skip_plugin_discovery = [False] * len(session_filepaths)
+        # Per-session work runs on a thread pool, subject-level target selection runs after it
+        workers = 1 if not workers else workers[0]
+        # Serially, the next session's images are read ahead on a background thread
+        prefetch = PREFETCH_SESSIONS if not prefetch else prefetch[0]
         # For each session, find images that match the contrast filters
-        session_imgs = {}
-        for (
-            all_imgs,
-            img_filters,
-            best_res,
-            proc_plugin_paths,
-            skip_defaults,
-            skip_set_sform_qform,
-        ) in zip(
+        sessions = match_sessions(
             session_filepaths,
             image_types,
             keep_best_res,
             plugin_paths,
             skip_default_plugins,
             skip_set_sform,
-        ):
-            if not all_imgs:
-                continue
+            skip_plugin_discovery,
+        )
+        for session, *_ in sessions:
             # Create "stage" directory
-            session = all_imgs[0].parent.parent
             (session / "stage").mkdir(exist_ok=True, parents=True)
 
-            # Filter images by image filters
-            filtered_imgs = []
-            for img_filter in img_filters:
-                # Get a list of images that match the filter (continue if none)
-                imgs = img_filter.filter(all_imgs)
-                if not imgs:
-                    continue
+        # Staged and plugin outputs are uncompressed .nii if requested
+        with intermediate_ext(".nii" if uncompressed and uncompressed[0] else None):
+            # Run plugins over the matched images of every session together
+            run_plugins(
+                [imgs for _, filter_imgs, *_ in sessions for imgs in filter_imgs],
+                [plugins for _, filter_imgs, plugins, *_ in sessions for _ in filter_imgs],
+                workers,
+                [session for session, filter_imgs, *_ in sessions for _ in filter_imgs],
+                prefetch,
+            )
 
-                # Load plugins
-                proc_plugins = []
-                if proc_plugin_paths is not None:
-                    for plugin_path in proc_plugin_paths:
-                        proc_plugins.extend(load_plugins(plugin_path))
-                if not skip_defaults:
-                    proc_plugins.extend([MEMPRAGEPlugin, MP2RAGEPlugin])
-
-                for plugin in proc_plugins:
-                    plugin_imgs = plugin.filter(imgs)
-                    other_imgs = [img for img in imgs if img not in plugin_imgs]
-                    out_imgs = plugin.run(plugin_imgs)
-                    imgs = out_imgs + other_imgs
-
-                # Keep only the best resolution image from each contrast (if needed)
-                if best_res:
-                    # Get existing images in "stage" directory
-                    stage_imgs = [img for img in imgs if img.parent.name == "stage"]
-                    # If there is are 3D images, pick the one that is the "most isotropic"
-                    imgs_3d = ImageFilter(acqdim="3D").filter(imgs)
-                    if imgs_3d:
-                        # Select the image with the lowest anisotropy
-                        imgs = [pick_most_isotropic(imgs_3d)]
-                    else:
-                        # Sort images by slice spacing and/or slice thickness (select first)
-                        imgs = [pick_smallest_slices(imgs)]
-                    # Remove staged images that are not the best resolution
-                    for img in stage_imgs:
-                        if img not in imgs:
-                            logging.warning(
-                                f"Removing staged {img} because it is not the best image."
-                            )
-                            # img.path.unlink()
-                # Add image(s) to filtered image list
-                filtered_imgs.extend(imgs)
-            if not skip_set_sform_qform:
-                # Fix sform/qform of filtered images
-                filtered_imgs = [fix_sform_qform(img) for img in filtered_imgs]
-
-            # Remove staged images that are not in the filtered image list
-            for stage_img in (session / "stage").iterdir():
-                if stage_img.name not in [img.name for img in filtered_imgs]:
-                    stage_img.unlink()
-
-            if not filtered_imgs:
-                logging.warning(f"No matching images found for {session}. Skipping.")
-                (session / "stage").rmdir()
-                session_imgs[session] = None
-                continue
-            else:
-                session_imgs[session] = filtered_imgs
+            staged = map_sessions(
+                stage_session,
+                [
+                    (session, filter_imgs, best_res, skip_set_sform_qform)
+                    for session, filter_imgs, _, best_res, skip_set_sform_qform, _ in sessions
+                ],
+                workers,
+                [
+                    [img.path for imgs in filter_imgs for img in imgs]
+                    for _, filter_imgs, *_ in sessions
+                ],
+                prefetch,
+            )
+        session_imgs = {session: imgs for (session, *_), imgs in zip(sessions, staged)}
 
         reg_filters = reg_filters[0]
         if reg_filters is None:
@@ -213,41 +254,17 @@ class Staging(ProcessingModule):
             session_targets = {session: None for session in session_imgs}
             subject_target = None
         else:
-            # Subject targets are chosen over all sessions (first for tie)
-            # Session targets are chosen over all images in each session
-            # Ties in priority are resolved by resolution:
-            # 1. For 3D images, most isotropic
-            # 2. For 2D images, thinnest slice spacing
-            # Find session targets
-            session_targets: dict[Path, ImageFile] = {}
-            for session, imgs in session_imgs.items():
-                if imgs is None:
-                    continue
-                for reg_filter in reg_filters:
-                    # Currenly use private _filter_dict to check acqdim
-                    # Radifox should be updated to expose these parameters readonly
-                    best_func = (
-                        pick_most_isotropic if reg_filter.acqdim == "3D" else pick_smallest_slices
-                    )
-                    filtered = reg_filter.filter(imgs)
-                    if filtered:
-                        session_targets[session] = best_func(filtered)
-                        break
-
-            # Find subject target
-            subject_target = subject_target[0]
-            if subject_target is None:
-                for img_filter in reg_filters:
-                    filtered = img_filter.filter(list(session_targets.values()))
-                    if filtered:
-                        subject_target = filtered[0]
-                        break
+            session_targets, subject_target = select_targets(
+                session_imgs, reg_filters, subject_target[0]
+            )
 
             # Symlink target images
             for session, img in session_targets.items():
+                (session / "stage" / "session-target").unlink(missing_ok=True)
                 (session / "stage" / "session-target").symlink_to(
                     Path("..", img.path.relative_to(session))
                 )
+                (session / "stage" / "subject-target").unlink(missing_ok=True)
                 (session / "stage" / "subject-target").symlink_to(
                     Path("..", "..", subject_target.path.relative_to(session.parent))
                 )
@@ -278,17 +295,815 @@ class Staging(ProcessingModule):
             for session, imgs in session_imgs.items()
         ]
 
+    @staticmethod
+    def plan(
+        session_filepaths: list[list[ImageFile]],
+        image_types: list[list[ImageFilter]],
+        keep_best_res: list[bool],
+        plugin_paths: list[list[Path]],
+        reg_filters: list[list[ImageFilter] | None],
+        skip_default_plugins: list[bool],
+        skip_set_sform: list[bool],
+        subject_target: list[ImageFile | None],
+        skip_plugin_discovery: list[bool] | None = None,
+        workers: list[int] | None = None,
+        uncompressed: list[bool] | None = None,
+        prefetch: list[int] | None = None,
+    ) -> dict:
+        """
+        Compute what ``run`` would stage from image names and sidecars alone
+
+        Takes the same arguments as ``run`` and returns a JSON-serializable plan (paths relative
+        to each session): the matched image sets, the plugin steps with their predicted outputs,
+        the staged files and their sources, the files that will be removed from "stage" and the
+        registration targets. Plugins predict their outputs with ``StagingPlugin.plan``. A
+        session with a plugin that cannot is marked "deferred" and its staged files are decided
+        when the plan is executed.
+        """
+        if skip_plugin_discovery is None:
+            skip_plugin_discovery = [False] * len(session_filepaths)
+        sessions = match_sessions(
+            session_filepaths,
+            image_types,
+            keep_best_res,
+            plugin_paths,
+            skip_default_plugins,
+            skip_set_sform,
+            skip_plugin_discovery,
+        )
+        if not sessions:
+            raise ValueError("No images to plan.")
+        subject_dir = sessions[0][0].parent
+
+        session_plans, session_imgs = {}, {}
+        uncompressed = bool(uncompressed and uncompressed[0])
+        with intermediate_ext(".nii" if uncompressed else None):
+            for session, *session_args in sessions:
+                session_plan, staged = plan_session(session, *session_args)
+                session_plans[session.name] = session_plan
+                if not session_plan["deferred"]:
+                    session_imgs[session] = staged or None
+
+        target = None
+        if reg_filters[0] is not None:
+            session_targets, target = select_targets(
+                session_imgs, reg_filters[0], subject_target[0]
+            )
+            for session, img in session_targets.items():
+                session_plans[session.name]["session_target"] = _rel_paths(session, [img])[0]
+            # A deferred session could still provide the subject target
+            if subject_target[0] is None and any(
+                session_plan["deferred"] for session_plan in session_plans.values()
+            ):
+                target = None
+        return {
+            "version": STAGING_PLAN_VERSION,
+            "subject_dir": str(subject_dir),
+            "options": {
+                "image_types": [filter_to_string(f) for f in image_types[0]],
+                "keep_best_res": keep_best_res[0],
+                "reg_filters": (
+                    None if reg_filters[0] is None
+                    else [filter_to_string(f) for f in reg_filters[0]]
+                ),
+                "plugin_paths": (
+                    None if plugin_paths[0] is None else [str(path) for path in plugin_paths[0]]
+                ),
+                "skip_default_plugins": skip_default_plugins[0],
+                "skip_plugin_discovery": skip_plugin_discovery[0],
+                "skip_set_sform": skip_set_sform[0],
+                "uncompressed": uncompressed,
+            },
+            "sessions": session_plans,
+            "subject_target": None if target is None else _rel_paths(subject_dir, [target])[0],
+        }
+
+    @staticmethod
+    def plan_to_args(
+        plan: dict,
+        sessions: list[str] | None = None,
+        workers: int = 1,
+        prefetch: int = PREFETCH_SESSIONS,
+    ) -> dict:
+        """
+        Convert a staging plan (optionally a subset of its sessions) to ``run`` arguments
+
+        The sessions are planned again from the plan's inputs and options. A ``ValueError`` is
+        raised if an input is missing or if the plugins or staged files of a session no longer
+        match the plan (e.g. changed sidecars, plugins or options), so nothing is staged that
+        was not planned.
+        """
+        if plan.get("version") != STAGING_PLAN_VERSION:
+            raise ValueError(f"unsupported plan version {plan.get('version')}")
+        subject_dir = Path(plan["subject_dir"])
+        options = plan["options"]
+        sessions = list(plan["sessions"]) if sessions is None else sessions
+        for session in sessions:
+            if session not in plan["sessions"]:
+                raise ValueError(f"session {session} is not in the plan")
+        if (
+            plan["subject_target"] is None
+            and options["reg_filters"] is not None
+            and len(sessions) < len(plan["sessions"])
+        ):
+            warnings.warn("The plan has no subject target, so each subset of sessions "
+                          "executed separately will choose its own.")
+        subject_target = (
+            None if plan["subject_target"] is None
+            else ImageFile(subject_dir / plan["subject_target"])
+        )
+        image_types = [ImageFilter.from_string(f) for f in options["image_types"]]
+        reg_filters = (
+            None if options["reg_filters"] is None
+            else [ImageFilter.from_string(f) for f in options["reg_filters"]]
+        )
+        plugin_paths = (
+            None if options["plugin_paths"] is None
+            else [Path(path) for path in options["plugin_paths"]]
+        )
+        num = len(sessions)
+        run_args = {
+            "session_filepaths": [
+                [
+                    ImageFile(subject_dir / session / path)
+                    for path in plan["sessions"][session]["inputs"]
+                ]
+                for session in sessions
+            ],
+            "image_types": [image_types] * num,
+            "keep_best_res": [options["keep_best_res"]] * num,
+            "reg_filters": [reg_filters] * num,
+            "plugin_paths": [plugin_paths] * num,
+            "skip_default_plugins": [options["skip_default_plugins"]] * num,
+            "skip_plugin_discovery": [options["skip_plugin_discovery"]] * num,
+            "skip_set_sform": [options["skip_set_sform"]] * num,
+            "subject_target": [subject_target] * num,
+            "workers": [workers] * num,
+            "uncompressed": [options.get("uncompressed", False)] * num,
+            "prefetch": [prefetch] * num,
+        }
+        for session, imgs in zip(sessions, run_args["session_filepaths"]):
+            missing = [img.name for img in imgs if not img.path.exists()]
+            if missing:
+                raise ValueError(f"inputs of session {session} no longer exist: {missing}")
+        current = Staging.plan(**run_args)["sessions"]
+        for session in sessions:
+            for key in ("plugins", "staged"):
+                if current[session][key] != plan["sessions"][session][key]:
+                    raise ValueError(
+                        f"the {key} of session {session} no longer match the plan "
+                        f"(planned {plan['sessions'][session][key]}, "
+                        f"now {current[session][key]})"
+                    )
+        return run_args
+
+
+def match_sessions(
+    session_filepaths: list[list[ImageFile]],
+    image_types: list[list[ImageFilter]],
+    keep_best_res: list[bool],
+    plugin_paths: list[list[Path]],
+    skip_default_plugins: list[bool],
+    skip_set_sform: list[bool],
+    skip_plugin_discovery: list[bool],
+) -> list[tuple]:
+    """
+    Match each session's images to the image filters (by name only)
+
+    Returns:
+        list[tuple]: (session, filter_imgs, plugins, keep_best_res, skip_set_sform, all_imgs)
+            for each session with images
+    """
+    sessions = []
+    for (
+        all_imgs,
+        img_filters,
+        best_res,
+        proc_plugin_paths,
+        skip_defaults,
+        skip_set_sform_qform,
+        skip_discovery,
+    ) in zip(
+        session_filepaths,
+        image_types,
+        keep_best_res,
+        plugin_paths,
+        skip_default_plugins,
+        skip_set_sform,
+        skip_plugin_discovery,
+    ):
+        if not all_imgs:
+            continue
+        session = all_imgs[0].parent.parent
+
+        # Plugins are loaded once per process (cached by file/entry point)
+        proc_plugins = get_plugins(proc_plugin_paths, skip_defaults, skip_discovery)
+
+        # Get a list of images that match each filter (skip if none)
+        filter_imgs = [img_filter.filter(all_imgs) for img_filter in img_filters]
+        filter_imgs = [imgs for imgs in filter_imgs if imgs]
+        sessions.append(
+            (session, filter_imgs, proc_plugins, best_res, skip_set_sform_qform, all_imgs)
+        )
+    return sessions
+
+
+def plan_session(
+    session: Path,
+    filter_imgs: list[list[ImageFile]],
+    plugins: list[type[StagingPlugin]],
+    best_res: bool,
+    skip_set_sform_qform: bool,
+    all_imgs: list[ImageFile],
+) -> tuple[dict, list[ImageFile]]:
+    """Plan the staging of one session (see ``Staging.plan``), returning its staged images too."""
+    image_sets, planned_sets, deferred = [], [], False
+    for imgs in filter_imgs:
+        # Follow run_plugins: each plugin replaces the images it matched by its outputs
+        steps, current = [], list(imgs)
+        for plugin in plugins:
+            plugin_imgs = plugin.filter(current)
+            if not plugin_imgs:
+                continue
+            out_imgs = plugin.plan(plugin_imgs)
+            steps.append(
+                {
+                    "plugin": f"{plugin.__module__}:{plugin.__qualname__}",
+                    "inputs": _rel_paths(session, plugin_imgs),
+                    "outputs": None if out_imgs is None else _rel_paths(session, out_imgs),
+                }
+            )
+            if out_imgs is None:
+                deferred = True
+                break
+            current = out_imgs + [img for img in current if img not in plugin_imgs]
+        image_sets.append({"images": _rel_paths(session, imgs), "steps": steps})
+        planned_sets.append(current)
+    session_plan = {
+        "inputs": _rel_paths(session, all_imgs),
+        "plugins": [f"{plugin.__module__}:{plugin.__qualname__}" for plugin in plugins],
+        "image_sets": image_sets,
+        "deferred": deferred,
+        "staged": None,
+        "removals": None,
+        "session_target": None,
+    }
+    if deferred:
+        return session_plan, []
+    selected = select_images(planned_sets, best_res)
+    staged = [
+        (img.path if skip_set_sform_qform else sform_qform_path(img), img.path) for img in selected
+    ]
+    session_plan["staged"] = [
+        {"path": out_rel, "source": src_rel}
+        for out_rel, src_rel in zip(
+            _rel_paths(session, [out for out, _ in staged]),
+            _rel_paths(session, [src for _, src in staged]),
+        )
+    ]
+    staged_names = [out.name for out, _ in staged]
+    stage_dir = session / "stage"
+    session_plan["removals"] = _rel_paths(
+        session,
+        sorted(path for path in stage_dir.iterdir() if path.name not in staged_names)
+        if stage_dir.is_dir() else [],
+    )
+    return session_plan, [ImageFile(out) for out, _ in staged]
+
+
+def _rel_paths(root: Path, imgs: list[ImageFile | Path]) -> list[str]:
+    paths = [img.path if isinstance(img, ImageFile) else img for img in imgs]
+    return [path.relative_to(root).as_posix() for path in paths]
+
+
+def select_images(filter_imgs: list[list[ImageFile]], best_res: bool) -> list[ImageFile]:
+    """Combine the images matched by each filter, keeping only the best resolution if needed."""
+    # Filter images by image filters
+    filtered_imgs = []
+    for imgs in filter_imgs:
+        # Keep only the best resolution image from each contrast (if needed)
+        if best_res:
+            # Get existing images in "stage" directory
+            stage_imgs = [img for img in imgs if img.parent.name == "stage"]
+            # If there is are 3D images, pick the one that is the "most isotropic"
+            imgs_3d = ImageFilter(acqdim="3D").filter(imgs)
+            if imgs_3d:
+                # Select the image with the lowest anisotropy
+                imgs = [pick_most_isotropic(imgs_3d)]
+            else:
+                # Sort images by slice spacing and/or slice thickness (select first)
+                imgs = [pick_smallest_slices(imgs)]
+            # Remove staged images that are not the best resolution
+            for img in stage_imgs:
+                if img not in imgs:
+                    logging.warning(f"Removing staged {img} because it is not the best image.")
+                    # img.path.unlink()
+        # Add image(s) to filtered image list
+        filtered_imgs.extend(imgs)
+    return filtered_imgs
+
+
+def select_targets(
+    session_imgs: dict[Path, list[ImageFile] | None],
+    reg_filters: list[ImageFilter],
+    subject_target: ImageFile | None = None,
+) -> tuple[dict[Path, ImageFile], ImageFile | None]:
+    """Choose the registration target of each session and of the subject (unless given)."""
+    # Subject targets are chosen over all sessions (first for tie)
+    # Session targets are chosen over all images in each session
+    # Ties in priority are resolved by resolution:
+    # 1. For 3D images, most isotropic
+    # 2. For 2D images, thinnest slice spacing
+    # Find session targets
+    session_targets: dict[Path, ImageFile] = {}
+    for session, imgs in session_imgs.items():
+        if imgs is None:
+            continue
+        for reg_filter in reg_filters:
+            # Currenly use private _filter_dict to check acqdim
+            # Radifox should be updated to expose these parameters readonly
+            best_func = pick_most_isotropic if reg_filter.acqdim == "3D" else pick_smallest_slices
+            filtered = reg_filter.filter(imgs)
+            if filtered:
+                session_targets[session] = best_func(filtered)
+                break
+
+    # Find subject target
+    if subject_target is None:
+        for img_filter in reg_filters:
+            filtered = img_filter.filter(list(session_targets.values()))
+            if filtered:
+                subject_target = filtered[0]
+                break
+    return session_targets, subject_target
+
+
+def filter_to_string(img_filter: ImageFilter) -> str:
+    """Format an image filter so that ``ImageFilter.from_string`` reads it back."""
+    items = []
+    for key, value in img_filter._filter_dict.items():
+        if callable(value):
+            raise ValueError(f"Cannot write the callable {key} filter of {img_filter}.")
+        if isinstance(value, (list, tuple)):
+            value = f"[{','.join(value)}]"
+        items.append(f"{key}={value}")
+    return ";".join(items)
+
+
+def stage_session(
+    session: Path,
+    filter_imgs: list[list[ImageFile]],
+    best_res: bool,
+    skip_set_sform_qform: bool,
+) -> list[ImageFile] | None:
+    """Select, conform and clean up the staged images of one session (None if none match)."""
+    filtered_imgs = select_images(filter_imgs, best_res)
+    if not skip_set_sform_qform:
+        # Fix sform/qform of filtered images
+        filtered_imgs = [fix_sform_qform(img) for img in filtered_imgs]
+
+    # Staged intermediates that were up to date but removed in an earlier run are built now
+    StagingManifest.for_session(session).build_deferred([img.path for img in filtered_imgs])
+
+    # Remove staged images that are not in the filtered image list
+    for stage_img in (session / "stage").iterdir():
+        if stage_img.name not in [img.name for img in filtered_imgs]:
+            stage_img.unlink()
+    StagingManifest.close(session, keep=[img.name for img in filtered_imgs])
+
+    if not filtered_imgs:
+        logging.warning(f"No matching images found for {session}. Skipping.")
+        (session / "stage").rmdir()
+        return None
+    return filtered_imgs
+
+
+class _ThreadLogBuffer:
+    """
+    Handler filters that hold back records from threads with an active buffer
+
+    The filters are added to handlers (not loggers), so records of named loggers that
+    propagate to the handlers are held back too. Each record is kept with the handler that
+    received it and is replayed to that handler.
+
+    Params:
+        handlers (list[logging.Handler]): handlers to hold records back from
+    """
+
+    def __init__(self, handlers: list[logging.Handler]) -> None:
+        self.local = threading.local()
+        self.filters = {handler: functools.partial(self.hold, handler) for handler in handlers}
+
+    def __enter__(self) -> _ThreadLogBuffer:
+        for handler, log_filter in self.filters.items():
+            handler.addFilter(log_filter)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for handler, log_filter in self.filters.items():
+            handler.removeFilter(log_filter)
+
+    def hold(self, handler: logging.Handler, record: logging.LogRecord) -> bool:
+        records = getattr(self.local, "records", None)
+        if records is None:
+            return True
+        records.append((handler, record))
+        return False
+
+    @staticmethod
+    def replay(records: list[tuple[logging.Handler, logging.LogRecord]]) -> None:
+        for handler, record in records:
+            handler.handle(record)
+
+    def call(
+        self, func, *args
+    ) -> tuple[list[tuple[logging.Handler, logging.LogRecord]], object, BaseException | None]:
+        self.local.records = []
+        try:
+            return self.local.records, func(*args), None
+        except BaseException as e:
+            return self.local.records, None, e
+        finally:
+            self.local.records = None
+
+
+def map_sessions(
+    func,
+    items: list[tuple],
+    workers: int = 1,
+    prefetch_files: list[list[Path]] | None = None,
+    prefetch: int = 0,
+) -> list:
+    """
+    Call ``func(*item)`` for each item on a thread pool and return the results in order
+
+    Log records of each call are held back and replayed in item order, so the log reads as if
+    the items ran one after another. The first failing item's error is raised after the logs of
+    the items before it (and its own) have been replayed.
+
+    Items run one after another if ``workers`` is 1. The files of the next ``prefetch`` items
+    (``prefetch_files``) are then read into the page cache by a ``PageCacheWarmer`` (a thread
+    pool already overlaps reading with computation).
+    """
+    if workers <= 1 or len(items) <= 1:
+        if not prefetch or not prefetch_files or len(items) <= 1:
+            return [func(*item) for item in items]
+        results = []
+        with PageCacheWarmer(prefetch_files, prefetch) as warmer:
+            for i, item in enumerate(items):
+                warmer.advance(i)
+                results.append(func(*item))
+        return results
+    with (
+        _ThreadLogBuffer(logging.getLogger().handlers) as log_buffer,
+        ThreadPoolExecutor(max_workers=workers) as executor,
+    ):
+        futures = [executor.submit(log_buffer.call, func, *item) for item in items]
+        results = []
+        for future in futures:
+            records, result, error = future.result()
+            log_buffer.replay(records)
+            if error is not None:
+                for pending in futures:
+                    pending.cancel()
+                raise error
+            results.append(result)
+    return results
+
+
+class PageCacheWarmer:
+    """
+    Warm the OS page cache with the files of upcoming sessions on a background thread
+
+    The compressed files are read in blocks and discarded, so network storage latency is paid
+    before the session is staged and its reads come from the page cache. Nothing is decoded or
+    handed to the stager: decompression still happens when the session is staged. Memory use
+    stays at one block.
+
+    Params:
+        file_sets (list[list[Path]]): files of each session, in staging order
+        depth (int): number of sessions read ahead of the current one
+        max_bytes (int | None): bytes read per session (``RADIFOX_PREFETCH_BYTES`` if None)
+    """
+
+    block_size = 2**20
+
+    def __init__(
+        self, file_sets: list[list[Path]], depth: int = 1, max_bytes: int | None = None
+    ) -> None:
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("RADIFOX_PREFETCH_BYTES", PREFETCH_BYTES))
+        self.file_sets = file_sets
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.warmed: dict[int, int] = {}
+        self._current = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._warm, daemon=True)
+
+    def __enter__(self) -> PageCacheWarmer:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def advance(self, index: int) -> None:
+        """Mark session ``index`` as being staged (allowing the next ``depth`` to be read)."""
+        with self._cond:
+            self._current = index
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _warm(self) -> None:
+        buffer = memoryview(bytearray(self.block_size))
+        for index, files in enumerate(self.file_sets):
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or index <= self._current + self.depth
+                )
+                if self._closed:
+                    return
+                # Too late for a session that is already being staged
+                if index <= self._current:
+                    continue
+            nbytes = 0
+            for path in files:
+                try:
+                    with open(path, "rb", buffering=0) as fobj:
+                        while nbytes < self.max_bytes and not self._closed:
+                            read = fobj.readinto(buffer[: self.max_bytes - nbytes])
+                            if not read:
+                                break
+                            nbytes += read
+                except OSError:
+                    continue
+            self.warmed[index] = nbytes
+
 
 def fix_sform_qform(img: ImageFile) -> ImageFile:
-    """Conform the qform/sform matrix of an image header."""
-    out_fpath = img.parent.parent / "stage" / f"{img.stem}_hdrfix.nii.gz"
-    obj = nib.Nifti1Image.load(img.path)
-    obj.set_qform(obj.get_sform(), 2)
-    obj.set_sform(obj.get_qform(), 1)
-    obj.to_filename(out_fpath)
+    """
+    Conform the qform/sform matrix of an image header.
+
+    Only the header is read. If it is already conformant (equal sform/qform with codes 1/2),
+    the file is cloned into "stage" (reflink, then hardlink, then copy). Otherwise the header
+    is patched and the voxel bytes are streamed through unchanged. Staged files are always
+    replaced (never written in place), so a hardlink never modifies the source image.
+    """
+    return stage_output(
+        sform_qform_path(img), [img.path], "fix_sform_qform", {}, write_sform_qform
+    )
+
+
+def sform_qform_path(img: ImageFile) -> Path:
+    """Staged path of an image with a conformed sform/qform."""
+    return img.parent.parent / "stage" / f"{img.stem}_hdrfix{get_intermediate_ext()}"
+
+
+def write_sform_qform(out_fpath: Path, in_fpath: Path) -> None:
+    with nib.openers.ImageOpener(in_fpath) as fobj:
+        hdr = nib.Nifti1Header.from_fileobj(fobj)
+        compressed = out_fpath.name.endswith(".gz")
+        if is_conformant(hdr) and in_fpath.name.endswith(".gz") == compressed:
+            method = clone_file(in_fpath, out_fpath)
+            index = GzipIndex.load(in_fpath) if compressed else None
+            if index is not None:
+                index.save(out_fpath)
+            logging.debug(f"Header of {in_fpath} is conformant, staged by {method}.")
+            return
+        hdr.set_qform(hdr.get_sform(), 2)
+        hdr.set_sform(hdr.get_qform(), 1)
+        tmp_fpath = out_fpath.with_name(f".{out_fpath.name}.tmp")
+        with (
+            ParallelGzipWriter(tmp_fpath, index_name=out_fpath)
+            if compressed
+            else open(tmp_fpath, "wb")
+        ) as out_fobj:
+            hdr.write_to(out_fobj)
+            vox_offset = int(hdr.get_data_offset())
+            out_fobj.write(b"\x00" * (vox_offset - out_fobj.tell()))
+            fobj.seek(vox_offset)
+            shutil.copyfileobj(fobj, out_fobj, 2**20)
+    tmp_fpath.replace(out_fpath)
+
+
+def stage_output(
+    out_fpath: Path,
+    sources: list[Path],
+    producer: str,
+    params: dict,
+    build,
+) -> ImageFile:
+    """
+    Build a staged output with ``build(out_fpath, *sources)`` unless it is up to date
+
+    The output is current if the session's staging manifest has an entry for it with the same
+    producer, parameters and source files (size/mtime, or hash if those changed) and the
+    output itself has not changed since it was recorded.
+
+    An intermediate output (e.g. a plugin output that was header-fixed) is removed once the
+    session is staged. If its entry is otherwise current, it is not rebuilt but deferred: it is
+    only built (see ``StagingManifest.build_deferred``) if an output made from it is rebuilt or
+    it is staged itself.
+    """
+    manifest = StagingManifest.for_session(out_fpath.parent.parent)
+    if manifest.is_current(out_fpath, sources, producer, params):
+        logging.info(f"{out_fpath.name} is up to date. Skipping.")
+    elif manifest.is_current(out_fpath, sources, producer, params, removed=True):
+        logging.info(f"{out_fpath.name} is up to date (removed intermediate). Skipping.")
+        manifest.deferred[out_fpath.name] = (out_fpath, sources, producer, params, build)
+    else:
+        manifest.build_deferred(sources)
+        build(out_fpath, *sources)
+        manifest.record(out_fpath, sources, producer, params)
     return ImageFile(out_fpath)
 
 
+class StagingManifest:
+    """
+    Record of how each staged file of a session was produced
+
+    Stored as "<subject>_<session>_StagingManifest.json" in the session directory. Each entry
+    maps a staged filename to its producer, parameters, source files (size, mtime, hash) and
+    output digest. Entries of removed intermediates that staged files were made from are kept,
+    so that they are not rebuilt on the next update. Manifests are cached per session until
+    ``close`` writes them.
+
+    Params:
+        session (Path): session directory
+        entries (dict[str, dict]): manifest entries by staged filename
+        deferred (dict[str, tuple]): current, removed intermediates that were not rebuilt
+            (output path and ``stage_output`` arguments by filename)
+    """
+
+    _open: dict[Path, StagingManifest] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, session: Path) -> None:
+        self.session = session
+        try:
+            manifest = json.loads(self.manifest_path(session).read_text())
+            self.entries = manifest.get("entries", {})
+        except (OSError, ValueError):
+            self.entries = {}
+        self.deferred: dict[str, tuple] = {}
+
+    @staticmethod
+    def manifest_path(session: Path) -> Path:
+        return session / f"{session.parent.name}_{session.name}_StagingManifest.json"
+
+    @classmethod
+    def for_session(cls, session: Path) -> StagingManifest:
+        with cls._lock:
+            if session not in cls._open:
+                cls._open[session] = cls(session)
+            return cls._open[session]
+
+    @classmethod
+    def close(cls, session: Path, keep: list[str] | None = None) -> None:
+        """
+        Write a session's manifest
+
+        If ``keep`` is given, only the entries of those files and of the staged intermediates
+        they were made from are kept.
+        """
+        with cls._lock:
+            manifest = cls._open.pop(session, None) or cls(session)
+        if keep is not None:
+            keep, pending = set(keep), list(keep)
+            while pending:
+                for src in manifest.entries.get(pending.pop(), {}).get("sources", []):
+                    src_path = PurePosixPath(src["path"])
+                    if src_path.parent.as_posix() == "stage" and src_path.name not in keep:
+                        keep.add(src_path.name)
+                        pending.append(src_path.name)
+            manifest.entries = {k: v for k, v in manifest.entries.items() if k in keep}
+        manifest.save()
+
+    def save(self) -> None:
+        out_path = self.manifest_path(self.session)
+        tmp_path = out_path.with_name(f".{out_path.name}.tmp")
+        tmp_path.write_text(json.dumps({"entries": self.entries}, indent=2, sort_keys=True))
+        tmp_path.replace(out_path)
+
+    def is_current(
+        self,
+        out_fpath: Path,
+        sources: list[Path],
+        producer: str,
+        params: dict,
+        removed: bool = False,
+    ) -> bool:
+        """Check an output against its entry (as a removed intermediate if ``removed``)."""
+        entry = self.entries.get(out_fpath.name)
+        if (
+            entry is None
+            or entry["producer"] != producer
+            or entry["params"] != json.loads(json.dumps(params))
+            or [src["path"] for src in entry["sources"]] != [self._rel(p) for p in sources]
+        ):
+            return False
+        if removed:
+            if out_fpath.exists():
+                return False
+        elif not self._matches(out_fpath, entry["output"]):
+            return False
+        return all(
+            self._matches(Path(path), record) or self._is_deferred(Path(path), record)
+            for path, record in zip(sources, entry["sources"])
+        )
+
+    def build_deferred(self, paths: list[Path]) -> None:
+        """Build the deferred intermediates among ``paths`` (and those they are made from)."""
+        for path in paths:
+            deferred = self.deferred.pop(Path(path).name, None)
+            if deferred is None or Path(path) != deferred[0]:
+                continue
+            out_fpath, sources, producer, params, build = deferred
+            self.build_deferred(sources)
+            build(out_fpath, *sources)
+            self.record(out_fpath, sources, producer, params)
+
+    def record(self, out_fpath: Path, sources: list[Path], producer: str, params: dict) -> None:
+        self.entries[out_fpath.name] = {
+            "producer": producer,
+            "params": json.loads(json.dumps(params)),
+            "sources": [{"path": self._rel(path), **self._stat(path)} for path in sources],
+            "output": self._stat(out_fpath),
+        }
+
+    def _rel(self, path: Path) -> str:
+        return Path(os.path.relpath(path, self.session)).as_posix()
+
+    @staticmethod
+    def _stat(path: Path) -> dict:
+        stat = Path(path).stat()
+        return {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": hash_file(Path(path), include_names=False),
+        }
+
+    def _is_deferred(self, path: Path, record: dict) -> bool:
+        # A deferred source matches if the recorded output it was built as is the same
+        return (
+            path.name in self.deferred
+            and self.entries[path.name]["output"]["sha256"] == record["sha256"]
+        )
+
+    @staticmethod
+    def _matches(path: Path, record: dict) -> bool:
+        # Size and mtime are checked first; a touched but identical file is matched by hash
+        try:
+            stat = path.stat()
+        except OSError:
+            return False
+        if stat.st_size != record["size"]:
+            return False
+        if stat.st_mtime_ns != record["mtime_ns"]:
+            if hash_file(path, include_names=False) != record["sha256"]:
+                return False
+            record["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+
+def is_conformant(hdr: nib.Nifti1Header, atol: float = 1e-4) -> bool:
+    """Check if a header already has matching sform/qform (sform code 1, qform code 2)."""
+    sform, sform_code = hdr.get_sform(coded=True)
+    qform, qform_code = hdr.get_qform(coded=True)
+    return (
+        int(sform_code) == 1
+        and int(qform_code) == 2
+        and np.allclose(sform, qform, rtol=0, atol=atol)
+    )
+
+
+def clone_file(src: Path, dst: Path) -> str:
+    """Clone a file as a reflink, hardlink or copy (first that works). Returns the method."""
+    dst.unlink(missing_ok=True)
+    try:
+        import fcntl
+
+        with open(src, "rb") as src_fobj, open(dst, "wb") as dst_fobj:
+            fcntl.ioctl(dst_fobj.fileno(), FICLONE, src_fobj.fileno())
+        return "reflink"
+    except (ImportError, OSError):
+        dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        shutil.copyfile(src, dst)
+        return "copy"
+
+
 def pick_most_isotropic(imgs: list[ImageFile]) -> ImageFile:
     """Pick the most isotropic image from a list of images."""
     # Return first image if only one image
@@ -314,14 +1129,64 @@ def pick_smallest_slices(imgs: list[ImageFile]) -> ImageFile:
     )[0]
 
 
-def load_plugins(plugin_path: Path) -> list[StagingPlugin]:
-    """Load plugins from a plugin file."""
+_plugin_file_registry: dict[Path, list[type[StagingPlugin]]] = {}
+_entry_point_registry: list[type[StagingPlugin]] | None = None
+
+
+def load_plugins(plugin_path: Path) -> list[type[StagingPlugin]]:
+    """Load plugins from a plugin file (each file is executed once per process)."""
+    plugin_path = Path(plugin_path).resolve()
+    if plugin_path in _plugin_file_registry:
+        return _plugin_file_registry[plugin_path]
+    start = time.perf_counter()
     # Get the module name from the plugin file name
     spec = importlib.util.spec_from_file_location(plugin_path.stem, plugin_path)
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
 
     # Inspect the module and find all subclasses of the specified base class
+    plugins = find_plugin_classes(module)
+    _plugin_file_registry[plugin_path] = plugins
+    logging.info(
+        f"Loaded {len(plugins)} staging plugin(s) from {plugin_path} "
+        f"in {time.perf_counter() - start:.3f}s."
+    )
+    return plugins
+
+
+def load_entry_point_plugins() -> list[type[StagingPlugin]]:
+    """Load plugins advertised by installed packages (once per process)."""
+    global _entry_point_registry
+    if _entry_point_registry is not None:
+        return _entry_point_registry
+    plugins = []
+    for entry_point in importlib.metadata.entry_points(group=PLUGIN_ENTRY_POINT_GROUP):
+        start = time.perf_counter()
+        try:
+            obj = entry_point.load()
+        except Exception as e:
+            logging.warning(f"Could not load staging plugin entry point {entry_point.name}: {e}")
+            continue
+        if inspect.ismodule(obj):
+            found = find_plugin_classes(obj)
+        elif inspect.isclass(obj) and issubclass(obj, StagingPlugin):
+            found = [obj]
+        else:
+            logging.warning(
+                f"Staging plugin entry point {entry_point.name} is not a StagingPlugin or module."
+            )
+            continue
+        plugins.extend(found)
+        logging.info(
+            f"Loaded {len(found)} staging plugin(s) from entry point {entry_point.name} "
+            f"in {time.perf_counter() - start:.3f}s."
+        )
+    _entry_point_registry = plugins
+    return plugins
+
+
+def find_plugin_classes(module) -> list[type[StagingPlugin]]:
+    """Find all concrete subclasses of StagingPlugin in a module."""
     return [
         member
         for name, member in inspect.getmembers(module, inspect.isclass)
@@ -329,7 +1194,105 @@ def load_plugins(plugin_path: Path) -> list[StagingPlugin]:
     ]
 
 
+def get_plugins(
+    plugin_paths: list[Path] | None = None,
+    skip_defaults: bool = False,
+    skip_discovery: bool = False,
+) -> list[type[StagingPlugin]]:
+    """
+    Collect staging plugins in run order (plugin files, entry points, then defaults)
+
+    A plugin class found more than once (e.g. imported into several plugin files) is only
+    run the first time it appears.
+    """
+    plugins = []
+    for plugin_path in plugin_paths or []:
+        plugins.extend(load_plugins(plugin_path))
+    if not skip_discovery:
+        plugins.extend(load_entry_point_plugins())
+    if not skip_defaults:
+        plugins.extend([MEMPRAGEPlugin, MP2RAGEPlugin])
+    return list(dict.fromkeys(plugins))
+
+
+def run_plugins(
+    image_sets: list[list[ImageFile]],
+    plugin_lists: list[list[type[StagingPlugin]]],
+    workers: int = 1,
+    groups: list | None = None,
+    prefetch: int = 0,
+) -> None:
+    """
+    Run plugins over image sets (one per session and image filter), in place
+
+    Each image set is passed through its own plugin list in order. At each step, the sets
+    that use the same plugin are handed to a single ``run_batch`` call. Every plugin's
+    ``setup`` is called once before the first step and ``teardown`` once after the last.
+
+    Plugins that keep the default ``run_batch`` have ``run`` called on a pool of ``workers``
+    threads instead, one task per group (e.g. session) so that the sets of a group, which may
+    write the same outputs, still run one after another. With one worker, the images of the
+    next ``prefetch`` groups are read into the page cache (see ``map_sessions``).
+    """
+    groups = list(range(len(image_sets))) if groups is None else groups
+    all_plugins = list(dict.fromkeys(plugin for plugins in plugin_lists for plugin in plugins))
+    started = []
+    try:
+        for plugin in all_plugins:
+            plugin.setup()
+            started.append(plugin)
+        for step in range(max((len(plugins) for plugins in plugin_lists), default=0)):
+            batches = {}
+            for i, plugins in enumerate(plugin_lists):
+                if step < len(plugins):
+                    batches.setdefault(plugins[step], []).append(i)
+            for plugin, set_idxs in batches.items():
+                plugin_sets = [plugin.filter(image_sets[i]) for i in set_idxs]
+                default_batch = (
+                    getattr(plugin.run_batch, "__func__", None) is StagingPlugin.run_batch.__func__
+                )
+                if default_batch:
+                    group_sets = {}
+                    for i, plugin_imgs in zip(set_idxs, plugin_sets):
+                        group_sets.setdefault(groups[i], []).append(plugin_imgs)
+                    group_outs = map_sessions(
+                        plugin.run_batch,
+                        [(sets,) for sets in group_sets.values()],
+                        workers,
+                        [
+                            [img.path for imgs in sets for img in imgs]
+                            for sets in group_sets.values()
+                        ],
+                        prefetch,
+                    )
+                    group_outs = dict(zip(group_sets, map(iter, group_outs)))
+                    out_sets = [next(group_outs[groups[i]]) for i in set_idxs]
+                else:
+                    out_sets = plugin.run_batch(plugin_sets)
+                if len(out_sets) != len(plugin_sets):
+                    raise ValueError(
+                        f"{plugin.__name__}.run_batch returned {len(out_sets)} image sets "
+                        f"for {len(plugin_sets)} inputs."
+                    )
+                for i, plugin_imgs, out_imgs in zip(set_idxs, plugin_sets, out_sets):
+                    other_imgs = [img for img in image_sets[i] if img not in plugin_imgs]
+                    image_sets[i][:] = out_imgs + other_imgs
+    finally:
+        for plugin in reversed(started):
+            plugin.teardown()
+
+
 class StagingPlugin(ABC):
+    """
+    Base class for staging plugins
+
+    ``filter`` and ``run`` are called for the matched images of each session and image filter.
+    Plugins with expensive initialization or that can vectorize across sessions can also
+    override the lifecycle hooks: ``setup`` (once per staging run, before any images),
+    ``run_batch`` (every session's images together) and ``teardown`` (once, after the run).
+    ``plan`` predicts the outputs of ``run`` for ``radifox-stage --plan``.
+    """
+
     @staticmethod
     @abstractmethod
     def filter(images: list[ImageFile]) -> list[ImageFile]:
@@ -340,6 +1303,24 @@ class StagingPlugin(ABC):
     def run(images: list[ImageFile]) -> list[ImageFile]:
         raise NotImplementedError
 
+    @classmethod
+    def setup(cls) -> None:
+        """Prepare shared state (e.g. load a lookup table or model) once per staging run."""
+
+    @classmethod
+    def run_batch(cls, image_sets: list[list[ImageFile]]) -> list[list[ImageFile]]:
+        """Process the filtered images of several sessions (defaults to ``run`` on each)."""
+        return [cls.run(images) for images in image_sets]
+
+    @classmethod
+    def teardown(cls) -> None:
+        """Release shared state created in ``setup``."""
+
+    @classmethod
+    def plan(cls, images: list[ImageFile]) -> list[ImageFile] | None:
+        """Predict the output images of ``run`` from names and sidecars (None if unknown)."""
+        return None
+
     @staticmethod
     def sort_by_series(imgs: list[ImageFile]) -> list[list[ImageFile]]:
         """Sort images by series ID and return a list of images for each series ID."""
@@ -352,6 +1333,8 @@ class StagingPlugin(ABC):
 
 
 class MEMPRAGEPlugin(StagingPlugin):
+    slab_bytes = 2**25
+
     @staticmethod
     def filter(images: list[ImageFile]) -> list[ImageFile]:
         return ImageFilter(
@@ -372,21 +1355,63 @@ class MEMPRAGEPlugin(StagingPlugin):
                 out_imgs.append(MEMPRAGEPlugin.sum_memprage(img_set))
         return out_imgs
 
+    @staticmethod
+    def plan(images: list[ImageFile]) -> list[ImageFile]:
+        out_imgs = []
+        for img_set in MEMPRAGEPlugin.sort_by_series(images):
+            sum_imgs = [img for img in img_set if "SUM" in img.extras]
+            if sum_imgs:
+                out_imgs.append(sum_imgs[0])
+            else:
+                out_imgs.append(ImageFile(MEMPRAGEPlugin.sum_path(img_set)))
+        return out_imgs
+
+    @staticmethod
+    def sum_path(imgs: list[ImageFile]) -> Path:
+        temp_img = sorted(imgs, key=lambda x: x.name)[0]
+        stage_dir = temp_img.path.parent.parent / "stage"
+        return stage_dir / f"{temp_img.stem}_sum{get_intermediate_ext()}"
+
     @staticmethod
     def sum_memprage(imgs: list[ImageFile]) -> ImageFile:
         """Create a sum image from a list of MEMPRAGE echo images."""
-        temp_img = sorted(imgs, key=lambda x: x.name)[0]
-        out_fpath = temp_img.path.parent.parent / "stage" / f"{temp_img.stem}_sum.nii.gz"
-        obj = nib.load(temp_img.path)
-        sum_data = np.sum(
-            [nib.Nifti1Image.load(img.path).get_fdata(dtype=np.float32) for img in imgs], axis=0
+        imgs = sorted(imgs, key=lambda x: x.name)
+        return stage_output(
+            MEMPRAGEPlugin.sum_path(imgs),
+            [img.path for img in imgs],
+            "MEMPRAGEPlugin.sum_memprage",
+            {},
+            MEMPRAGEPlugin.write_memprage_sum,
         )
-        nib.Nifti1Image(sum_data, None, obj.header).to_filename(out_fpath)
-        return ImageFile(out_fpath)
+
+    @staticmethod
+    def write_memprage_sum(out_fpath: Path, *echo_fpaths: Path) -> None:
+        sum_data, header = MEMPRAGEPlugin.sum_echoes(echo_fpaths)
+        save_nifti(nib.Nifti1Image(sum_data, None, header), out_fpath)
+
+    @staticmethod
+    def sum_echoes(echo_fpaths: list[Path]) -> tuple[np.ndarray, nib.Nifti1Header]:
+        """
+        Sum echo images into one float32 volume (returned with the first echo's header).
+
+        Echoes are added in order (as ``np.sum`` over the echo axis does), slab by slab from
+        the data proxies into one buffer, so peak memory is about one volume.
+        """
+        objs = [load_nifti(path, keep_file_open=True) for path in echo_fpaths]
+        sum_data = np.empty(objs[0].shape, dtype=np.float32)
+        plane_bytes = int(np.prod(objs[0].shape[:2])) * 8
+        step = max(1, MEMPRAGEPlugin.slab_bytes // plane_bytes)
+        for z0 in range(0, objs[0].shape[2], step):
+            slab = (slice(None), slice(None), slice(z0, z0 + step))
+            sum_data[slab] = objs[0].dataobj[slab]
+            for obj in objs[1:]:
+                sum_data[slab] += np.asarray(obj.dataobj[slab], dtype=np.float32)
+        return sum_data, objs[0].header
 
 
 class MP2RAGEPlugin(StagingPlugin):
     CMPLX_IMG_TYPES = ("MAG", "PHA", "REA", "IMA")
+    slab_bytes = 2**25
 
     @staticmethod
     def filter(images: list[ImageFile]) -> list[ImageFile]:
@@ -403,9 +1428,28 @@ class MP2RAGEPlugin(StagingPlugin):
             out_imgs.append(MP2RAGEPlugin.create_uniden(img_set))
         return out_imgs
 
+    @staticmethod
+    def plan(images: list[ImageFile]) -> list[ImageFile]:
+        return [
+            ImageFile(MP2RAGEPlugin.uniden_inputs(img_set)[2])
+            for img_set in MP2RAGEPlugin.sort_by_series(images)
+        ]
+
     @staticmethod
     def create_uniden(imgs: list[ImageFile], gamma: float = 1e9) -> ImageFile:
         """Create an UNIDEN (denoised uniform) image from the MP2RAGE complex component images."""
+        components, sources, out_fpath = MP2RAGEPlugin.uniden_inputs(imgs)
+        return stage_output(
+            out_fpath,
+            sources,
+            "MP2RAGEPlugin.create_uniden",
+            {"gamma": gamma, "components": list(components)},
+            functools.partial(MP2RAGEPlugin.write_uniden, components=components, gamma=gamma),
+        )
+
+    @staticmethod
+    def uniden_inputs(imgs: list[ImageFile]) -> tuple[tuple[str, str], list[Path], Path]:
+        """Find the UNIDEN components, sources (INV1 a/b, INV2 a/b) and output path."""
         img_dict = defaultdict(list)
         for img in imgs:
             inv = next(ex for ex in img.extras if "INV" in ex)
@@ -413,35 +1457,100 @@ class MP2RAGEPlugin(StagingPlugin):
                 (ct for ct in MP2RAGEPlugin.CMPLX_IMG_TYPES if ct in img.extras), "MAG"
             )
             img_dict[f"{inv}-{cmplx_type}"].append(img)
-        data = {
-            key: nib.Nifti1Image.load(img_dict[key][0].path).get_fdata(dtype=np.float32)
-            for key in img_dict
-        }
-        if all(len(img_dict[f"INV{i}-{comp}"]) == 1 for i in (1, 2) for comp in ["REA", "IMA"]):
-            temp_img = img_dict["INV1-REA"][0]
-            for inv in ["INV1", "INV2"]:
-                data[f"{inv}-CPX"] = data[f"{inv}-REA"] + data[f"{inv}-IMA"] * 1j
-        elif all(len(img_dict[f"INV{i}-{comp}"]) == 1 for i in (1, 2) for comp in ["MAG", "PHA"]):
-            temp_img = img_dict["INV1-MAG"][0]
-            for inv in ["INV1", "INV2"]:
-                data[f"{inv}-PHA"] = (
-                    (data[f"{inv}-PHA"] - data[f"{inv}-PHA"].min())
-                    / (data[f"{inv}-PHA"].max() - data[f"{inv}-PHA"].min())
-                    * (2 * np.pi)
-                )
-                data[f"{inv}-CPX"] = data[f"{inv}-MAG"] * np.exp(data[f"{inv}-PHA"] * 1j)
+        for components in (("REA", "IMA"), ("MAG", "PHA")):
+            if all(len(img_dict[f"INV{i}-{comp}"]) == 1 for i in (1, 2) for comp in components):
+                break
         else:
             raise ValueError("Cannot create uniden image from provided images.")
-        uniden = np.real(
-            ((np.conjugate(data["INV1-CPX"]) * data["INV2-CPX"]) - gamma)
-            / (np.abs(data["INV1-CPX"]) ** 2 + np.abs(data["INV2-CPX"]) ** 2 + 2 * gamma)
+        sources = [
+            img_dict[f"INV{i}-{comp}"][0].path for i in (1, 2) for comp in components
+        ]
+        temp_img = img_dict[f"INV1-{components[0]}"][0]
+        out_fpath = (
+            temp_img.parent.parent / "stage" / f"{temp_img.stem}_uniden{get_intermediate_ext()}"
+        )
+        return components, sources, out_fpath
+
+    @staticmethod
+    def write_uniden(
+        out_fpath: Path,
+        inv1_a: Path,
+        inv1_b: Path,
+        inv2_a: Path,
+        inv2_b: Path,
+        components: tuple[str, str] = ("REA", "IMA"),
+        gamma: float = 1e9,
+    ) -> None:
+        """Write an UNIDEN image from the (REA, IMA) or (MAG, PHA) images of each inversion."""
+        uniden, header = MP2RAGEPlugin.compute_uniden(
+            (inv1_a, inv1_b, inv2_a, inv2_b), components, gamma
         )
-        uniden = np.clip(uniden, -0.5, 0.5) + 0.5
+        save_nifti(nib.Nifti1Image(uniden, None, header), out_fpath)
+
+    @staticmethod
+    def compute_uniden(
+        component_fpaths: tuple[Path, Path, Path, Path],
+        components: tuple[str, str] = ("REA", "IMA"),
+        gamma: float = 1e9,
+    ) -> tuple[np.ndarray, nib.Nifti1Header]:
+        """
+        Compute UNIDEN in float32, slab by slab (returned with the first component's header).
+
+        With c1, c2 the complex INV1/INV2 signals, UNIDEN is
+        ``(Re(conj(c1) * c2) - gamma) / (|c1|^2 + |c2|^2 + 2 * gamma)`` clipped to [-0.5, 0.5]
+        and shifted by 0.5. ``Re(conj(c1) * c2)`` is expanded to ``re1 * re2 + im1 * im2``, so
+        no complex arrays are built. Phase images are rescaled to [0, 2pi] using a min/max from
+        a streaming first pass.
+        """
+        objs = [load_nifti(path, keep_file_open=True) for path in component_fpaths]
+        shape = objs[0].shape
+        step = max(1, MP2RAGEPlugin.slab_bytes // (int(np.prod(shape[:2])) * 8))
+        slabs = [
+            (slice(None), slice(None), slice(z0, z0 + step)) for z0 in range(0, shape[2], step)
+        ]
+
+        def read(obj, slab):
+            return np.array(obj.dataobj[slab], dtype=np.float32)
+
+        # Streaming min/max of each phase image (INV1 and INV2 second components)
+        polar = tuple(components) == ("MAG", "PHA")
+        phase_ranges = {}
+        if polar:
+            for idx in (1, 3):
+                phase_min, phase_max = np.inf, -np.inf
+                for slab in slabs:
+                    pha = read(objs[idx], slab)
+                    phase_min = min(phase_min, pha.min())
+                    phase_max = max(phase_max, pha.max())
+                phase_ranges[idx] = (np.float32(phase_min), np.float32(phase_max - phase_min))
 
-        obj = nib.Nifti1Image.load(temp_img.path)
-        out_fpath = temp_img.parent.parent / "stage" / f"{temp_img.stem}_uniden.nii.gz"
-        nib.Nifti1Image(uniden, None, obj.header).to_filename(out_fpath)
-        return ImageFile(out_fpath)
+        uniden = np.empty(shape, dtype=np.float32)
+        for slab in slabs:
+            re1, im1, re2, im2 = (read(obj, slab) for obj in objs)
+            if polar:
+                # Convert (magnitude, phase) to (real, imaginary) in place
+                for mag, pha, idx in ((re1, im1, 1), (re2, im2, 3)):
+                    phase_min, phase_range = phase_ranges[idx]
+                    pha -= phase_min
+                    pha /= phase_range
+                    pha *= np.float32(2 * np.pi)
+                    cos_pha = np.cos(pha)
+                    np.sin(pha, out=pha)
+                    pha *= mag
+                    mag *= cos_pha
+            num = re1 * re2
+            num += im1 * im2
+            num -= np.float32(gamma)
+            den = np.square(re1, out=re1)
+            den += np.square(im1, out=im1)
+            den += np.square(re2, out=re2)
+            den += np.square(im2, out=im2)
+            den += np.float32(2 * gamma)
+            num /= den
+            np.clip(num, -0.5, 0.5, out=num)
+            num += np.float32(0.5)
+            uniden[slab] = num
+        return uniden, objs[0].header
 
 
 if __name__ == "__main__":
@@ -1,7 +1,12 @@
 import json
+from json.encoder import (
+    _make_iterencode,
+    c_make_encoder,
+    encode_basestring,
+    encode_basestring_ascii,
+)
 from pathlib import PurePath
-from typing import Any, Union
-import uuid
+from typing import Any, Iterator, Union
 
 
 class NoIndent:
@@ -9,18 +14,29 @@ class NoIndent:
         self.value = value
 
 
+class _RawJSON(str):
+    """Encoded JSON text that is emitted as is (the encoding of a ``NoIndent`` value)."""
+
+
 class JSONObjectEncoder(json.JSONEncoder):
+    """
+    JSON encoder for paths, objects with ``__repr_json__`` and compact ``NoIndent`` values
+
+    ``NoIndent`` values are encoded on one line (with the other options of the encoder) while
+    the document is being encoded, so ``json.dump`` streams the output to a file.
+    """
+
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.kwargs = dict(kwargs)
-        del self.kwargs["indent"]
-        self._replacement_map = {}
+        self.kwargs.pop("indent", None)
+        self._inline_encoder = None
 
     def default(self, o: Any) -> Union[str, dict]:
         if isinstance(o, NoIndent):
-            key = uuid.uuid4().hex
-            self._replacement_map[key] = json.dumps(o.value, **self.kwargs, cls=JSONObjectEncoder)
-            return "@@%s@@" % (key,)
+            if self._inline_encoder is None:
+                self._inline_encoder = type(self)(**self.kwargs)
+            return _RawJSON(self._inline_encoder.encode(o.value))
         elif isinstance(o, PurePath):
             return str(o)
         elif hasattr(o, "__repr_json__") and callable(o.__repr_json__):
@@ -28,8 +44,51 @@ class JSONObjectEncoder(json.JSONEncoder):
         else:
             return super().default(o)
 
-    def encode(self, o: Any) -> str:
-        result = super().encode(o)
-        for k, v in self._replacement_map.items():
-            result = result.replace('"@@%s@@"' % (k,), v)
-        return result
+    def iterencode(self, o: Any, _one_shot: bool = False) -> Iterator[str]:
+        # As json.JSONEncoder.iterencode, emitting _RawJSON unquoted
+        markers = {} if self.check_circular else None
+        str_encoder = encode_basestring_ascii if self.ensure_ascii else encode_basestring
+
+        def _encoder(s: str) -> str:
+            return s if isinstance(s, _RawJSON) else str_encoder(s)
+
+        def floatstr(o: float) -> str:
+            if o != o:
+                text = "NaN"
+            elif o == float("inf"):
+                text = "Infinity"
+            elif o == -float("inf"):
+                text = "-Infinity"
+            else:
+                return float.__repr__(o)
+            if not self.allow_nan:
+                raise ValueError("Out of range float values are not JSON compliant: " + repr(o))
+            return text
+
+        if _one_shot and c_make_encoder is not None and self.indent is None:
+            return c_make_encoder(
+                markers,
+                self.default,
+                _encoder,
+                self.indent,
+                self.key_separator,
+                self.item_separator,
+                self.sort_keys,
+                self.skipkeys,
+                self.allow_nan,
+            )(o, 0)
+        indent = self.indent
+        if indent is not None and not isinstance(indent, str):
+            indent = " " * indent
+        return _make_iterencode(
+            markers,
+            self.default,
+            _encoder,
+            indent,
+            floatstr,
+            self.key_separator,
+            self.item_separator,
+            self.sort_keys,
+            self.skipkeys,
+            _one_shot,
+        )(o, 0)
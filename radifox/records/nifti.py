@@ -0,0 +1,586 @@
+"""
+NIfTI output helpers
+
+``ParallelGzipWriter`` compresses a gzip stream in independent blocks on a thread pool
+(pigz-style, zlib releases the GIL while compressing). Each block is a raw deflate stream
+primed with the last 32 KiB of the previous block as a dictionary and ended with a sync
+flush, so the concatenated blocks plus a standard header and CRC32/ISIZE trailer form a
+single ordinary gzip member readable by nibabel, FSL and ``gzip``.
+
+Since every block starts byte-aligned, the writer also records a zran-style seek index (a
+checkpoint every ``GZIP_INDEX_SPACING`` bytes with the 32 KiB window preceding it) in a cache
+directory (``RADIFOX_GZIP_INDEX_DIR``, empty to disable). ``load_nifti`` uses it to read slices of
+a ``.nii.gz`` by inflating only from the nearest checkpoint instead of from the file start. An
+index is only valid for the file size and mtime it was written for. Other gzip files (e.g. raw
+images or nibabel outputs) have deflate blocks that are not byte-aligned, which zlib cannot
+resume inflating within. If the optional ``indexed_gzip`` package is installed, ``load_nifti``
+reads them through it instead, which indexes them as they are first read, and stores that index
+in the same directory. The index directory is kept under a byte budget
+(``RADIFOX_GZIP_INDEX_BYTES``) by removing the least recently used indexes.
+
+Intermediate outputs (e.g. staged images) can instead be written as uncompressed ``.nii``, which
+nibabel memory-maps on load, by setting ``RADIFOX_INTERMEDIATE_EXT=.nii`` or with
+``intermediate_ext``.
+"""
+from __future__ import annotations
+
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import contextlib
+import io
+import os
+from pathlib import Path
+import struct
+import zlib
+
+import nibabel as nib
+
+try:
+    import indexed_gzip
+except ImportError:  # Optional, only needed to index gzip files not written by RADIFOX
+    indexed_gzip = None
+
+from .hashing import hash_value
+
+GZIP_BLOCK_SIZE = 2**20
+GZIP_WINDOW_SIZE = 2**15
+# nibabel's default .nii.gz compression level
+GZIP_COMPRESS_LEVEL = 1
+NIFTI_EXTS = (".nii.gz", ".nii")
+GZIP_INDEX_SPACING = 2**22
+GZIP_INDEX_MAGIC = b"RFXGZI01"
+GZIP_ZRAN_INDEX_MAGIC = b"RFXZRN01"
+GZIP_INDEX_BYTES = 2**28
+# Writer header: magic, method, flags, mtime (0, as nibabel), extra flags, OS (no optional fields)
+GZIP_HEADER_SIZE = 10
+
+_intermediate_ext: str | None = None
+
+
+def get_gzip_settings() -> tuple[int, int]:
+    """Return the (compression level, thread count) for .nii.gz outputs."""
+    level = int(os.environ.get("RADIFOX_GZIP_LEVEL", GZIP_COMPRESS_LEVEL))
+    threads = int(os.environ.get("RADIFOX_GZIP_THREADS", min(8, os.cpu_count() or 1)))
+    return level, threads
+
+
+def get_intermediate_ext() -> str:
+    """Return the extension of intermediate NIfTI outputs (".nii.gz" or ".nii")."""
+    ext = _intermediate_ext or os.environ.get("RADIFOX_INTERMEDIATE_EXT", NIFTI_EXTS[0])
+    if ext not in NIFTI_EXTS:
+        raise ValueError(f"Intermediate NIfTI extension must be one of {NIFTI_EXTS}, not {ext}.")
+    return ext
+
+
+@contextlib.contextmanager
+def intermediate_ext(ext: str | None):
+    """Write intermediate outputs with ``ext`` inside the context (None keeps the current one)."""
+    global _intermediate_ext
+    previous = _intermediate_ext
+    _intermediate_ext = ext or previous
+    try:
+        yield
+    finally:
+        _intermediate_ext = previous
+
+
+def get_gzip_index_dir() -> Path | None:
+    """Return the directory holding gzip seek indexes (None if disabled)."""
+    cache_dir = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    index_dir = os.environ.get("RADIFOX_GZIP_INDEX_DIR", str(cache_dir / "radifox" / "gzip-index"))
+    return Path(index_dir) if index_dir else None
+
+
+def prune_gzip_indexes(index_dir: Path | None = None, max_bytes: int | None = None) -> int:
+    """
+    Remove the least recently used gzip seek indexes until the rest fit in ``max_bytes``
+
+    Indexes are ordered by mtime, which ``GzipIndex.load`` updates on use. Defaults to the
+    ``get_gzip_index_dir`` directory and ``RADIFOX_GZIP_INDEX_BYTES`` (256 MiB). Returns the
+    number of indexes removed.
+    """
+    index_dir = get_gzip_index_dir() if index_dir is None else index_dir
+    if max_bytes is None:
+        max_bytes = int(os.environ.get("RADIFOX_GZIP_INDEX_BYTES", GZIP_INDEX_BYTES))
+    if index_dir is None or not index_dir.is_dir():
+        return 0
+    indexes = []
+    for index_file in index_dir.glob("*.gzi"):
+        try:
+            stat = index_file.stat()
+        except OSError:
+            continue
+        indexes.append((stat.st_mtime_ns, stat.st_size, index_file))
+    total = sum(size for _, size, _ in indexes)
+    removed = 0
+    for _, size, index_file in sorted(indexes):
+        if total <= max_bytes:
+            break
+        # Another process may have removed it already
+        index_file.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+def _store_index(
+    filename: str | os.PathLike, magic: bytes, data: bytes, stat: os.stat_result | None = None
+) -> None:
+    """Store index data of ``filename`` tagged with its size and mtime (or ``stat``'s)."""
+    index_file = GzipIndex.index_file(filename)
+    if index_file is None:
+        return
+    # The index is only an optimization, so failing to store it is not an error
+    try:
+        stat = os.stat(filename) if stat is None else stat
+        index_file.parent.mkdir(exist_ok=True, parents=True)
+        tmp_file = index_file.with_name(f".{index_file.name}.{os.getpid()}.tmp")
+        tmp_file.write_bytes(magic + struct.pack("<Qq", stat.st_size, stat.st_mtime_ns) + data)
+        tmp_file.replace(index_file)
+        prune_gzip_indexes(index_file.parent)
+    except OSError:
+        pass
+
+
+def _load_index(filename: str | os.PathLike, magic: bytes) -> bytes | None:
+    """Return the stored index data of ``filename`` (None if missing, stale or another kind)."""
+    index_file = GzipIndex.index_file(filename)
+    if index_file is None:
+        return None
+    try:
+        data = index_file.read_bytes()
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    pos = len(magic) + struct.calcsize("<Qq")
+    if len(data) < pos or not data.startswith(magic):
+        return None
+    if struct.unpack_from("<Qq", data, len(magic)) != (stat.st_size, stat.st_mtime_ns):
+        return None
+    # Mark the index as used for prune_gzip_indexes
+    try:
+        os.utime(index_file)
+    except OSError:
+        pass
+    return data[pos:]
+
+
+def find_nifti(base: Path) -> Path:
+    """Return the existing NIfTI file for a path without extension (".nii.gz" if none exists)."""
+    for ext in NIFTI_EXTS:
+        if base.with_name(base.name + ext).exists():
+            return base.with_name(base.name + ext)
+    return base.with_name(base.name + NIFTI_EXTS[0])
+
+
+def _compress_block(block: bytes, zdict: bytes | None, level: int, last: bool) -> bytes:
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(block)
+    return data + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class GzipIndex:
+    """
+    Seek points into a raw deflate stream of a gzip file
+
+    Each checkpoint is a (compressed offset, uncompressed offset, window) triple: inflation can
+    resume at the byte-aligned compressed offset with the window (the previous 32 KiB of
+    uncompressed data) as its dictionary.
+
+    Params:
+        checkpoints (list[tuple[int, int, bytes]]): checkpoints sorted by offset
+        length (int): uncompressed length of the stream
+    """
+
+    def __init__(self, checkpoints: list[tuple[int, int, bytes]], length: int) -> None:
+        self.checkpoints = checkpoints
+        self.length = length
+        self._offsets = [checkpoint[1] for checkpoint in checkpoints]
+
+    def find(self, offset: int) -> tuple[int, int, bytes]:
+        """Return the last checkpoint at or before an uncompressed offset."""
+        return self.checkpoints[max(bisect.bisect_right(self._offsets, offset) - 1, 0)]
+
+    @staticmethod
+    def index_file(filename: str | os.PathLike) -> Path | None:
+        index_dir = get_gzip_index_dir()
+        if index_dir is None:
+            return None
+        return index_dir / f"{hash_value(str(Path(filename).resolve()))[:32]}.gzi"
+
+    def save(self, filename: str | os.PathLike, stat: os.stat_result | None = None) -> None:
+        """
+        Store the index of ``filename``, tagged with its size and mtime (or ``stat``'s)
+
+        The index is only an optimization, so failing to store it is not an error. The least
+        recently used indexes are then removed to keep the directory in budget (see
+        ``prune_gzip_indexes``).
+        """
+        header = struct.pack("<QI", self.length, len(self.checkpoints))
+        offsets = b"".join(
+            struct.pack("<QQI", comp, uncomp, len(window))
+            for comp, uncomp, window in self.checkpoints
+        )
+        windows = zlib.compress(b"".join(window for _, _, window in self.checkpoints), 1)
+        _store_index(filename, GZIP_INDEX_MAGIC, header + offsets + windows, stat)
+
+    @classmethod
+    def load(cls, filename: str | os.PathLike) -> GzipIndex | None:
+        """
+        Return the stored index of ``filename`` (None if missing, stale or unreadable)
+
+        A loaded index is marked as used (its mtime is updated) for ``prune_gzip_indexes``.
+        """
+        data = _load_index(filename, GZIP_INDEX_MAGIC)
+        if data is None:
+            return None
+        try:
+            length, count = struct.unpack_from("<QI", data)
+            pos = struct.calcsize("<QI")
+            entries = [struct.unpack_from("<QQI", data, pos + 20 * i) for i in range(count)]
+            windows = zlib.decompress(data[pos + 20 * count :])
+        except (struct.error, zlib.error):
+            return None
+        checkpoints, start = [], 0
+        for comp, uncomp, window_size in entries:
+            checkpoints.append((comp, uncomp, windows[start : start + window_size]))
+            start += window_size
+        return cls(checkpoints, length)
+
+
+class IndexedGzipReader(io.RawIOBase):
+    """
+    Read-only, seekable view of the uncompressed data of an indexed gzip file
+
+    Sequential reads continue inflating where the previous read stopped, other seeks restart from
+    the nearest checkpoint. Wrap in ``io.BufferedReader`` for reads that are never short.
+
+    Params:
+        filename (Path): gzip filename
+        index (GzipIndex): seek index of the file
+    """
+
+    read_size = 2**16
+
+    def __init__(self, filename: str | os.PathLike, index: GzipIndex) -> None:
+        super().__init__()
+        self.name = str(filename)
+        self.index = index
+        self._fobj = open(filename, "rb")
+        self._pos = 0
+        self._inflater = None
+        self._out = b""
+        self._out_start = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.index.length
+        if offset < 0:
+            raise OSError("Negative seek position")
+        self._pos = offset
+        return self._pos
+
+    def _restart(self, checkpoint: tuple[int, int, bytes]) -> None:
+        comp, uncomp, window = checkpoint
+        self._fobj.seek(comp)
+        if window:
+            self._inflater = zlib.decompressobj(-zlib.MAX_WBITS, zdict=window)
+        else:
+            self._inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._out = b""
+        self._out_start = uncomp
+
+    def _inflate(self) -> bytes:
+        while not self._inflater.eof:
+            data = self._inflater.unconsumed_tail or self._fobj.read(self.read_size)
+            if not data:
+                break
+            out = self._inflater.decompress(data, self.read_size)
+            if out:
+                return out
+        return b""
+
+    def readinto(self, buffer) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if self._pos >= self.index.length:
+            return 0
+        checkpoint = self.index.find(self._pos)
+        out_end = self._out_start + len(self._out)
+        # Restart unless the data is ahead in the current stream and no checkpoint is closer
+        if self._inflater is None or self._pos < self._out_start or checkpoint[1] > out_end:
+            self._restart(checkpoint)
+        while self._out_start + len(self._out) <= self._pos:
+            self._out_start += len(self._out)
+            self._out = self._inflate()
+            if not self._out:
+                return 0
+        view = memoryview(buffer).cast("B")
+        start = self._pos - self._out_start
+        chunk = self._out[start : start + len(view)]
+        view[: len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._fobj.close()
+        super().close()
+
+
+class ZranGzipReader(io.RawIOBase):
+    """
+    Read-only, seekable view of the uncompressed data of any gzip file, through ``indexed_gzip``
+
+    ``indexed_gzip`` adds a checkpoint every ``GZIP_INDEX_SPACING`` bytes as it inflates, so the
+    first read of a file indexes it up to where the read stopped (all of it for a full decode).
+    The stored index of the file is imported on open, and stored again on close if reads
+    extended it. Requires the optional ``indexed_gzip`` package.
+
+    Params:
+        filename (Path): gzip filename
+    """
+
+    def __init__(self, filename: str | os.PathLike) -> None:
+        super().__init__()
+        self.name = str(filename)
+        # The index is stored for the file as opened
+        self._stat = os.stat(filename)
+        self._fobj = self._open()
+        data = _load_index(filename, GZIP_ZRAN_INDEX_MAGIC)
+        if data is not None:
+            try:
+                self._fobj.import_index(fileobj=io.BytesIO(zlib.decompress(data)))
+            except (zlib.error, indexed_gzip.ZranError):
+                self._fobj.close()
+                self._fobj = self._open()
+        self._stored_points = self._count_points()
+
+    def _open(self):
+        return indexed_gzip.IndexedGzipFile(
+            self.name, spacing=GZIP_INDEX_SPACING, buffer_size=IndexedGzipReader.read_size
+        )
+
+    def _count_points(self) -> int:
+        return sum(1 for _ in self._fobj.seek_points())
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._fobj.tell()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._fobj.seek(offset, whence)
+
+    def readinto(self, buffer) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        # indexed_gzip only adds checkpoints between reads, so read at most one spacing at a time
+        return self._fobj.readinto(memoryview(buffer).cast("B")[:GZIP_INDEX_SPACING])
+
+    def close(self) -> None:
+        if not self.closed:
+            try:
+                if self._count_points() > self._stored_points:
+                    data = io.BytesIO()
+                    self._fobj.export_index(fileobj=data)
+                    _store_index(
+                        self.name,
+                        GZIP_ZRAN_INDEX_MAGIC,
+                        zlib.compress(data.getvalue(), 1),
+                        self._stat,
+                    )
+            finally:
+                self._fobj.close()
+        super().close()
+
+
+def load_nifti(filename: str | os.PathLike, **kwargs) -> nib.Nifti1Image:
+    """
+    Load a NIfTI image, with slice reads of a .nii.gz inflating only near the slices
+
+    A .nii.gz written by RADIFOX is read through its ``GzipIndex``. Other .nii.gz files are read
+    through a ``ZranGzipReader`` if ``indexed_gzip`` is installed, which indexes them as they
+    are read (the index is stored when the image's file is closed, i.e. when the image is
+    garbage collected). Other images are loaded with ``nib.load(filename, **kwargs)``.
+    """
+    filename = Path(filename)
+    if not filename.name.endswith(".gz"):
+        return nib.load(filename, **kwargs)
+    index = GzipIndex.load(filename)
+    if index is not None:
+        raw = IndexedGzipReader(filename, index)
+    elif indexed_gzip is not None and GzipIndex.index_file(filename) is not None:
+        raw = ZranGzipReader(filename)
+    else:
+        return nib.load(filename, **kwargs)
+    fobj = io.BufferedReader(raw, IndexedGzipReader.read_size)
+    file_holder = nib.fileholders.FileHolder(filename=str(filename), fileobj=fobj)
+    return nib.Nifti1Image.from_file_map({"image": file_holder})
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """
+    Write-only gzip file compressed in blocks on a thread pool
+
+    Supports ``tell`` and forward ``seek`` (padding with zeros), which is all nibabel needs to
+    write an image. A ``GzipIndex`` with a checkpoint at the first block boundary after every
+    ``index_spacing`` bytes is saved when the file is closed (if it has more than one).
+
+    Params:
+        filename (Path): output filename
+        compresslevel (int | None): zlib compression level (see ``get_gzip_settings``)
+        threads (int | None): compression threads (see ``get_gzip_settings``)
+        block_size (int): uncompressed bytes per block
+        index_spacing (int): uncompressed bytes between seek index checkpoints
+        index_name (Path | None): final filename of a file that is renamed after writing
+    """
+
+    def __init__(
+        self,
+        filename: str | os.PathLike,
+        compresslevel: int | None = None,
+        threads: int | None = None,
+        block_size: int = GZIP_BLOCK_SIZE,
+        index_spacing: int = GZIP_INDEX_SPACING,
+        index_name: str | os.PathLike | None = None,
+    ) -> None:
+        super().__init__()
+        default_level, default_threads = get_gzip_settings()
+        self.compresslevel = default_level if compresslevel is None else compresslevel
+        self.threads = max(1, default_threads if threads is None else threads)
+        self.block_size = block_size
+        self.index_spacing = index_spacing
+        self.index_name = filename if index_name is None else index_name
+        self.name = str(filename)
+        self._fobj = open(filename, "wb")
+        self._executor = ThreadPoolExecutor(self.threads) if self.threads > 1 else None
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._zdict = b""
+        self._crc = 0
+        self._size = 0
+        self._written = GZIP_HEADER_SIZE
+        self._checkpoints = [(GZIP_HEADER_SIZE, 0, b"")]
+        self._next_checkpoint = index_spacing
+        xfl = 2 if self.compresslevel == 9 else (4 if self.compresslevel == 1 else 0)
+        self._fobj.write(b"\x1f\x8b\x08\x00" + struct.pack("<IBB", 0, xfl, 255))
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._size + len(self._buffer)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence != io.SEEK_SET:
+            raise OSError("ParallelGzipWriter only supports SEEK_SET and SEEK_CUR.")
+        if offset < self.tell():
+            raise OSError("Negative seek in write mode")
+        if offset > self.tell():
+            self.write(b"\x00" * (offset - self.tell()))
+        return self.tell()
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        data = memoryview(data)
+        if not data.c_contiguous:
+            data = memoryview(data.tobytes())
+        data = data.cast("B")
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[: self.block_size])
+            del self._buffer[: self.block_size]
+            self._submit(block, last=False)
+        return len(data)
+
+    def _submit(self, block: bytes, last: bool) -> None:
+        self._crc = zlib.crc32(block, self._crc)
+        # Blocks start byte-aligned, so a block start is a checkpoint (its offset once written)
+        checkpoint = None
+        if block and self._size >= self._next_checkpoint:
+            checkpoint = (self._size, self._zdict)
+            self._next_checkpoint = self._size + self.index_spacing
+        self._size += len(block)
+        zdict = self._zdict
+        self._zdict = (zdict + block)[-GZIP_WINDOW_SIZE:]
+        if self._executor is None:
+            self._write_block(_compress_block(block, zdict, self.compresslevel, last), checkpoint)
+            return
+        self._pending.append(
+            (
+                self._executor.submit(_compress_block, block, zdict, self.compresslevel, last),
+                checkpoint,
+            )
+        )
+        # Bound memory to a couple of blocks per thread, written in order
+        while len(self._pending) > 2 * self.threads:
+            future, checkpoint = self._pending.popleft()
+            self._write_block(future.result(), checkpoint)
+
+    def _write_block(self, data: bytes, checkpoint: tuple[int, bytes] | None) -> None:
+        if checkpoint is not None:
+            self._checkpoints.append((self._written, *checkpoint))
+        self._fobj.write(data)
+        self._written += len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            block = bytes(self._buffer)
+            self._buffer.clear()
+            self._submit(block, last=True)
+            while self._pending:
+                future, checkpoint = self._pending.popleft()
+                self._write_block(future.result(), checkpoint)
+            self._fobj.write(struct.pack("<II", self._crc, self._size & 0xFFFFFFFF))
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._fobj.close()
+            super().close()
+        if len(self._checkpoints) > 1:
+            GzipIndex(self._checkpoints, self._size).save(self.index_name, os.stat(self.name))
+
+
+def save_nifti(
+    img: nib.Nifti1Image,
+    filename: str | os.PathLike,
+    compresslevel: int | None = None,
+    threads: int | None = None,
+) -> None:
+    """Save a NIfTI image, compressing .nii.gz outputs with ``ParallelGzipWriter``."""
+    filename = Path(filename)
+    if not filename.name.endswith(".gz"):
+        img.to_filename(filename)
+        return
+    with ParallelGzipWriter(filename, compresslevel, threads) as fobj:
+        file_holder = nib.fileholders.FileHolder(filename=str(filename), fileobj=fobj)
+        img.to_file_map({"image": file_holder})
+    img.set_filename(str(filename))
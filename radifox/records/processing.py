@@ -8,14 +8,14 @@ from pathlib import Path
 import socket
 import sys
 from typing import Any
-
-import nibabel as nib
+import warnings
 
 from .utils import safe_append_to_file, format_timedelta
 from .hashing import hash_file
 from .logging import create_loggers
+from .nifti import NIFTI_EXTS
 from ..naming import ImageFile
-from .qa import create_qa_image, create_surface_qa_image
+from .qa import QAOutputOptions, render_qa_images
 
 CONTAINER_LABELS = [
     "ci.image",
@@ -32,6 +32,11 @@ class ProcessingModule(ABC):
     version: str = None
     log_uses_filename: bool = True
     skip_prov_write: tuple[str] = tuple()
+    qa_workers: int = 1
+    qa_output_options: QAOutputOptions | None = None
+    qa_volume: int | str = 0
+    qa_skip_unchanged: bool = True
+    container_labels_path: Path = Path("/.singularity.d/labels.json")
 
     def __init__(self, args: list[str] | None = None) -> None:
         self.verify_container()
@@ -67,16 +72,16 @@ class ProcessingModule(ABC):
     def run(*args, **kwargs) -> dict[str, Path] | list[dict[str, Path]]:
         raise NotImplementedError
 
-    @staticmethod
-    def get_container_labels() -> dict[str, str]:
-        with open("/.singularity.d/labels.json", "r") as f:
+    @classmethod
+    def get_container_labels(cls) -> dict[str, str]:
+        with open(cls.container_labels_path, "r") as f:
             labels = json.load(f)
         return labels
 
-    @staticmethod
-    def verify_container() -> None:
-        if Path("/.singularity.d/labels.json").exists():
-            labels = ProcessingModule.get_container_labels()
+    @classmethod
+    def verify_container(cls) -> None:
+        if cls.container_labels_path.exists():
+            labels = cls.get_container_labels()
             if any(lbl not in labels for lbl in CONTAINER_LABELS):
                 raise ValueError("Container is missing required labels.")
         else:
@@ -229,11 +234,11 @@ class ProcessingModule(ABC):
             self.write_prov(prov_str, self.outputs, self.skip_prov_write)
 
     @staticmethod
-    def create_qa(
+    def get_qa_tasks(
         outputs: dict[str, Path | list[Path] | None],
         name: str,
         skip_prov_write: tuple[str],
-    ) -> None:
+    ) -> list[tuple[Path, Path | None, str, Path]]:
         outs = [
             el
             for key, sub in outputs.items()
@@ -241,50 +246,79 @@ class ProcessingModule(ABC):
             for el in (sub if isinstance(sub, list) else [sub])
         ]
         if len(outs) == 0:
-            return
+            return []
         out = outs[0][0] if isinstance(outs[0], tuple) else outs[0]
         out_dir = out.parent.parent / "qa" / name
         out_dir.mkdir(exist_ok=True, parents=True)
+        tasks = []
         for out in outs:
             if out is None:
                 continue
             if isinstance(out, tuple):
-                overlay = out[0]
-                bg_image = out[1]
+                overlay = Path(out[0])
+                bg_image = Path(out[1])
                 lut = out[2] if len(out) > 2 else "binary"
                 out_name = f"{overlay.name.split('.')[0]}.png"
             else:
                 overlay = None
-                bg_image = out
+                bg_image = Path(out)
                 lut = "binary"
                 out_name = f"{bg_image.name.split('.')[0]}.png"
-            if not str(bg_image).endswith(".nii.gz"):
+            if not str(bg_image).endswith(NIFTI_EXTS):
                 continue
-            if overlay is not None and overlay.name.endswith(".gii"):
-                if len(nib.GiftiImage.load(overlay).agg_data('pointset')) == 0 \
-                        or len(nib.GiftiImage.load(overlay).agg_data('triangle')) == 0:
-                    continue
-                create_surface_qa_image(
-                    overlay,
-                    bg_image,
-                    out_dir / out_name,
-                    color=lut,
-                )
-            else:
-                create_qa_image(
-                    str(bg_image),
-                    out_dir / out_name,
-                    str(overlay) if overlay is not None else None,
-                    lut,
-                )
+            tasks.append((bg_image, overlay, lut, out_dir / out_name))
+        return tasks
+
+    @staticmethod
+    def create_qa(
+        outputs: dict[str, Path | list[Path] | None],
+        name: str,
+        skip_prov_write: tuple[str],
+    ) -> None:
+        """Render the QA images of one set of outputs (deprecated, see ``get_qa_tasks``)."""
+        warnings.warn(
+            "ProcessingModule.create_qa is deprecated, QA images are collected with "
+            "get_qa_tasks and rendered with render_qa_images.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        render_qa_images(ProcessingModule.get_qa_tasks(outputs, name, skip_prov_write))
+
+    def get_qa_workers(self) -> int:
+        return int(os.environ.get("RADIFOX_QA_WORKERS", self.qa_workers))
 
     def generate_qa_images(self) -> None:
+        if type(self).create_qa is not ProcessingModule.create_qa:
+            # Modules that override the deprecated create_qa keep rendering through it
+            warnings.warn(
+                f"{type(self).__name__}.create_qa overrides a deprecated method, override "
+                "get_qa_tasks instead.",
+                DeprecationWarning,
+            )
+            if self.check_multi_run():
+                for i in range(len(list(self.parsed_args.values())[0])):
+                    if self.outputs[i] is not None:
+                        self.create_qa(self.outputs[i], self.name, self.skip_prov_write)
+            else:
+                self.create_qa(self.outputs, self.name, self.skip_prov_write)
+            return
+        # QA for every session is collected first so that one pool renders all of it
+        tasks = []
         if self.check_multi_run():
             for i in range(len(list(self.parsed_args.values())[0])):
                 if self.outputs[i] is not None:
-                    self.create_qa(self.outputs[i], self.name, self.skip_prov_write)
+                    tasks.extend(
+                        self.get_qa_tasks(self.outputs[i], self.name, self.skip_prov_write)
+                    )
         else:
-            self.create_qa(self.outputs, self.name, self.skip_prov_write)
+            tasks.extend(self.get_qa_tasks(self.outputs, self.name, self.skip_prov_write))
+        render_qa_images(
+            tasks,
+            self.get_qa_workers(),
+            self.qa_output_options,
+            self.qa_volume,
+            self.qa_skip_unchanged,
+        )
 
     def create_loggers(self):
         out_paths = None
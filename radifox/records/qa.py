@@ -1,14 +1,26 @@
-import io
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import functools
+import itertools
+import json
+import logging
+from pathlib import Path
+import traceback
 
-import matplotlib.pyplot as plt
 import nibabel as nib
 import numpy as np
-import trimesh
-from PIL import Image
+from PIL import Image, ImageColor, ImageDraw
 
-from .resize import nn_resize_1mmiso
+from .hashing import hash_file, hash_value
+from .nifti import load_nifti
+from .resize import nn_resize_1mmiso, nn_resize_indices
 from .utils import get_tkr_matrix
 
+QA_TILE_SIZE = 224
+QA_SLICES = (0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7)
+# Bump whenever a change to the renderers alters the pixels they produce
+QA_RENDERER_VERSION = "2"
+QA_MANIFEST = "qa_manifest.json"
+
 BINARY_LUT = {1: [255, 0, 0]}
 
 BRAIN_COLOR_LUT = {
@@ -168,63 +180,467 @@ COLORBLIND_LUT = {
 luts = {"binary": BINARY_LUT, "brain_color": BRAIN_COLOR_LUT, "colorblind": COLORBLIND_LUT}
 
 
-def create_montage(img_obj, axial_slices, coronal_slices, sagittal_slices):
-    reslicer = Reslicer(img_obj)
-    max_size = max(reslicer.data.shape)
+def create_montage(img_obj, axial_slices, coronal_slices, sagittal_slices, volume=0):
+    reslicer = Reslicer(img_obj, on_demand=True, volume=volume)
+    max_size = max(reslicer.shape)
+    planes = ["axial", "sagittal", "coronal"]
+    requests = [
+        (int(slice_num), plane)
+        for plane, dist_list in zip(planes, [axial_slices, sagittal_slices, coronal_slices])
+        for slice_num in np.around(np.array(dist_list) * reslicer.get_num_slices(plane))
+    ]
     slices = [[], [], []]
-    for i, (plane, dist_list) in enumerate(
-        zip(["axial", "sagittal", "coronal"], [axial_slices, sagittal_slices, coronal_slices])
-    ):
-        slice_list = np.around(np.array(dist_list) * reslicer.get_num_slices(plane))
-        for slice_num in slice_list:
-            sel_slice = reslicer.get_slice(int(slice_num), plane)
-            pad_width = [
-                (
-                    int(np.floor((max_size - sel_slice.shape[i]) / 2.0)),
-                    int(np.ceil((max_size - sel_slice.shape[i]) / 2.0)),
-                )
-                for i in range(2)
-            ]
-            slices[i].append(
-                np.pad(sel_slice, pad_width, "constant", constant_values=reslicer.bg_value)
+    for (_, plane), sel_slice in zip(requests, reslicer.get_slices(requests)):
+        pad_width = [
+            (
+                int(np.floor((max_size - sel_slice.shape[i]) / 2.0)),
+                int(np.ceil((max_size - sel_slice.shape[i]) / 2.0)),
             )
+            for i in range(2)
+        ]
+        slices[planes.index(plane)].append(
+            np.pad(sel_slice, pad_width, "constant", constant_values=reslicer.bg_value)
+        )
     return np.concatenate([np.concatenate(slices[i], 0) for i in range(len(slices))], 1)
 
 
+def render_qa_image(
+    bg_image, overlay, lut, output_file, cache=None, output_options=None, volume=0
+) -> None:
+    """Render one QA image (surface contours for GIFTI overlays, colored labels otherwise)."""
+    if overlay is not None and str(overlay).endswith(".gii"):
+        vertices, faces = load_surface(overlay, cache)
+        if len(vertices) == 0 or len(faces) == 0:
+            return
+        create_surface_qa_image(
+            overlay, bg_image, output_file, color=lut, cache=cache, output_options=output_options
+        )
+    else:
+        create_qa_image(
+            str(bg_image),
+            output_file,
+            str(overlay) if overlay is not None else None,
+            lut,
+            cache=cache,
+            output_options=output_options,
+            volume=volume,
+        )
+
+
+def render_qa_images(
+    tasks, workers=1, output_options=None, volume=0, skip_unchanged=True
+) -> list[Path]:
+    """
+    Render (bg_image, overlay, lut, output_file) QA tasks, optionally on a process pool
+
+    Tasks that share a background are rendered together with one QACache. At most ``workers``
+    groups are in flight at once, which bounds memory to a few decoded inputs per worker.
+    Failures are logged per image and do not stop the remaining images.
+
+    With ``skip_unchanged``, each output's digest (see ``qa_digest``) is recorded in a manifest
+    in its directory, and images whose digest is unchanged and whose file exists are skipped.
+
+    Returns:
+        list[Path]: output files that failed to render
+    """
+    tasks = list(tasks)
+    digests, manifests = {}, {}
+    if skip_unchanged:
+        file_hashes = {}
+        for task in tasks:
+            out_dir = task[3].parent
+            if out_dir not in manifests:
+                manifests[out_dir] = load_qa_manifest(out_dir)
+            digests[task[3]] = qa_digest(task, output_options, volume, file_hashes)
+        tasks = [
+            task
+            for task in tasks
+            if digests[task[3]] is None
+            or manifests[task[3].parent].get(task[3].name) != digests[task[3]]
+            or not task[3].exists()
+        ]
+    failures = _render_qa_tasks(tasks, workers, output_options, volume)
+    if skip_unchanged:
+        failed = set(failures)
+        for task in tasks:
+            manifest = manifests[task[3].parent]
+            if task[3] in failed or digests[task[3]] is None:
+                manifest.pop(task[3].name, None)
+            else:
+                manifest[task[3].name] = digests[task[3]]
+        for out_dir, manifest in manifests.items():
+            save_qa_manifest(out_dir, manifest)
+    return failures
+
+
+def qa_digest(task, output_options=None, volume=0, file_hashes=None) -> str | None:
+    """
+    Digest of everything that determines a QA image
+
+    Covers the background and overlay contents, the LUT, slice fractions, displayed volume,
+    output options and the renderer version. Returns None if an input cannot be read.
+    """
+    file_hashes = {} if file_hashes is None else file_hashes
+    bg_image, overlay, lut, _ = task
+    parts = [QA_RENDERER_VERSION, repr(QA_SLICES), repr(lut), repr(volume)]
+    if output_options is not None:
+        parts.append(repr(sorted(vars(output_options).items())))
+    for path in (bg_image, overlay):
+        if path is None:
+            parts.append("")
+            continue
+        if path not in file_hashes:
+            try:
+                file_hashes[path] = hash_file(Path(path), include_names=False)
+            except OSError:
+                file_hashes[path] = None
+        if file_hashes[path] is None:
+            return None
+        parts.append(file_hashes[path])
+    return hash_value("\n".join(parts))
+
+
+def load_qa_manifest(qa_dir) -> dict[str, str]:
+    """Load the output name to digest mapping of a QA directory (empty if missing or corrupt)."""
+    try:
+        manifest = json.loads((Path(qa_dir) / QA_MANIFEST).read_text())
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def save_qa_manifest(qa_dir, manifest) -> None:
+    qa_dir = Path(qa_dir)
+    qa_dir.mkdir(exist_ok=True, parents=True)
+    tmp_file = qa_dir / f".{QA_MANIFEST}.tmp"
+    tmp_file.write_text(json.dumps(dict(sorted(manifest.items())), indent=2))
+    tmp_file.replace(qa_dir / QA_MANIFEST)
+
+
+def _render_qa_tasks(tasks, workers, output_options, volume) -> list[Path]:
+    groups = {}
+    for task in tasks:
+        groups.setdefault(str(task[0]), []).append(task)
+    failures = []
+    if workers <= 1 or len(groups) <= 1:
+        for group in groups.values():
+            failures.extend(_log_qa_errors(_render_qa_group(group, output_options, volume)))
+        return failures
+
+    group_iter = iter(groups.values())
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for group in itertools.islice(group_iter, workers):
+            pending.add(executor.submit(_render_qa_group, group, output_options, volume))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                failures.extend(_log_qa_errors(future.result()))
+                for group in itertools.islice(group_iter, 1):
+                    pending.add(executor.submit(_render_qa_group, group, output_options, volume))
+    return failures
+
+
+def _render_qa_group(group, output_options=None, volume=0) -> list[tuple[Path, str]]:
+    cache = QACache()
+    errors = []
+    for bg_image, overlay, lut, output_file in group:
+        try:
+            render_qa_image(bg_image, overlay, lut, output_file, cache, output_options, volume)
+        except Exception:
+            errors.append((output_file, traceback.format_exc()))
+    return errors
+
+
+def _log_qa_errors(errors) -> list[Path]:
+    for output_file, error in errors:
+        logging.error(f"Failed to create QA image {output_file}:\n{error}")
+    return [output_file for output_file, _ in errors]
+
+
 def create_qa_image(
     input_filename,
     output_filename,
     overlay_filename=None,
     overlay_lut="binary",
-    axial_slices=(0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7),
-    coronal_slices=(0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7),
-    sagittal_slices=(0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7),
+    axial_slices=QA_SLICES,
+    coronal_slices=QA_SLICES,
+    sagittal_slices=QA_SLICES,
     alpha=0.4,
+    cache=None,
+    output_options=None,
+    volume=0,
 ):
-    input_obj = nib.load(input_filename)
-    base_img = create_montage(input_obj, axial_slices, coronal_slices, sagittal_slices)
-    base_img -= np.min(base_img)
-    base_img = np.array(base_img / np.percentile(base_img, 99.9) * 255.0)
-    base_img[base_img > 255.0] = 255.0
-    base_img = base_img.astype(np.ubyte).T
+    base_img = get_background_montage(
+        input_filename, axial_slices, coronal_slices, sagittal_slices, cache, volume
+    )
 
     if overlay_filename is not None:
-        overlay_obj = nib.load(overlay_filename)
+        overlay_obj = load_nifti(overlay_filename, keep_file_open=True)
         overlay_img = (
             create_montage(overlay_obj, axial_slices, coronal_slices, sagittal_slices)
             .astype(np.ubyte)
             .T
         )
-        lut = np.zeros((256, 3))
-        for k, v in luts[overlay_lut].items():
-            lut[k, :] = v
-        colored_overlay = np.zeros(overlay_img.shape + (3,))
-        for i in range(3):
-            colored_overlay[overlay_img > 0, i] = np.take(lut[:, i], overlay_img[overlay_img > 0])
-        base_img = np.repeat(base_img[:, :, np.newaxis], 3, axis=2)
-        base_img = ((colored_overlay * alpha) + (base_img * (1 - alpha))).astype(np.ubyte)
+        # Single LUT gather, then fixed-point (8-bit) alpha blending
+        weight = np.uint16(round(alpha * 256))
+        colored_overlay = get_lut_array(overlay_lut)[overlay_img].astype(np.uint16)
+        colored_overlay *= weight
+        colored_overlay += (base_img.astype(np.uint16) * (256 - weight))[:, :, np.newaxis]
+        colored_overlay += 128
+        base_img = (colored_overlay >> 8).astype(np.ubyte)
+
+    save_qa_image(base_img, output_filename, output_options)
+
+
+def get_background_montage(
+    input_filename, axial_slices, coronal_slices, sagittal_slices, cache=None, volume=0
+) -> np.ndarray:
+    """Create the normalized uint8 montage of a background image (reused from cache if given)."""
+    key = (
+        str(input_filename),
+        tuple(axial_slices),
+        tuple(coronal_slices),
+        tuple(sagittal_slices),
+        volume,
+    )
+    if cache is not None and key in cache.montages:
+        return cache.montages[key]
+    input_obj = load_nifti(input_filename, keep_file_open=True)
+    base_img = create_montage(input_obj, axial_slices, coronal_slices, sagittal_slices, volume)
+    base_img -= np.min(base_img)
+    base_img = np.array(base_img / np.percentile(base_img, 99.9) * 255.0)
+    base_img[base_img > 255.0] = 255.0
+    base_img = base_img.astype(np.ubyte).T
+    if cache is not None:
+        base_img.flags.writeable = False
+        cache.montages[key] = base_img
+    return base_img
+
+
+@functools.cache
+def get_lut_array(lut_name) -> np.ndarray:
+    """Return a named LUT as a 256x3 uint8 color table (label 0 and unlisted labels are black)."""
+    lut = np.zeros((256, 3), dtype=np.ubyte)
+    for k, v in luts[lut_name].items():
+        lut[k, :] = v
+    lut.flags.writeable = False
+    return lut
+
+
+class QAOutputOptions:
+    """
+    Formats and sizes written for each QA image
 
-    Image.fromarray(base_img).save(output_filename)
+    The full-size montage is always written as PNG to the requested output filename. The
+    defaults reproduce that alone with PIL's default settings.
+
+    Params:
+        png_compress_level (int | None): zlib level for PNG outputs (PIL default if None)
+        formats (tuple[str]): extra full-size encodings written next to the PNG (e.g. "webp")
+        quality (int): quality for lossy formats (WebP, JPEG)
+        thumbnail_size (int | None): longest side of a "<stem>_thumb" image (skipped if None)
+        tile_size (int | None): tile size of a "<stem>_tiles" zoom pyramid (skipped if None)
+        compact_format (str): format used for thumbnails and tiles
+    """
+
+    def __init__(
+        self,
+        png_compress_level: int | None = None,
+        formats: tuple[str, ...] = (),
+        quality: int = 80,
+        thumbnail_size: int | None = None,
+        tile_size: int | None = None,
+        compact_format: str = "png",
+    ) -> None:
+        self.png_compress_level = png_compress_level
+        self.formats = tuple(fmt.lower() for fmt in formats)
+        self.quality = quality
+        self.thumbnail_size = thumbnail_size
+        self.tile_size = tile_size
+        self.compact_format = compact_format.lower()
+
+    def save_kwargs(self, fmt: str) -> dict:
+        if fmt == "png":
+            if self.png_compress_level is None:
+                return {}
+            return {"compress_level": self.png_compress_level}
+        if fmt in ("webp", "jpeg", "jpg"):
+            return {"quality": self.quality}
+        return {}
+
+
+def save_qa_image(image, output_file, output_options=None) -> None:
+    """Save a QA montage plus any extra encodings, thumbnail and tiles from ``output_options``."""
+    output_file = Path(output_file)
+    options = QAOutputOptions() if output_options is None else output_options
+    img = Image.fromarray(image)
+    img.save(output_file, **options.save_kwargs("png"))
+    stem = output_file.name.split(".")[0]
+    for fmt in options.formats:
+        img.save(output_file.parent / f"{stem}.{fmt}", **options.save_kwargs(fmt))
+    if options.thumbnail_size is not None:
+        thumb = img.copy()
+        thumb.thumbnail((options.thumbnail_size, options.thumbnail_size), Image.LANCZOS)
+        fmt = options.compact_format
+        thumb.save(output_file.parent / f"{stem}_thumb.{fmt}", **options.save_kwargs(fmt))
+    if options.tile_size is not None:
+        save_qa_tiles(img, output_file.parent / f"{stem}_tiles", options)
+
+
+def save_qa_tiles(img, tile_dir, output_options) -> None:
+    """
+    Write a tile pyramid for zooming into a QA montage
+
+    Level 0 is full resolution and each following level halves the image until it fits in a
+    single tile. Tiles are saved as "<level>/<column>_<row>.<ext>" with a "tiles.json" layout.
+    """
+    tile_size = output_options.tile_size
+    fmt = output_options.compact_format
+    tile_dir.mkdir(exist_ok=True, parents=True)
+    levels = []
+    level_img = img
+    while True:
+        width, height = level_img.size
+        columns, rows = -(-width // tile_size), -(-height // tile_size)
+        level = len(levels)
+        (tile_dir / str(level)).mkdir(exist_ok=True)
+        for col in range(columns):
+            for row in range(rows):
+                box = (
+                    col * tile_size,
+                    row * tile_size,
+                    min((col + 1) * tile_size, width),
+                    min((row + 1) * tile_size, height),
+                )
+                level_img.crop(box).save(
+                    tile_dir / str(level) / f"{col}_{row}.{fmt}", **output_options.save_kwargs(fmt)
+                )
+        levels.append(
+            {"level": level, "width": width, "height": height, "columns": columns, "rows": rows}
+        )
+        if columns == 1 and rows == 1:
+            break
+        level_img = level_img.resize(
+            (max(1, -(-width // 2)), max(1, -(-height // 2))), Image.LANCZOS
+        )
+    layout = {"tile_size": tile_size, "format": fmt, "levels": levels}
+    (tile_dir / "tiles.json").write_text(json.dumps(layout, indent=2))
+
+
+class QACache:
+    """
+    Decoded QA inputs shared between the images rendered in one QA run
+
+    Params:
+        montages (dict): normalized background montages keyed by path and slice positions
+        volumes (dict): decoded surface QA backgrounds keyed by path
+        surfaces (dict): decoded GIFTI (vertices, faces) keyed by path
+        meshes (dict): SurfaceMesh objects in voxel coordinates keyed by path and image grid
+    """
+
+    def __init__(self):
+        self.montages = {}
+        self.volumes = {}
+        self.surfaces = {}
+        self.meshes = {}
+
+
+def load_surface(surf_file, cache=None) -> tuple[np.ndarray, np.ndarray]:
+    """Decode the vertices and faces of a GIFTI surface (once per QA run if cache is given)."""
+    if cache is not None and str(surf_file) in cache.surfaces:
+        return cache.surfaces[str(surf_file)]
+    vertices, faces = nib.GiftiImage.load(surf_file).agg_data(("pointset", "triangle"))
+    if cache is not None:
+        cache.surfaces[str(surf_file)] = (vertices, faces)
+    return vertices, faces
+
+
+def load_volume(img_file, cache=None) -> nib.Nifti1Image:
+    """Decode a surface QA background as float64 (once per QA run if cache is given)."""
+    if cache is not None and str(img_file) in cache.volumes:
+        return cache.volumes[str(img_file)]
+    img_obj = nib.Nifti1Image.load(img_file)
+    # Decoded data is kept by the image (get_fdata caches it)
+    img_obj.get_fdata()
+    if cache is not None:
+        cache.volumes[str(img_file)] = img_obj
+    return img_obj
+
+
+class SurfaceMesh:
+    """
+    Triangle mesh with per-axis slab indexes for sectioning at many heights
+
+    Triangles are bucketed by the slabs (of ``slab_width`` voxels) that their extent along an axis
+    overlaps, so each section only tests the triangles in the bucket of its height. Sections are
+    returned as line segments in the same 2D plane frames that ``trimesh.section_multiplane``
+    uses for axis-aligned normals at the origin.
+
+    Params:
+        vertices (np.ndarray): (N, 3) vertex coordinates
+        faces (np.ndarray): (M, 3) vertex indices of each triangle
+    """
+
+    # Columns of the 3D coordinates (and signs) that make up the 2D section frame of each axis
+    plane_frames = {0: ((2, -1), (1, 1)), 1: ((2, -1), (0, -1)), 2: ((0, 1), (1, 1))}
+
+    def __init__(self, vertices, faces, slab_width=4.0):
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+        self.faces = np.asarray(faces, dtype=np.int64)
+        self.slab_width = slab_width
+        self._slab_index = {}
+
+    def _get_slab_index(self, axis):
+        if axis not in self._slab_index:
+            tri_coords = self.vertices[self.faces, axis]
+            first = np.floor(tri_coords.min(axis=1) / self.slab_width).astype(np.int64)
+            last = np.floor(tri_coords.max(axis=1) / self.slab_width).astype(np.int64)
+            # Compressed (CSR) buckets: every triangle is listed once for each slab it overlaps
+            counts = last - first + 1
+            tri_ids = np.repeat(np.arange(len(self.faces)), counts)
+            slab_ids = np.repeat(first, counts) + (
+                np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            )
+            order = np.argsort(slab_ids, kind="stable")
+            if len(slab_ids) > 0:
+                slab_min, slab_max = slab_ids.min(), slab_ids.max()
+            else:
+                slab_min, slab_max = 0, -1
+            offsets = np.searchsorted(slab_ids[order], np.arange(slab_min, slab_max + 2))
+            self._slab_index[axis] = (slab_min, offsets, tri_ids[order])
+        return self._slab_index[axis]
+
+    def section(self, axis, heights) -> list[list[np.ndarray]]:
+        """Intersect the mesh with planes normal to ``axis`` and return 2D segments per height."""
+        slab_min, offsets, tri_ids = self._get_slab_index(axis)
+        (col_u, sign_u), (col_v, sign_v) = self.plane_frames[axis]
+        sections = []
+        for height in heights:
+            slab = int(np.floor(height / self.slab_width)) - slab_min
+            if slab < 0 or slab >= len(offsets) - 1:
+                sections.append([])
+                continue
+            tris = self.vertices[self.faces[tri_ids[offsets[slab]:offsets[slab + 1]]]]
+            dist = tris[:, :, axis] - height
+            above = dist >= 0
+            # A triangle is cut when its vertices are on both sides (two crossing edges)
+            cut = above.any(axis=1) & ~above.all(axis=1)
+            tris, dist, above = tris[cut], dist[cut], above[cut]
+            points, crossing = [], []
+            for i, j in ((0, 1), (1, 2), (2, 0)):
+                crosses = above[:, i] != above[:, j]
+                # Edges that do not cross give nan/inf points, which are dropped below
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    frac = dist[:, i] / (dist[:, i] - dist[:, j])
+                    points.append(tris[:, i] + frac[:, np.newaxis] * (tris[:, j] - tris[:, i]))
+                crossing.append(crosses)
+            points = np.stack(points, axis=1)[np.stack(crossing, axis=1)].reshape(-1, 2, 3)
+            segments = np.stack(
+                [sign_u * points[:, :, col_u], sign_v * points[:, :, col_v]], axis=2
+            )
+            sections.append(list(segments))
+        return sections
 
 
 class Reslicer:
@@ -235,9 +651,18 @@ class Reslicer:
     and provides as way to extract a slice in a specific orientation. It can currently bring the
     image to axial, coronal, and sagittal views.
 
+    In on-demand mode, the resampled volume is never built. Requested slices are mapped back to
+    source indices and read from the nibabel ``dataobj`` in a single pass over the slowest axis,
+    so memory scales with a few slices rather than the whole volume.
+
+    For 4D images, only the selected volume is read from ``dataobj``. With ``volume="mean"``,
+    a strided subset of at most ``summary_volumes`` volumes is averaged slab by slab, so the
+    cost does not grow with the number of timepoints.
+
     Params:
-        data (np.ndarray): The Nifti image object from nibabel
+        data (np.ndarray): The resampled image data (only available if not on-demand)
         orient (tuple[str]): orientation tuple
+        shape (tuple[int]): shape of the resampled image
     """
 
     inplane_dirs = {
@@ -247,41 +672,156 @@ class Reslicer:
     }
     slice_dirs = {"axial": "S", "sagittal": "L", "coronal": "P"}
     flip_dict = {"L": "R", "R": "L", "P": "A", "A": "P", "I": "S", "S": "I"}
+    slab_bytes = 2**25
+    summary_volumes = 16
 
-    def __init__(self, nii_obj):
+    def __init__(self, nii_obj, on_demand=False, volume=0):
         """
         Args:
             nii_obj (nib.Nifti1Image): The Nifti image object from nibabel
+            on_demand (bool): Read and resample only the requested slices from ``dataobj``
+            volume (int | str): Volume of a 4D image to show, or "mean" for a strided mean
         """
-        # noinspection PyTypeChecker
-        obj_3d = nii_obj if len(nii_obj.shape) == 3 else nib.four_to_three(nii_obj)[0]
-        self.data = nn_resize_1mmiso(obj_3d)
         self.orient = nib.aff2axcodes(nii_obj.affine)
-        self.bg_value = self.data.min()
+        self.on_demand = on_demand
+        self.dataobj = nii_obj.dataobj
+        self.volume = volume
+        self._summary = None
+        if on_demand:
+            self.indices = nn_resize_indices(nii_obj.shape[:3], nii_obj.header.get_zooms()[:3])
+            self.shape = tuple(len(idx) for idx in self.indices)
+            self._bg_value = None
+        else:
+            if len(nii_obj.shape) == 3:
+                obj_3d = nii_obj
+            else:
+                data_3d = self._read_slab(slice(None))
+                obj_3d = nib.Nifti1Image(data_3d, nii_obj.affine, nii_obj.header)
+            self.data = nn_resize_1mmiso(obj_3d)
+            self.shape = self.data.shape
+            self._bg_value = self.data.min()
+
+    def summary_indices(self) -> range:
+        """The volumes averaged for ``volume="mean"`` (evenly strided across the series)."""
+        num_vols = int(np.prod(self.dataobj.shape[3:], dtype=int))
+        return range(0, num_vols, -(-num_vols // self.summary_volumes))
+
+    def _read_slab(self, z_slice) -> np.ndarray:
+        # One z slab of the selected volume (or of the summary mean) as float64
+        if len(self.dataobj.shape) == 3:
+            return np.asarray(self.dataobj[:, :, z_slice], dtype=np.float64)
+        if self.volume != "mean":
+            index = np.unravel_index(self.volume, self.dataobj.shape[3:])
+            return np.asarray(
+                self.dataobj[(slice(None), slice(None), z_slice) + index], dtype=np.float64
+            )
+        if self._summary is None:
+            self._summary = self._stream_mean()
+        return self._summary[:, :, z_slice]
+
+    def _stream_mean(self) -> np.ndarray:
+        # Volumes are the slowest axes on disk, so each one is read forward in z slabs
+        shape = self.dataobj.shape
+        step = max(1, self.slab_bytes // (shape[0] * shape[1] * 8))
+        total = np.zeros(shape[:3])
+        vol_indices = self.summary_indices()
+        for vol in vol_indices:
+            index = np.unravel_index(vol, shape[3:])
+            for z0 in range(0, shape[2], step):
+                z1 = min(z0 + step, shape[2])
+                total[:, :, z0:z1] += self.dataobj[
+                    (slice(None), slice(None), slice(z0, z1)) + index
+                ]
+        total /= len(vol_indices)
+        return total
+
+    @property
+    def bg_value(self):
+        if self._bg_value is None:
+            # The minimum is gathered during a read pass, so run one with no slices
+            self._read_planes([])
+        return self._bg_value
 
     def get_num_slices(self, plane="axial") -> int:
         if self.slice_dirs[plane] in self.orient:
-            return self.data.shape[self.orient.index(self.slice_dirs[plane])]
-        return self.data.shape[self.orient.index(self.flip_dict[self.slice_dirs[plane]])]
+            return self.shape[self.orient.index(self.slice_dirs[plane])]
+        return self.shape[self.orient.index(self.flip_dict[self.slice_dirs[plane]])]
 
     def get_slice(self, slice_num, plane="axial") -> np.ndarray:
-        slices, dirs = [], []
+        return self.get_slices([(slice_num, plane)])[0]
+
+    def get_slices(self, requests) -> list[np.ndarray]:
+        """Extract a list of (slice_num, plane) slices, reading the image at most once."""
+        specs = [self._plane_spec(slice_num, plane) for slice_num, plane in requests]
+        if self.on_demand:
+            planes = self._read_planes([(axis, index) for axis, index, _, _ in specs])
+        else:
+            planes = [np.take(self.data, index, axis=axis) for axis, index, _, _ in specs]
+        sel_slices = []
+        for plane_data, (_, _, inplane, transpose) in zip(planes, specs):
+            sel_slice = plane_data[inplane]
+            sel_slices.append(sel_slice.T if transpose else sel_slice)
+        return sel_slices
+
+    def _plane_spec(self, slice_num, plane):
+        # Returns the slice axis, the index along it, the in-plane flips and whether to transpose
+        inplane, dirs = [], []
+        axis, index = None, None
         for i, code in enumerate(self.orient):
             if code in self.inplane_dirs[plane][0]:
-                slices.append(slice(None, None))
+                inplane.append(slice(None, None))
                 dirs.append(code)
             elif code in self.inplane_dirs[plane][1]:
-                slices.append(slice(None, None, -1))
+                inplane.append(slice(None, None, -1))
                 dirs.append(self.flip_dict[code])
             else:
-                if code == self.slice_dirs[plane]:
-                    slices.append(slice(slice_num, slice_num + 1))
-                else:
-                    slices.append(
-                        slice(self.data.shape[i] - slice_num - 1, self.data.shape[i] - slice_num)
-                    )
-        sel_slice = np.squeeze(self.data[tuple(slices)])
-        return sel_slice if tuple(dirs) == self.inplane_dirs[plane][0] else sel_slice.T
+                axis = i
+                index = (
+                    slice_num if code == self.slice_dirs[plane] else self.shape[i] - slice_num - 1
+                )
+        return axis, index, tuple(inplane), tuple(dirs) != self.inplane_dirs[plane][0]
+
+    def _read_planes(self, plane_specs):
+        # Source-resolution planes are filled slab by slab along the last (slowest on disk) axis
+        src_specs = [(axis, int(self.indices[axis][index])) for axis, index in plane_specs]
+        buffers = {}
+        for axis, src_index in src_specs:
+            buf_shape = tuple(dim for i, dim in enumerate(self.dataobj.shape[:3]) if i != axis)
+            buffers[(axis, src_index)] = np.empty(buf_shape)
+
+        need_min = self._bg_value is None
+        if need_min or any(axis != 2 for axis, _ in src_specs):
+            z_needed = np.unique(self.indices[2])
+        else:
+            z_needed = np.unique([src_index for _, src_index in src_specs])
+        if len(z_needed) > 0:
+            plane_bytes = self.dataobj.shape[0] * self.dataobj.shape[1] * 8
+            step = max(1, self.slab_bytes // plane_bytes)
+            xy_idx = np.ix_(np.unique(self.indices[0]), np.unique(self.indices[1]))
+            z_min = np.inf
+            for z0 in range(z_needed[0], z_needed[-1] + 1, step):
+                z1 = min(z0 + step, z_needed[-1] + 1)
+                slab = self._read_slab(slice(z0, z1))
+                if need_min:
+                    z_sel = z_needed[(z_needed >= z0) & (z_needed < z1)] - z0
+                    if len(z_sel) > 0:
+                        z_min = min(z_min, slab[xy_idx][:, :, z_sel].min())
+                for (axis, src_index), buf in buffers.items():
+                    if axis == 0:
+                        buf[:, z0:z1] = slab[src_index]
+                    elif axis == 1:
+                        buf[:, z0:z1] = slab[:, src_index]
+                    elif z0 <= src_index < z1:
+                        buf[...] = slab[:, :, src_index - z0]
+            if need_min:
+                self._bg_value = z_min
+
+        # Resample each plane to the output grid with the in-plane index arrays
+        planes = []
+        for axis, src_index in src_specs:
+            inplane_idx = [idx for i, idx in enumerate(self.indices) if i != axis]
+            planes.append(buffers[(axis, src_index)][np.ix_(*inplane_idx)])
+        return planes
 
 
 def create_surface_qa_image(
@@ -289,27 +829,35 @@ def create_surface_qa_image(
     img_file,
     output_file,
     color="red",
-    axial_slices=(0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7),
-    coronal_slices=(0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7),
-    sagittal_slices=(0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7),
+    axial_slices=QA_SLICES,
+    coronal_slices=QA_SLICES,
+    sagittal_slices=QA_SLICES,
+    cache=None,
+    output_options=None,
 ):
     linewidth = 0.5
-    if color == "binary":
-        linecolor = "red"
     if isinstance(color, (list, tuple)):
         linecolor = color[0]
         linewidth = color[1]
     else:
         linecolor = color
-    img_obj = nib.Nifti1Image.load(img_file)
+    if linecolor == "binary":
+        linecolor = "red"
+    # The background is decoded once per QA group for all surfaces drawn on it
+    img_obj = load_volume(img_file, cache)
     img_data = img_obj.get_fdata()
     # noinspection PyUnresolvedReferences
     tk = get_tkr_matrix(img_obj.shape, img_obj.header.get_zooms())
 
-    surf_obj = nib.GiftiImage.load(surf_file)
-    mesh = trimesh.Trimesh(*surf_obj.agg_data(("pointset", "triangle")))
-    # noinspection PyUnresolvedReferences
-    mesh.vertices = nib.affines.apply_affine(np.linalg.inv(tk), mesh.vertices)
+    mesh_key = (str(surf_file), img_obj.shape, tuple(img_obj.header.get_zooms()))
+    if cache is not None and mesh_key in cache.meshes:
+        mesh = cache.meshes[mesh_key]
+    else:
+        vertices, faces = load_surface(surf_file, cache)
+        # noinspection PyUnresolvedReferences
+        mesh = SurfaceMesh(nib.affines.apply_affine(np.linalg.inv(tk), vertices), faces)
+        if cache is not None:
+            cache.meshes[mesh_key] = mesh
 
     directions = ["axial", "sagittal", "coronal"]
     axes = {"sagittal": 0, "coronal": 1, "axial": 2}
@@ -327,7 +875,7 @@ def create_surface_qa_image(
             else:  # 'axial'
                 slice_arrs.append(img_data[:, :, slice_idx].ravel())
     slice_arr = np.concatenate(slice_arrs, axis=0)
-    img_data -= slice_arr.min()
+    img_data = img_data - slice_arr.min()
     img_data = np.array(img_data / np.percentile(slice_arr, 99.9) * 255.0)
     img_data[img_data > 255.0] = 255.0
     img_data = img_data.astype(np.ubyte)
@@ -338,60 +886,81 @@ def create_surface_qa_image(
         size = img_data.shape[axes[direction]]
         slices = np.rint(np.array(slice_levels[direction]) * size).astype(int)
         if direction == "sagittal":
-            plane_normal = [1, 0, 0]
             adding = [192, 0]
         elif direction == "coronal":
-            plane_normal = [0, 1, 0]
             adding = [192, 176]
         else:
-            plane_normal = [0, 0, 1]
             adding = [16, 0]
-        sections = mesh.section_multiplane(
-            plane_origin=[0, 0, 0],
-            plane_normal=plane_normal,
-            heights=slices,
-        )
+        sections = mesh.section(axes[direction], slices)
 
         for i, slice_idx in enumerate(slices):
-            fig = plt.figure(frameon=False, figsize=(224 / 72, 224 / 72), dpi=72)
-            ax = plt.Axes(fig, [0.0, 0.0, 1.0, 1.0])
-            ax.set_axis_off()
-            fig.add_axes(ax)
-
+            # Slices are placed on the canvas as (top row, left column) in pixels
             if direction == "sagittal":
                 slice_data = img_data[slice_idx, :, ::-1]
-                extent = (0, img_data.shape[1], 16, img_data.shape[2] + 16)
+                top_left = (QA_TILE_SIZE - img_data.shape[2] - 16, 0)
             elif direction == "coronal":
                 slice_data = img_data[:, slice_idx, ::-1]
-                extent = (16, img_data.shape[0] + 16, 16, img_data.shape[2] + 16)
+                top_left = (QA_TILE_SIZE - img_data.shape[2] - 16, 16)
             else:  # 'axial'
                 slice_data = img_data[:, :, slice_idx]
-                extent = (16, img_data.shape[0] + 16, 0, img_data.shape[1])
-
-            # Plot the slice with the correct extent
-            ax.imshow(np.zeros((224, 224)), extent=(0, 224, 0, 224), cmap="gray")
-            ax.imshow(slice_data.T, extent=extent, cmap="gray")
-
-            # Find intersections
-            if sections[i] is not None:
-                # noinspection PyTypeChecker
-                for points in sections[i].discrete:
-                    points[:, 0] += adding[0]
-                    points[:, 1] += adding[1]
-                    if direction in ["sagittal", "coronal"]:
-                        points = points[:, ::-1]
-                        points[:, 1] = img_data.shape[2] - points[:, 1] + 16
-                        if direction == "coronal":
-                            points[:, 0] = img_data.shape[0] - points[:, 0]
-                    else:
-                        points[:, 1] = img_data.shape[1] - points[:, 1]
-                    ax.plot(*points.T, color=linecolor, linewidth=linewidth)
-            buf = io.BytesIO()
-            fig.savefig(buf, format="png")
-            buf.seek(0)
-            imgs[d].append(np.array(Image.open(buf)))
-            buf.close()
-            plt.close(fig)
+                top_left = (QA_TILE_SIZE - img_data.shape[1], 16)
+
+            # Find intersections (y runs upwards from the bottom of the canvas)
+            polylines = []
+            for points in sections[i]:
+                points[:, 0] += adding[0]
+                points[:, 1] += adding[1]
+                if direction in ["sagittal", "coronal"]:
+                    points = points[:, ::-1]
+                    points[:, 1] = img_data.shape[2] - points[:, 1] + 16
+                    if direction == "coronal":
+                        points[:, 0] = img_data.shape[0] - points[:, 0]
+                else:
+                    points[:, 1] = img_data.shape[1] - points[:, 1]
+                points[:, 1] = QA_TILE_SIZE - points[:, 1]
+                polylines.append(points)
+            imgs[d].append(rasterize_slice(slice_data.T, top_left, polylines, linecolor, linewidth))
     montage = np.concatenate([np.concatenate(img_dir, 1) for img_dir in imgs], 0)
-    montage_im = Image.fromarray(montage)
-    montage_im.save(output_file)
+    save_qa_image(montage, output_file, output_options)
+
+
+def rasterize_slice(
+    slice_data, top_left, polylines, color="red", linewidth=0.5, size=QA_TILE_SIZE, supersample=4
+) -> np.ndarray:
+    """
+    Draw a grayscale slice and contour polylines onto a square black RGB canvas
+
+    The slice is contrast-stretched to its own min/max. Polylines are given as (x, y) pixel
+    coordinates with the origin at the top-left corner of the canvas and are drawn anti-aliased
+    by rendering a coverage mask at ``supersample`` times the resolution.
+    """
+    canvas = np.zeros((size, size), dtype=np.ubyte)
+    vmin, vmax = slice_data.min(), slice_data.max()
+    if vmax > vmin:
+        gray = np.minimum((slice_data - vmin) * (256.0 / (vmax - vmin)), 255.0).astype(np.ubyte)
+    else:
+        gray = np.zeros(slice_data.shape, dtype=np.ubyte)
+    # Clip the slice to the canvas
+    row, col = top_left
+    rows = slice(max(row, 0), min(row + gray.shape[0], size))
+    cols = slice(max(col, 0), min(col + gray.shape[1], size))
+    canvas[rows, cols] = gray[rows.start - row:rows.stop - row, cols.start - col:cols.stop - col]
+    canvas = np.repeat(canvas[:, :, np.newaxis], 3, axis=2)
+    if not polylines:
+        return canvas
+
+    mask = Image.new("L", (size * supersample, size * supersample))
+    draw = ImageDraw.Draw(mask)
+    width = max(1, int(round(linewidth * supersample)))
+    for points in polylines:
+        # PIL addresses pixel centers, the polylines use pixel edges
+        draw.line(
+            [tuple(pt) for pt in np.asarray(points) * supersample - 0.5],
+            fill=255,
+            width=width,
+            joint="curve",
+        )
+    coverage = np.asarray(mask.resize((size, size), Image.BOX), dtype=np.uint16)[:, :, np.newaxis]
+    linecolor = np.array(ImageColor.getrgb(color)[:3], dtype=np.uint16)
+    blended = linecolor * coverage + canvas.astype(np.uint16) * (255 - coverage) + 127
+    return (blended // 255).astype(np.ubyte)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""
+Project-wide QA contact sheets
+
+Collects every ``<subject>/<session>/qa/<module>/*.png`` image of a project into per-module
+mosaics of downsampled montages, with a JSON index mapping each cell to its source image.
+Thumbnails are cached and only rebuilt for sources that changed since the last run, and a
+sheet page is only recomposed when one of its cells changed.
+"""
+from __future__ import annotations
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+from pathlib import Path
+
+from PIL import Image
+
+from .hashing import hash_value
+
+SHEET_INDEX_VERSION = 1
+
+
+def find_qa_images(project_dir: Path) -> dict[str, list[Path]]:
+    """Return the full-size QA PNGs of a project grouped by module name."""
+    modules = {}
+    for qa_file in sorted(project_dir.glob("*/*/qa/*/*.png")):
+        if qa_file.name.split(".")[0].endswith("_thumb"):
+            continue
+        modules.setdefault(qa_file.parent.name, []).append(qa_file)
+    return modules
+
+
+def make_thumbnail(source: Path, thumb_file: Path, cell_size: int) -> None:
+    with Image.open(source) as img:
+        img = img.convert("RGB")
+        img.thumbnail((cell_size, cell_size), Image.LANCZOS)
+        thumb_file.parent.mkdir(exist_ok=True, parents=True)
+        img.save(thumb_file)
+
+
+def _make_thumbnails(jobs: list[tuple[Path, Path, int]]) -> list[tuple[Path, str]]:
+    errors = []
+    for source, thumb_file, cell_size in jobs:
+        try:
+            make_thumbnail(source, thumb_file, cell_size)
+        except Exception as e:
+            errors.append((source, str(e)))
+    return errors
+
+
+class ContactSheet:
+    """
+    Per-module contact sheet pages and their JSON index
+
+    Params:
+        module (str): QA module name
+        output_dir (Path): directory holding the sheets, index and thumbnail cache
+        cell_size (int): size of the square cell each montage is downsampled into
+        columns (int): cells per row
+        rows (int): rows per sheet page
+    """
+
+    def __init__(
+        self, module: str, output_dir: Path, cell_size: int = 256, columns: int = 10, rows: int = 20
+    ) -> None:
+        self.module = module
+        self.output_dir = output_dir
+        self.cell_size = cell_size
+        self.columns = columns
+        self.rows = rows
+        self.index_file = output_dir / f"{module}.json"
+        self.thumb_dir = output_dir / "thumbs" / module
+
+    def load_index(self) -> dict:
+        try:
+            index = json.loads(self.index_file.read_text())
+        except (OSError, ValueError):
+            return {}
+        layout = (SHEET_INDEX_VERSION, self.cell_size, self.columns, self.rows)
+        if (
+            index.get("version"),
+            index.get("cell_size"),
+            index.get("columns"),
+            index.get("rows"),
+        ) != layout:
+            return {}
+        return index
+
+    def thumb_file(self, rel_source: str) -> Path:
+        return self.thumb_dir / f"{hash_value(rel_source)[:24]}.png"
+
+    def plan(self, project_dir: Path, sources: list[Path]) -> tuple[list[dict], list[Path]]:
+        """Assign sources to cells and list the ones whose thumbnail must be rebuilt."""
+        previous = {entry["source"]: entry for entry in self.load_index().get("entries", [])}
+        per_sheet = self.columns * self.rows
+        entries, stale = [], []
+        for i, source in enumerate(sources):
+            rel_source = source.relative_to(project_dir).as_posix()
+            stat = source.stat()
+            page, cell = divmod(i, per_sheet)
+            row, col = divmod(cell, self.columns)
+            entry = {
+                "source": rel_source,
+                "subject": source.parents[3].name,
+                "session": source.parents[2].name,
+                "sheet": self.sheet_file(page).name,
+                "x": col * self.cell_size,
+                "y": row * self.cell_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+            }
+            prev = previous.get(rel_source)
+            if (
+                prev is None
+                or (prev["mtime_ns"], prev["size"]) != (entry["mtime_ns"], entry["size"])
+                or not self.thumb_file(rel_source).exists()
+            ):
+                stale.append(source)
+            entries.append(entry)
+        return entries, stale
+
+    def sheet_file(self, page: int) -> Path:
+        return self.output_dir / f"{self.module}_{page:03d}.png"
+
+    def compose(self, entries: list[dict], changed: set[str]) -> list[Path]:
+        """Recompose sheet pages whose cells changed (or that are missing)."""
+        previous = self.load_index()
+        prev_cells = {
+            (entry["sheet"], entry["x"], entry["y"]): entry["source"]
+            for entry in previous.get("entries", [])
+        }
+        pages = {}
+        for entry in entries:
+            pages.setdefault(entry["sheet"], []).append(entry)
+        written = []
+        for sheet_name, page_entries in pages.items():
+            sheet_path = self.output_dir / sheet_name
+            page_changed = (
+                not sheet_path.exists()
+                or len(page_entries) != sum(1 for key in prev_cells if key[0] == sheet_name)
+                or any(
+                    entry["source"] in changed
+                    or prev_cells.get((sheet_name, entry["x"], entry["y"])) != entry["source"]
+                    for entry in page_entries
+                )
+            )
+            if not page_changed:
+                continue
+            rows = -(-len(page_entries) // self.columns)
+            width = min(len(page_entries), self.columns) * self.cell_size
+            sheet = Image.new("RGB", (width, rows * self.cell_size))
+            for entry in page_entries:
+                thumb_file = self.thumb_file(entry["source"])
+                if not thumb_file.exists():
+                    continue
+                with Image.open(thumb_file) as thumb:
+                    # Center each thumbnail in its cell
+                    offset_x = (self.cell_size - thumb.width) // 2
+                    offset_y = (self.cell_size - thumb.height) // 2
+                    sheet.paste(thumb, (entry["x"] + offset_x, entry["y"] + offset_y))
+            sheet.save(sheet_path)
+            written.append(sheet_path)
+        # Pages left over from a larger previous sheet
+        for entry in previous.get("entries", []):
+            if entry["sheet"] not in pages:
+                (self.output_dir / entry["sheet"]).unlink(missing_ok=True)
+        return written
+
+    def save_index(self, entries: list[dict]) -> None:
+        index = {
+            "version": SHEET_INDEX_VERSION,
+            "module": self.module,
+            "cell_size": self.cell_size,
+            "columns": self.columns,
+            "rows": self.rows,
+            "sheets": sorted({entry["sheet"] for entry in entries}),
+            "entries": entries,
+        }
+        tmp_file = self.index_file.with_name(f".{self.index_file.name}.tmp")
+        tmp_file.write_text(json.dumps(index, indent=2))
+        tmp_file.replace(self.index_file)
+
+
+def build_contact_sheets(
+    project_dir: Path,
+    output_dir: Path | None = None,
+    modules: list[str] | None = None,
+    cell_size: int = 256,
+    columns: int = 10,
+    rows: int = 20,
+    workers: int = 1,
+) -> dict[str, list[Path]]:
+    """
+    Build or update the contact sheets of a project
+
+    Returns:
+        dict[str, list[Path]]: sheet pages written for each module
+    """
+    output_dir = project_dir / "qa-sheets" if output_dir is None else output_dir
+    output_dir.mkdir(exist_ok=True, parents=True)
+    qa_images = find_qa_images(project_dir)
+    if modules is not None:
+        qa_images = {module: qa_images.get(module, []) for module in modules}
+
+    sheets, plans = {}, {}
+    sessions = {}
+    for module, sources in qa_images.items():
+        sheet = ContactSheet(module, output_dir, cell_size, columns, rows)
+        entries, stale = sheet.plan(project_dir, sources)
+        sheets[module], plans[module] = sheet, (entries, stale)
+        for source in stale:
+            sessions.setdefault(source.parents[2], []).append(
+                (source, sheet.thumb_file(source.relative_to(project_dir).as_posix()), cell_size)
+            )
+
+    # Thumbnails are rebuilt one session per job
+    if workers <= 1 or len(sessions) <= 1:
+        results = [_make_thumbnails(jobs) for jobs in sessions.values()]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_make_thumbnails, sessions.values()))
+    for errors in results:
+        for source, error in errors:
+            logging.error(f"Could not create a contact sheet thumbnail for {source}: {error}")
+
+    written = {}
+    for module, sheet in sheets.items():
+        entries, stale = plans[module]
+        changed = {source.relative_to(project_dir).as_posix() for source in stale}
+        written[module] = sheet.compose(entries, changed)
+        sheet.save_index(entries)
+    return written
+
+
+def main(args: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Build project-wide QA contact sheets.")
+    parser.add_argument("-p", "--project-dir", type=Path, required=True)
+    parser.add_argument("-o", "--output-dir", type=Path, default=None)
+    parser.add_argument("-m", "--modules", type=str, nargs="+", default=None)
+    parser.add_argument("--cell-size", type=int, default=256)
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=20)
+    parser.add_argument("-w", "--workers", type=int, default=1)
+    parsed = parser.parse_args(args)
+
+    parsed.project_dir = parsed.project_dir.resolve()
+    if not parsed.project_dir.is_dir():
+        parser.error(f"Project directory ({parsed.project_dir}) does not exist.")
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    written = build_contact_sheets(
+        parsed.project_dir,
+        parsed.output_dir,
+        parsed.modules,
+        parsed.cell_size,
+        parsed.columns,
+        parsed.rows,
+        parsed.workers,
+    )
+    for module, sheet_paths in written.items():
+        logging.info(f"{module}: {len(sheet_paths)} contact sheet page(s) updated.")
+
+
+if __name__ == "__main__":
+    main()
@@ -56,3 +56,20 @@ def nn_resize_1mmiso(img_obj):
 
     # Reshape the result to the new shape
     return resized_data.reshape(new_shape)
+
+
+def nn_resize_indices(shape, zooms):
+    # Per-axis source indices selected by nn_resize_1mmiso, so that
+    # nn_resize_1mmiso(img) == data[np.ix_(*nn_resize_indices(img.shape, zooms))]
+    scaling_factors = [1.0 / zoom for zoom in zooms]
+    new_shape = tuple(int(round(dim / scale)) for dim, scale in zip(shape, scaling_factors))
+
+    indices = []
+    for dim, new_dim, scale in zip(shape, new_shape, scaling_factors):
+        # Same bounds as nn_resize_1mmiso, one axis at a time
+        start, end = -0.5, -0.5 + dim
+        diff = ((end - start) - new_dim * scale) / 2
+        coords = np.arange(start + diff + scale / 2, end - diff - scale / 4, scale)
+        # map_coordinates (order=0, mode="nearest") rounds half up and clips to the edges
+        indices.append(np.clip(np.floor(coords + 0.5).astype(int), 0, dim - 1))
+    return indices
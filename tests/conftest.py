@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def gzip_index_dir(tmp_path, monkeypatch):
+    """Keep gzip seek indexes written by the tests out of the user's cache directory."""
+    index_dir = tmp_path / "gzip-index"
+    monkeypatch.setenv("RADIFOX_GZIP_INDEX_DIR", str(index_dir))
+    return index_dir
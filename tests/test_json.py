@@ -0,0 +1,54 @@
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from radifox.records.json import JSONObjectEncoder, NoIndent
+
+
+class Info:
+    def __repr_json__(self):
+        return {"Shape": NoIndent([2, 3]), "Path": Path("/a/b")}
+
+
+DOC = {
+    "SeriesInfo": {
+        "SliceTiming": NoIndent([0.0, 0.5, 1.0]),
+        "Nested": NoIndent({"b": [1, 2], "a": NoIndent(["x", "é"])}),
+        "Info": Info(),
+        "List": [NoIndent([1]), 2, "s"],
+        "Empty": NoIndent([]),
+    }
+}
+
+
+@pytest.mark.parametrize(
+    "kwargs, expected",
+    [
+        (
+            {"indent": 4},
+            '{\n    "SeriesInfo": {\n        "SliceTiming": [0.0, 0.5, 1.0],\n'
+            '        "Nested": {"b": [1, 2], "a": ["x", "\\u00e9"]},\n'
+            '        "Info": {\n            "Shape": [2, 3],\n            "Path": "/a/b"\n'
+            '        },\n        "List": [\n            [1],\n            2,\n            "s"\n'
+            '        ],\n        "Empty": []\n    }\n}',
+        ),
+        (
+            {"indent": 2, "sort_keys": True, "ensure_ascii": False, "separators": (",", ":")},
+            '{\n  "SeriesInfo":{\n    "Empty":[],\n    "Info":{\n      "Path":"/a/b",\n'
+            '      "Shape":[2,3]\n    },\n    "List":[\n      [1],\n      2,\n      "s"\n'
+            '    ],\n    "Nested":{"a":["x","é"],"b":[1,2]},\n'
+            '    "SliceTiming":[0.0,0.5,1.0]\n  }\n}',
+        ),
+    ],
+)
+def test_json_object_encoder(kwargs, expected):
+    assert json.dumps(DOC, cls=JSONObjectEncoder, **kwargs) == expected
+    # json.dump streams the same output
+    fobj = io.StringIO()
+    json.dump(DOC, fobj, cls=JSONObjectEncoder, **kwargs)
+    assert fobj.getvalue() == expected
+    assert json.dumps(NoIndent([1, 2]), cls=JSONObjectEncoder, **kwargs) == json.dumps(
+        [1, 2], **{k: v for k, v in kwargs.items() if k != "indent"}
+    )
@@ -0,0 +1,22 @@
+import pytest
+
+from benchmarks.memory import (
+    SIZES,
+    WORKLOADS,
+    load_budgets,
+    make_inputs,
+    measure_tracemalloc,
+    over_budget,
+)
+
+
+@pytest.fixture(scope="module")
+def small_inputs(tmp_path_factory):
+    return make_inputs(tmp_path_factory.mktemp("memory"), SIZES["small"])
+
+
+@pytest.mark.parametrize("name", list(WORKLOADS))
+def test_memory_budget(small_inputs, name):
+    budget = load_budgets()[name]["small"]
+    measured = {"tracemalloc_mib": measure_tracemalloc(name, small_inputs)}
+    assert not over_budget(measured, budget), f"{name}: {measured} over {budget}"
@@ -0,0 +1,138 @@
+import gzip
+import io
+import os
+import zlib
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from radifox.records import nifti
+from radifox.records.nifti import (
+    GzipIndex,
+    IndexedGzipReader,
+    ParallelGzipWriter,
+    ZranGzipReader,
+    load_nifti,
+    prune_gzip_indexes,
+    save_nifti,
+)
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_parallel_gzip_writer(tmp_path, threads):
+    payload = np.random.default_rng(0).integers(0, 8, size=50_000).astype(np.ubyte).tobytes()
+    with ParallelGzipWriter(tmp_path / "out.gz", 6, threads, block_size=4096) as fobj:
+        fobj.write(payload[:1000])
+        fobj.seek(1500)
+        assert fobj.tell() == 1500
+        fobj.write(payload)
+        with pytest.raises(OSError):
+            fobj.seek(10)
+    expected = payload[:1000] + b"\x00" * 500 + payload
+    # A single standard gzip member
+    assert gzip.decompress((tmp_path / "out.gz").read_bytes()) == expected
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decompressor.decompress((tmp_path / "out.gz").read_bytes()) == expected
+    assert decompressor.eof and decompressor.unused_data == b""
+    # Byte-reproducible (no timestamp in the gzip header)
+    with ParallelGzipWriter(tmp_path / "again.gz", 6, threads, block_size=4096) as fobj:
+        fobj.write(payload[:1000] + b"\x00" * 500 + payload)
+    assert (tmp_path / "again.gz").read_bytes() == (tmp_path / "out.gz").read_bytes()
+
+
+def test_save_nifti(tmp_path):
+    data = np.random.default_rng(0).standard_normal((20, 30, 10)).astype(np.float32)
+    img = nib.Nifti1Image(data, np.diag([1.0, 1.2, 2.0, 1.0]))
+    save_nifti(img, tmp_path / "img.nii.gz", threads=2)
+    img.to_filename(tmp_path / "ref.nii.gz")
+    assert gzip.decompress((tmp_path / "img.nii.gz").read_bytes()) == gzip.decompress(
+        (tmp_path / "ref.nii.gz").read_bytes()
+    )
+    np.testing.assert_array_equal(nib.load(tmp_path / "img.nii.gz").get_fdata(), data)
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_gzip_index(tmp_path, gzip_index_dir, threads):
+    data = np.random.default_rng(0).integers(0, 1000, size=(20, 30, 40)).astype(np.int16)
+    img = nib.Nifti1Image(data, np.eye(4))
+    filename = tmp_path / "img.nii.gz"
+    with ParallelGzipWriter(filename, 6, threads, block_size=4096, index_spacing=8192) as fobj:
+        file_holder = nib.fileholders.FileHolder(filename=str(filename), fileobj=fobj)
+        img.to_file_map({"image": file_holder})
+    index = GzipIndex.load(filename)
+    assert len(index.checkpoints) == 6 and index.length == 352 + data.nbytes
+    assert len(list(gzip_index_dir.iterdir())) == 1
+
+    # Random access reads match the full stream
+    payload = gzip.decompress(filename.read_bytes())
+    with io.BufferedReader(IndexedGzipReader(filename, index)) as fobj:
+        for offset, size in [(20000, 5000), (100, 10), (30000, 20000), (47000, 10000)]:
+            fobj.seek(offset)
+            assert fobj.read(size) == payload[offset : offset + size]
+    loaded = load_nifti(filename)
+    assert isinstance(loaded.dataobj.file_like, io.BufferedReader)
+    np.testing.assert_array_equal(loaded.dataobj[:, :, 35], data[:, :, 35])
+    np.testing.assert_array_equal(loaded.dataobj[5, :, 2:9], data[5, :, 2:9])
+    np.testing.assert_array_equal(loaded.get_fdata(), data)
+
+    # A rewritten file is no longer indexed
+    img.to_filename(filename)
+    assert GzipIndex.load(filename) is None
+    np.testing.assert_array_equal(load_nifti(filename).get_fdata(), data)
+
+
+def test_zran_gzip_index(tmp_path, gzip_index_dir, monkeypatch):
+    pytest.importorskip("indexed_gzip")
+    monkeypatch.setattr(nifti, "GZIP_INDEX_SPACING", 2**16)
+    data = np.random.default_rng(0).integers(0, 1000, size=(40, 50, 60)).astype(np.int16)
+    filename = tmp_path / "img.nii.gz"
+    nib.Nifti1Image(data, np.eye(4)).to_filename(filename)
+    assert GzipIndex.load(filename) is None
+
+    # The first full decode indexes the file, and the index is stored on close
+    loaded = load_nifti(filename)
+    assert isinstance(loaded.dataobj.file_like.raw, ZranGzipReader)
+    np.testing.assert_array_equal(loaded.get_fdata(), data)
+    assert not gzip_index_dir.exists()
+    loaded.dataobj.file_like.close()
+    (index_file,) = gzip_index_dir.iterdir()
+    index_data = index_file.read_bytes()
+
+    # Later reads seek through the stored index, which is not rewritten
+    loaded = load_nifti(filename)
+    np.testing.assert_array_equal(loaded.dataobj[:, :, 50], data[:, :, 50])
+    np.testing.assert_array_equal(loaded.dataobj[5, :, 2:9], data[5, :, 2:9])
+    del loaded
+    assert index_file.read_bytes() == index_data
+    assert GzipIndex.load(filename) is None
+
+    # A rewritten file is indexed again
+    nib.Nifti1Image(data[::-1], np.eye(4)).to_filename(filename)
+    os.utime(filename, ns=(0, 0))
+    loaded = load_nifti(filename)
+    np.testing.assert_array_equal(loaded.dataobj[:, :, 50], data[::-1, :, 50])
+    np.testing.assert_array_equal(loaded.get_fdata(), data[::-1])
+    del loaded
+    assert index_file.read_bytes() != index_data
+
+
+def test_prune_gzip_indexes(tmp_path, gzip_index_dir, monkeypatch):
+    payload = np.random.default_rng(0).integers(0, 8, size=20_000).astype(np.ubyte).tobytes()
+    filenames = [tmp_path / f"{i}.gz" for i in range(3)]
+    for filename in filenames:
+        with ParallelGzipWriter(filename, 6, 1, block_size=4096, index_spacing=4096) as fobj:
+            fobj.write(payload)
+    index_files = [GzipIndex.index_file(filename) for filename in filenames]
+    sizes = [index_file.stat().st_size for index_file in index_files]
+    # Oldest first, then loading the first index marks it as the most recently used
+    for i, index_file in enumerate(index_files):
+        os.utime(index_file, ns=(i * 10**9, i * 10**9))
+    assert GzipIndex.load(filenames[0]) is not None
+    assert prune_gzip_indexes(max_bytes=sizes[0] + sizes[2]) == 1
+    assert [index_file.exists() for index_file in index_files] == [True, False, True]
+
+    # Saving an index keeps the directory in budget
+    monkeypatch.setenv("RADIFOX_GZIP_INDEX_BYTES", str(sizes[0]))
+    GzipIndex.load(filenames[0]).save(filenames[1])
+    assert [p.name for p in gzip_index_dir.iterdir()] == [index_files[1].name]
@@ -0,0 +1,301 @@
+import json
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+import pytest
+from PIL import Image
+
+from benchmarks.surface_qa import make_ellipsoid
+from radifox.records.processing import ProcessingModule
+from radifox.records.qa import (
+    QACache,
+    QAOutputOptions,
+    Reslicer,
+    SurfaceMesh,
+    create_montage,
+    create_qa_image,
+    create_surface_qa_image,
+    get_background_montage,
+    get_lut_array,
+    rasterize_slice,
+    save_qa_image,
+    render_qa_images,
+)
+
+SLICES = (0.3, 0.5, 0.7)
+# Rendered from make_surface_qa_inputs by the matplotlib surface QA renderer it replaced
+SURFACE_QA_REFERENCE = Path(__file__).parent / "data" / "surface_qa_reference.png"
+
+
+def make_surface_qa_inputs(out_dir):
+    """Write a smooth 1 mm T1 and an ellipsoid surface (as used for ``SURFACE_QA_REFERENCE``)."""
+    shape = (192, 224, 192)
+    grid = np.meshgrid(*[np.arange(dim) - dim / 2 for dim in shape], indexing="ij")
+    radius = np.sqrt(sum(axis**2 for axis in grid))
+    data = (np.exp(-radius / 40) * 1000).astype(np.int16)
+    nib.Nifti1Image(data, np.eye(4)).to_filename(out_dir / "t1.nii")
+    vertices, faces = make_ellipsoid(resolution=32)
+    nib.GiftiImage(
+        darrays=[
+            nib.gifti.GiftiDataArray(vertices.astype(np.float32), intent="NIFTI_INTENT_POINTSET"),
+            nib.gifti.GiftiDataArray(faces.astype(np.int32), intent="NIFTI_INTENT_TRIANGLE"),
+        ]
+    ).to_filename(out_dir / "surf.gii")
+    return out_dir / "surf.gii", out_dir / "t1.nii"
+
+
+def make_image(shape, zooms, axcodes=("R", "A", "S"), seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(-100, 1000, size=shape).astype(np.int16)
+    ornt = nib.orientations.axcodes2ornt(axcodes)
+    affine = nib.orientations.inv_ornt_aff(ornt, shape[:3]) @ np.diag(list(zooms) + [1])
+    return nib.Nifti1Image(data, affine)
+
+
+@pytest.mark.parametrize(
+    "axcodes",
+    [("R", "A", "S"), ("L", "P", "S"), ("P", "I", "R"), ("S", "L", "A")],
+)
+@pytest.mark.parametrize("zooms", [(1.0, 1.0, 1.0), (0.7, 0.9375, 2.5)])
+def test_on_demand_reslicer_matches_eager(tmp_path, axcodes, zooms):
+    img = make_image((23, 19, 17), zooms, axcodes)
+    img.to_filename(tmp_path / "img.nii.gz")
+    loaded = nib.load(tmp_path / "img.nii.gz", keep_file_open=True)
+    eager = Reslicer(loaded)
+    on_demand = Reslicer(loaded, on_demand=True)
+    # Force several slabs per pass
+    on_demand.slab_bytes = 23 * 19 * 8 * 3
+
+    assert on_demand.shape == eager.shape
+    assert on_demand.bg_value == eager.bg_value
+    requests = [
+        (int(frac * eager.get_num_slices(plane)), plane)
+        for plane in ("axial", "sagittal", "coronal")
+        for frac in SLICES
+    ]
+    expected = [eager.get_slice(slice_num, plane) for slice_num, plane in requests]
+    for exp_slice, got_slice in zip(expected, on_demand.get_slices(requests)):
+        np.testing.assert_array_equal(got_slice, exp_slice)
+
+
+def test_on_demand_reslicer_reads_first_volume():
+    img = make_image((12, 14, 10, 3), (1.0, 1.2, 1.5))
+    eager = Reslicer(img)
+    on_demand = Reslicer(img, on_demand=True)
+    assert on_demand.bg_value == eager.bg_value
+    np.testing.assert_array_equal(on_demand.get_slice(4, "coronal"), eager.get_slice(4, "coronal"))
+
+
+@pytest.mark.parametrize("volume", [3, "mean"])
+def test_reslicer_volume_selection(tmp_path, monkeypatch, volume):
+    # At most three summary volumes, so volumes 0, 3 and 6 are averaged
+    monkeypatch.setattr(Reslicer, "summary_volumes", 3)
+    monkeypatch.setattr(Reslicer, "slab_bytes", 12 * 14 * 8 * 4)
+    img = make_image((12, 14, 10, 7), (1.0, 1.2, 1.5))
+    img.to_filename(tmp_path / "img.nii.gz")
+    loaded = nib.load(tmp_path / "img.nii.gz", keep_file_open=True)
+    data = img.get_fdata()
+    expected_3d = data[..., 3] if volume == 3 else data[..., ::3].mean(axis=3)
+    expected = Reslicer(nib.Nifti1Image(expected_3d, img.affine, img.header))
+
+    for reslicer in [Reslicer(loaded, volume=volume), Reslicer(loaded, True, volume=volume)]:
+        assert reslicer.bg_value == pytest.approx(expected.bg_value)
+        np.testing.assert_allclose(reslicer.get_slice(4, "axial"), expected.get_slice(4, "axial"))
+        np.testing.assert_allclose(
+            reslicer.get_slice(5, "sagittal"), expected.get_slice(5, "sagittal")
+        )
+
+
+def test_create_montage_shape():
+    img = make_image((20, 24, 16), (1.0, 1.0, 2.0))
+    montage = create_montage(img, SLICES, SLICES, SLICES)
+    assert montage.shape == (3 * 32, 3 * 32)
+
+
+def test_overlay_blending_and_background_cache(tmp_path):
+    bg_img = make_image((20, 24, 16), (1.0, 1.0, 2.0))
+    bg_img.to_filename(tmp_path / "bg.nii.gz")
+    labels = np.random.default_rng(1).integers(0, 15, size=(20, 24, 16)).astype(np.int16)
+    nib.Nifti1Image(labels, bg_img.affine).to_filename(tmp_path / "seg.nii.gz")
+
+    cache = QACache()
+    for _ in range(2):
+        create_qa_image(
+            tmp_path / "bg.nii.gz",
+            tmp_path / "qa.png",
+            tmp_path / "seg.nii.gz",
+            "colorblind",
+            SLICES,
+            SLICES,
+            SLICES,
+            cache=cache,
+        )
+    assert len(cache.montages) == 1
+
+    base = get_background_montage(tmp_path / "bg.nii.gz", SLICES, SLICES, SLICES).astype(float)
+    overlay = create_montage(nib.load(tmp_path / "seg.nii.gz"), SLICES, SLICES, SLICES).T
+    colored = get_lut_array("colorblind")[overlay.astype(np.ubyte)].astype(float)
+    expected = colored * 0.4 + base[:, :, np.newaxis] * 0.6
+    got = np.asarray(Image.open(tmp_path / "qa.png")).astype(float)
+    assert np.abs(got - expected).max() <= 1.0
+
+
+def test_surface_qa_matches_reference(tmp_path):
+    if not SURFACE_QA_REFERENCE.exists():
+        pytest.skip("Surface QA reference image is not available.")
+    surf_path, img_path = make_surface_qa_inputs(tmp_path)
+    create_surface_qa_image(surf_path, img_path, tmp_path / "qa.png")
+    got = np.asarray(Image.open(tmp_path / "qa.png").convert("RGB"), dtype=np.int16)
+    expected = np.asarray(Image.open(SURFACE_QA_REFERENCE).convert("RGB"), dtype=np.int16)
+    assert got.shape == expected.shape
+    # Anti-aliasing differs along the contours, so only a few pixels may differ noticeably
+    diff = np.abs(got - expected).max(axis=-1)
+    assert diff.mean() < 0.5
+    assert np.mean(diff > 32) < 0.0025
+
+
+def test_surface_qa_background_cache(tmp_path):
+    make_image((20, 24, 16), (1.0, 1.0, 2.0)).to_filename(tmp_path / "bg.nii.gz")
+    # An octahedron around the center of the image (tkr RAS)
+    vertices = np.array(
+        [[6, 0, 0], [-6, 0, 0], [0, 6, 0], [0, -6, 0], [0, 0, 6], [0, 0, -6]], dtype=np.float32
+    )
+    faces = np.array(
+        [[0, 2, 4], [2, 1, 4], [1, 3, 4], [3, 0, 4], [2, 0, 5], [1, 2, 5], [3, 1, 5], [0, 3, 5]],
+        dtype=np.int32,
+    )
+    nib.GiftiImage(
+        darrays=[
+            nib.gifti.GiftiDataArray(vertices, intent="NIFTI_INTENT_POINTSET"),
+            nib.gifti.GiftiDataArray(faces, intent="NIFTI_INTENT_TRIANGLE"),
+        ]
+    ).to_filename(tmp_path / "surf.gii")
+
+    cache = QACache()
+    for name in ("a.png", "b.png"):
+        create_surface_qa_image(
+            tmp_path / "surf.gii", tmp_path / "bg.nii.gz", tmp_path / name, cache=cache
+        )
+    # Decoded once for the group
+    assert list(cache.volumes) == [str(tmp_path / "bg.nii.gz")]
+    assert Image.open(tmp_path / "a.png").tobytes() == Image.open(tmp_path / "b.png").tobytes()
+
+
+def test_rasterize_slice():
+    slice_data = np.arange(12, dtype=np.ubyte).reshape(3, 4) * 10
+    canvas = rasterize_slice(slice_data, (2, 1), [np.array([[0.0, 10.5], [20.0, 10.5]])], "lime", 1)
+    assert canvas.shape == (224, 224, 3)
+    # Stretched to the full range and placed at the top-left corner
+    expected = (slice_data.astype(float) * 256 / 110).clip(0, 255).astype(np.ubyte)
+    np.testing.assert_array_equal(canvas[2:5, 1:5, 0], expected)
+    assert canvas[0, 0].tolist() == [0, 0, 0]
+    # A one pixel wide line along row 10
+    assert canvas[10, 5].tolist() == [0, 255, 0]
+    assert canvas[12, 5].tolist() == [0, 0, 0]
+
+
+@pytest.mark.parametrize("axis", [0, 1, 2])
+def test_surface_mesh_section_matches_trimesh(axis):
+    trimesh = pytest.importorskip("trimesh")
+    mesh = trimesh.creation.icosphere(subdivisions=3, radius=20)
+    mesh.vertices = mesh.vertices * [1.0, 1.2, 0.8] + [50.3, 61.7, 40.1]
+    heights = np.arange(25, 80, 7)
+    normal = np.eye(3)[axis]
+    expected = mesh.section_multiplane(plane_origin=[0, 0, 0], plane_normal=normal, heights=heights)
+    sections = SurfaceMesh(mesh.vertices, mesh.faces, slab_width=3.0).section(axis, heights)
+    for exp_path, segments in zip(expected, sections):
+        if exp_path is None:
+            assert len(segments) == 0
+            continue
+        exp_points = np.concatenate(exp_path.discrete)
+        got_points = np.concatenate(segments)
+        # Every section point lies on trimesh's polylines (and vice versa)
+        dists = np.linalg.norm(got_points[:, None] - exp_points[None], axis=2)
+        assert dists.min(axis=1).max() < 1e-6
+        assert dists.min(axis=0).max() < 1e-6
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_qa_images_isolates_failures(tmp_path, workers):
+    for i in range(3):
+        make_image((12, 14, 10), (1.0, 1.0, 1.0), seed=i).to_filename(tmp_path / f"img{i}.nii.gz")
+    tasks = [
+        (tmp_path / f"img{i}.nii.gz", None, "binary", tmp_path / f"img{i}.png") for i in range(3)
+    ]
+    tasks.append((tmp_path / "missing.nii.gz", None, "binary", tmp_path / "missing.png"))
+    failures = render_qa_images(tasks, workers=workers)
+    assert failures == [tmp_path / "missing.png"]
+    assert all((tmp_path / f"img{i}.png").exists() for i in range(3))
+
+
+def test_save_qa_image_outputs(tmp_path):
+    image = np.random.default_rng(0).integers(0, 256, size=(300, 500, 3)).astype(np.ubyte)
+    options = QAOutputOptions(
+        png_compress_level=9, formats=("webp",), thumbnail_size=64, tile_size=128
+    )
+    save_qa_image(image, tmp_path / "qa.png", options)
+    np.testing.assert_array_equal(np.asarray(Image.open(tmp_path / "qa.png")), image)
+    assert Image.open(tmp_path / "qa.webp").size == (500, 300)
+    assert max(Image.open(tmp_path / "qa_thumb.png").size) == 64
+
+    layout = json.loads((tmp_path / "qa_tiles" / "tiles.json").read_text())
+    assert [(lvl["columns"], lvl["rows"]) for lvl in layout["levels"]] == [(4, 3), (2, 2), (1, 1)]
+    assert Image.open(tmp_path / "qa_tiles" / "0" / "3_2.png").size == (500 - 384, 300 - 256)
+    np.testing.assert_array_equal(
+        np.asarray(Image.open(tmp_path / "qa_tiles" / "0" / "1_0.png")), image[:128, 128:256]
+    )
+
+
+def test_render_qa_images_skips_unchanged(tmp_path):
+    make_image((12, 14, 10), (1.0, 1.0, 1.0)).to_filename(tmp_path / "img.nii.gz")
+    task = (tmp_path / "img.nii.gz", None, "binary", tmp_path / "qa" / "img.png")
+    (tmp_path / "qa").mkdir()
+    assert render_qa_images([task]) == []
+    assert (tmp_path / "qa" / "qa_manifest.json").exists()
+
+    # Same inputs, so the (tampered) output is left alone
+    (tmp_path / "qa" / "img.png").write_bytes(b"stale")
+    render_qa_images([task])
+    assert (tmp_path / "qa" / "img.png").read_bytes() == b"stale"
+
+    # New background content or a missing output renders again
+    make_image((12, 14, 10), (1.0, 1.0, 1.0), seed=1).to_filename(tmp_path / "img.nii.gz")
+    render_qa_images([task])
+    assert (tmp_path / "qa" / "img.png").read_bytes() != b"stale"
+    (tmp_path / "qa" / "img.png").unlink()
+    render_qa_images([task])
+    assert (tmp_path / "qa" / "img.png").exists()
+
+
+def test_deprecated_create_qa(tmp_path):
+    (tmp_path / "proc").mkdir()
+    make_image((12, 14, 10), (1.0, 1.0, 1.0)).to_filename(tmp_path / "proc" / "img.nii.gz")
+    outputs = {"image": tmp_path / "proc" / "img.nii.gz"}
+    with pytest.warns(DeprecationWarning):
+        ProcessingModule.create_qa(outputs, "test", ())
+    assert (tmp_path / "qa" / "test" / "img.png").exists()
+
+    # Modules that override create_qa are still rendered through it
+    calls = []
+
+    class Module(ProcessingModule):
+        name = "test"
+
+        @staticmethod
+        def cli(args=None):
+            return {}
+
+        @staticmethod
+        def run(**kwargs):
+            return {}
+
+        @staticmethod
+        def create_qa(outputs, name, skip_prov_write):
+            calls.append((outputs, name))
+
+    module = object.__new__(Module)
+    module.parsed_args, module.outputs = {"image": tmp_path / "proc" / "img.nii.gz"}, outputs
+    with pytest.warns(DeprecationWarning):
+        module.generate_qa_images()
+    assert calls == [(outputs, "test")]
@@ -0,0 +1,42 @@
+import json
+
+import numpy as np
+from PIL import Image
+
+from radifox.records.qasheet import build_contact_sheets
+
+
+def make_project(project_dir, num_sessions=3):
+    rng = np.random.default_rng(0)
+    for i in range(num_sessions):
+        qa_dir = project_dir / "SUBJ-01" / f"SUBJ-01_0{i}" / "qa" / "staging"
+        qa_dir.mkdir(parents=True)
+        for name in ("T1", "FLAIR"):
+            image = rng.integers(0, 256, size=(60, 80, 3)).astype(np.ubyte)
+            Image.fromarray(image).save(qa_dir / f"SUBJ-01_0{i}_{name}.png")
+
+
+def test_build_contact_sheets(tmp_path):
+    make_project(tmp_path / "proj")
+    out_dir = tmp_path / "sheets"
+    written = build_contact_sheets(tmp_path / "proj", out_dir, cell_size=20, columns=2, rows=2)
+    assert [p.name for p in written["staging"]] == ["staging_000.png", "staging_001.png"]
+    assert Image.open(out_dir / "staging_000.png").size == (40, 40)
+    assert Image.open(out_dir / "staging_001.png").size == (40, 20)
+
+    index = json.loads((out_dir / "staging.json").read_text())
+    entry = index["entries"][3]
+    assert entry["source"] == "SUBJ-01/SUBJ-01_01/qa/staging/SUBJ-01_01_T1.png"
+    assert (entry["sheet"], entry["x"], entry["y"]) == ("staging_000.png", 20, 20)
+    assert entry["session"] == "SUBJ-01_01"
+
+    # Nothing changed, so nothing is rewritten
+    written = build_contact_sheets(tmp_path / "proj", out_dir, cell_size=20, columns=2, rows=2)
+    assert written["staging"] == []
+
+    # Only the page holding the changed image is recomposed
+    source = tmp_path / "proj" / index["entries"][4]["source"]
+    Image.fromarray(np.full((60, 80, 3), 255, dtype=np.ubyte)).save(source)
+    written = build_contact_sheets(tmp_path / "proj", out_dir, cell_size=20, columns=2, rows=2)
+    assert [p.name for p in written["staging"]] == ["staging_001.png"]
+    assert np.asarray(Image.open(out_dir / "staging_001.png"))[10, 10].tolist() == [255] * 3
@@ -0,0 +1,515 @@
+import importlib.metadata
+import json
+import logging
+import time
+import tracemalloc
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from radifox.modules import staging
+from radifox.modules.staging import (
+    MEMPRAGEPlugin,
+    MP2RAGEPlugin,
+    PageCacheWarmer,
+    Staging,
+    StagingPlugin,
+    fix_sform_qform,
+    get_plugins,
+    load_plugins,
+    map_sessions,
+    run_plugins,
+)
+from radifox.naming import ImageFile
+from radifox.records.processing import CONTAINER_LABELS
+
+PLUGIN_SOURCE = """
+from pathlib import Path
+
+from radifox.modules.staging import MEMPRAGEPlugin, StagingPlugin
+
+counter = Path(__file__).with_suffix(".count")
+counter.write_text(str(int(counter.read_text()) + 1 if counter.exists() else 1))
+
+
+class EchoPlugin(StagingPlugin):
+    @staticmethod
+    def filter(images):
+        return []
+
+    @staticmethod
+    def run(images):
+        return images
+"""
+
+
+def test_plugin_files_load_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(staging, "_plugin_file_registry", {})
+    plugin_file = tmp_path / "echo_plugin.py"
+    plugin_file.write_text(PLUGIN_SOURCE)
+
+    plugins = load_plugins(plugin_file)
+    assert load_plugins(tmp_path / "." / "echo_plugin.py") is plugins
+    for _ in range(3):
+        get_plugins([plugin_file], skip_discovery=True)
+    assert (tmp_path / "echo_plugin.count").read_text() == "1"
+
+    # MEMPRAGEPlugin is imported by the plugin file, so it only runs once (in file order)
+    names = [plugin.__name__ for plugin in get_plugins([plugin_file], skip_discovery=True)]
+    assert names == ["EchoPlugin", "MEMPRAGEPlugin", "MP2RAGEPlugin"]
+
+
+def test_entry_point_plugins(monkeypatch):
+    monkeypatch.setattr(staging, "_entry_point_registry", None)
+    entry_points = [
+        importlib.metadata.EntryPoint(
+            "mp2rage", "radifox.modules.staging:MP2RAGEPlugin", staging.PLUGIN_ENTRY_POINT_GROUP
+        ),
+        importlib.metadata.EntryPoint(
+            "broken", "radifox.does_not_exist:Plugin", staging.PLUGIN_ENTRY_POINT_GROUP
+        ),
+    ]
+    monkeypatch.setattr(importlib.metadata, "entry_points", lambda group: entry_points)
+    assert get_plugins(skip_defaults=True) == [MP2RAGEPlugin]
+    assert get_plugins() == [MP2RAGEPlugin, MEMPRAGEPlugin]
+    assert get_plugins(skip_discovery=True) == [MEMPRAGEPlugin, MP2RAGEPlugin]
+
+
+class RenamePlugin(StagingPlugin):
+    """Static-only plugin (default lifecycle)"""
+
+    @staticmethod
+    def filter(images):
+        return [img for img in images if "T1" in img.name]
+
+    @staticmethod
+    def run(images):
+        return [ImageFile(img.path.with_name(img.name.replace("T1", "T1SUM"))) for img in images]
+
+
+class BatchPlugin(StagingPlugin):
+    calls = []
+
+    @staticmethod
+    def filter(images):
+        return [img for img in images if "SUM" in img.name]
+
+    @staticmethod
+    def run(images):
+        raise AssertionError("run_batch should be used")
+
+    @classmethod
+    def setup(cls):
+        cls.calls.append("setup")
+
+    @classmethod
+    def run_batch(cls, image_sets):
+        cls.calls.append(len(image_sets))
+        return [[ImageFile(img.path.with_suffix(".done")) for img in imgs] for imgs in image_sets]
+
+    @classmethod
+    def teardown(cls):
+        cls.calls.append("teardown")
+
+
+def test_run_plugins_lifecycle(tmp_path):
+    image_sets = [
+        [ImageFile(tmp_path / f"S-01_0{i}_T1.nii"), ImageFile(tmp_path / f"S-01_0{i}_T2.nii")]
+        for i in range(3)
+    ]
+    run_plugins(image_sets, [[RenamePlugin, BatchPlugin]] * 3)
+    assert BatchPlugin.calls == ["setup", 3, "teardown"]
+    assert [img.name for img in image_sets[1]] == ["S-01_01_T1SUM.done", "S-01_01_T2.nii"]
+
+
+def test_fix_sform_qform(tmp_path):
+    (tmp_path / "nii").mkdir()
+    (tmp_path / "stage").mkdir()
+    data = np.random.default_rng(0).integers(0, 3000, size=(30, 40, 20)).astype(np.int16)
+    affine = np.array([[0.9, 0.1, 0, -80], [-0.1, 0.9, 0, -100], [0, 0, 2.5, -40], [0, 0, 0, 1]])
+    img = nib.Nifti1Image(data, affine)
+    img.header.set_slope_inter(0.5, 3)
+    img.set_qform(np.eye(4), 1)
+    img.to_filename(tmp_path / "nii" / "S-01_01_T1.nii.gz")
+
+    # Matches loading the whole image and setting the forms, without rescaling the voxels
+    expected = nib.load(tmp_path / "nii" / "S-01_01_T1.nii.gz")
+    expected.set_qform(expected.get_sform(), 2)
+    expected.set_sform(expected.get_qform(), 1)
+    staged = fix_sform_qform(ImageFile(tmp_path / "nii" / "S-01_01_T1.nii.gz"))
+    assert staged.path == tmp_path / "stage" / "S-01_01_T1_hdrfix.nii.gz"
+    got = nib.load(staged.path)
+    np.testing.assert_allclose(got.affine, expected.affine)
+    assert got.header.get_sform(coded=True)[1] == 1
+    assert got.header.get_qform(coded=True)[1] == 2
+    assert got.dataobj.slope == 0.5
+    np.testing.assert_array_equal(np.asanyarray(got.dataobj.get_unscaled()), data)
+
+    # An already conformant image is staged as an identical clone
+    conformant = tmp_path / "nii" / "S-01_01_T2.nii.gz"
+    staged.path.replace(conformant)
+    staged = fix_sform_qform(ImageFile(conformant))
+    assert staged.path.read_bytes() == conformant.read_bytes()
+    assert [p.name for p in (tmp_path / "stage").iterdir()] == ["S-01_01_T2_hdrfix.nii.gz"]
+
+
+def make_session(session_dir, series, first=1):
+    (session_dir / "nii").mkdir(parents=True, exist_ok=True)
+    prefix = f"{session_dir.parent.name}_{session_dir.name}"
+    for i, image_type in enumerate(series, start=first):
+        stem = f"{prefix}_0{i}-01_{image_type}"
+        data = np.random.default_rng(i).integers(0, 1000, size=(10, 12, 8)).astype(np.int16)
+        img = nib.Nifti1Image(data, np.diag([1.0, 1.0, 1.5, 1.0]))
+        img.set_qform(np.eye(4), 1)
+        img.to_filename(session_dir / "nii" / f"{stem}.nii.gz")
+        info = {"AcquiredResolution": [1.0, 1.0], "SliceThickness": 1.5, "SliceSpacing": None}
+        (session_dir / "nii" / f"{stem}.json").write_text(json.dumps({"SeriesInfo": info}))
+
+
+def test_staging_module(tmp_path, monkeypatch):
+    labels = dict.fromkeys(CONTAINER_LABELS, "test")
+    (tmp_path / "labels.json").write_text(json.dumps(labels))
+    monkeypatch.setattr(Staging, "container_labels_path", tmp_path / "labels.json")
+    # The module adds its log handlers to the root logger
+    root = logging.getLogger()
+    monkeypatch.setattr(root, "handlers", root.handlers[:])
+    monkeypatch.setattr(root, "level", root.level)
+    subject_dir = tmp_path / "SUBJ-01"
+    make_session(subject_dir / "01", ["BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE"])
+    Staging(["-s", str(subject_dir), "--image-types", "modality=T1"])
+    stem = "SUBJ-01_01_01-01_BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE_hdrfix"
+    assert (subject_dir / "01" / "stage" / f"{stem}.prov").exists()
+    assert (subject_dir / "01" / "qa" / "staging" / f"{stem}.png").exists()
+
+    monkeypatch.setattr(Staging, "container_labels_path", tmp_path / "missing.json")
+    with pytest.raises(ValueError):
+        Staging(["-s", str(subject_dir), "--image-types", "modality=T1"])
+
+
+def test_incremental_staging(tmp_path):
+    subject_dir = tmp_path / "SUBJ-01"
+    session_dir = subject_dir / "01"
+    make_session(session_dir, ["BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE", "BRAIN-T2-FSE-2D-AXIAL-NA"])
+    args = ["-s", str(subject_dir), "--image-types", "modality=T1", "modality=T2"]
+    Staging.run(**Staging.cli(args))
+    manifest_file = session_dir / "SUBJ-01_01_StagingManifest.json"
+    manifest = json.loads(manifest_file.read_text())["entries"]
+    t1_name = "SUBJ-01_01_01-01_BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE_hdrfix.nii.gz"
+    t2_name = "SUBJ-01_01_02-01_BRAIN-T2-FSE-2D-AXIAL-NA_hdrfix.nii.gz"
+    assert sorted(manifest) == sorted(p.name for p in (session_dir / "stage").iterdir())
+    assert manifest[t1_name]["sources"][0]["path"] == (
+        "nii/SUBJ-01_01_01-01_BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE.nii.gz"
+    )
+    mtimes = {p.name: p.stat().st_mtime_ns for p in (session_dir / "stage").iterdir()}
+
+    # Changed sources are rebuilt, unchanged ones kept and new series picked up
+    nib.Nifti1Image(np.ones((10, 12, 8), dtype=np.int16), np.eye(4)).to_filename(
+        session_dir / "nii" / "SUBJ-01_01_01-01_BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE.nii.gz"
+    )
+    make_session(session_dir, ["BRAIN-T2-FSE-2D-CORONAL-NA"], first=3)
+    with pytest.raises(SystemExit):
+        Staging.cli(args)
+    Staging.run(**Staging.cli(args + ["--update"]))
+    staged = {p.name: p.stat().st_mtime_ns for p in (session_dir / "stage").iterdir()}
+    assert len(staged) == 3
+    assert staged[t2_name] == mtimes[t2_name]
+    assert staged[t1_name] != mtimes[t1_name]
+    np.testing.assert_array_equal(nib.load(session_dir / "stage" / t1_name).get_fdata(), 1)
+
+
+def test_incremental_staging_plugin_outputs(tmp_path, monkeypatch):
+    subject_dir = tmp_path / "SUBJ-01"
+    session_dir = subject_dir / "01"
+    make_session(session_dir, ["BRAIN-T2-FSE-2D-AXIAL-NA"])
+    # Two MEMPRAGE echoes of series 05 and four MP2RAGE components of series 06
+    extras = [("05", "01", "ECHO1"), ("05", "02", "ECHO2")] + [
+        ("06", f"0{i}", extra)
+        for i, extra in enumerate(["INV1-REA", "INV1-IMA", "INV2-REA", "INV2-IMA"], start=1)
+    ]
+    for series, acq, extra in extras:
+        stem = f"SUBJ-01_01_{series}-{acq}_BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE-{extra}"
+        data = np.random.default_rng(int(series + acq)).integers(-500, 500, size=(10, 12, 8))
+        nib.Nifti1Image(data.astype(np.int16), np.eye(4)).to_filename(
+            session_dir / "nii" / f"{stem}.nii.gz"
+        )
+        (session_dir / "nii" / f"{stem}.json").write_text(
+            (session_dir / "nii" / "SUBJ-01_01_01-01_BRAIN-T2-FSE-2D-AXIAL-NA.json").read_text()
+        )
+    args = ["-s", str(subject_dir), "--image-types", "modality=T1", "modality=T2"]
+    Staging.run(**Staging.cli(args))
+    stage_dir = session_dir / "stage"
+    mtimes = {p.name: p.stat().st_mtime_ns for p in stage_dir.iterdir()}
+    sum_stem = "SUBJ-01_01_05-01_BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE-ECHO1_sum"
+    assert len(mtimes) == 3 and f"{sum_stem}_hdrfix.nii.gz" in mtimes
+    # Removed intermediates keep their manifest entries
+    manifest = json.loads((session_dir / "SUBJ-01_01_StagingManifest.json").read_text())
+    assert f"{sum_stem}.nii.gz" in manifest["entries"]
+    assert len(manifest["entries"]) == 5
+
+    # An update without changes rebuilds nothing (plugin outputs included)
+    def fail(*args, **kwargs):
+        raise AssertionError("rebuilt")
+
+    with monkeypatch.context() as m:
+        m.setattr(MEMPRAGEPlugin, "write_memprage_sum", staticmethod(fail))
+        m.setattr(MP2RAGEPlugin, "write_uniden", staticmethod(fail))
+        Staging.run(**Staging.cli(args + ["--update"]))
+    assert {p.name: p.stat().st_mtime_ns for p in stage_dir.iterdir()} == mtimes
+
+    # A removed staged output is rebuilt from its (rebuilt) intermediate
+    (stage_dir / f"{sum_stem}_hdrfix.nii.gz").unlink()
+    Staging.run(**Staging.cli(args + ["--update"]))
+    staged = {p.name: p.stat().st_mtime_ns for p in stage_dir.iterdir()}
+    assert staged.keys() == mtimes.keys()
+    assert [name for name in staged if staged[name] != mtimes[name]] == [
+        f"{sum_stem}_hdrfix.nii.gz"
+    ]
+
+
+def test_parallel_staging_matches_serial(tmp_path, caplog):
+    series = [
+        "BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE",
+        "BRAIN-T2-FSE-2D-AXIAL-NA",
+        "BRAIN-FLAIR-FSE-3D-SAGITTAL-NA",
+    ]
+    results = {}
+    for workers in (1, 3):
+        subject_dir = tmp_path / str(workers) / "SUBJ-01"
+        for session in ("01", "02", "03", "04"):
+            make_session(subject_dir / session, series)
+        args = [
+            "-s", str(subject_dir), "--image-types", "modality=T1", "modality=T2",
+            "--reg-filters", "modality=T1;acqdim=3D", "-w", str(workers),
+        ]
+        caplog.clear()
+        with caplog.at_level("INFO"):
+            outputs = Staging.run(**Staging.cli(args))
+        staged = {
+            p.relative_to(subject_dir).as_posix(): (
+                str(p.readlink()) if p.is_symlink() else p.read_bytes()
+            )
+            for p in sorted(subject_dir.glob("*/stage/*"))
+        }
+        messages = [msg.replace(str(subject_dir), "") for msg in caplog.messages]
+        results[workers] = (outputs, staged, messages)
+    (outputs_1, staged_1, messages_1), (outputs_3, staged_3, messages_3) = results.values()
+    assert [[img.name for img in out["staged_files"]] for out in outputs_1] == [
+        [img.name for img in out["staged_files"]] for out in outputs_3
+    ]
+    assert staged_1.keys() == staged_3.keys() and len(staged_1) == 16
+    assert staged_1 == staged_3
+    assert len(messages_1) > 20
+    assert messages_1 == messages_3
+
+
+def test_map_sessions_orders_child_logger_records(caplog):
+    logger = logging.getLogger("radifox.test.plugin")
+
+    def work(i):
+        for j in range(3):
+            logger.info(f"{i}-{j}")
+            # Later items log first
+            time.sleep(0.01 * (3 - i))
+        return i
+
+    with caplog.at_level("INFO"):
+        assert map_sessions(work, [(i,) for i in range(3)], workers=3) == [0, 1, 2]
+    assert caplog.messages == [f"{i}-{j}" for i in range(3) for j in range(3)]
+    assert all(record.name == "radifox.test.plugin" for record in caplog.records)
+
+
+def test_page_cache_warmer(tmp_path):
+    file_sets = []
+    for i in range(3):
+        file_sets.append([tmp_path / f"{i}-{j}.bin" for j in range(2)])
+        for path in file_sets[-1]:
+            path.write_bytes(b"\x00" * 1000)
+
+    def wait_for(warmer, index):
+        deadline = time.monotonic() + 10
+        while index not in warmer.warmed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return warmer.warmed.get(index)
+
+    with PageCacheWarmer(file_sets, depth=1, max_bytes=1500) as warmer:
+        warmer.advance(0)
+        # Only the next session is read, up to the byte cap
+        assert wait_for(warmer, 1) == 1500
+        time.sleep(0.1)
+        assert 0 not in warmer.warmed and 2 not in warmer.warmed
+        warmer.advance(1)
+        assert wait_for(warmer, 2) == 1500
+
+
+def test_plan_and_execute(tmp_path, monkeypatch):
+    subject_dir = tmp_path / "SUBJ-01"
+    series = ["BRAIN-T2-FSE-2D-AXIAL-NA", "BRAIN-T1-SE-2D-AXIAL-PRE"]
+    for session in ("01", "02"):
+        make_session(subject_dir / session, series)
+        # Two MEMPRAGE echoes of series 05
+        for echo in (1, 2):
+            stem = f"SUBJ-01_{session}_05-0{echo}_BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE-ECHO{echo}"
+            nii_dir = subject_dir / session / "nii"
+            nib.Nifti1Image(np.ones((10, 12, 8), dtype=np.int16), np.eye(4)).to_filename(
+                nii_dir / f"{stem}.nii.gz"
+            )
+            (nii_dir / f"{stem}.json").write_text(
+                (nii_dir / f"SUBJ-01_{session}_01-01_BRAIN-T2-FSE-2D-AXIAL-NA.json").read_text()
+            )
+    plan_file = tmp_path / "plan.json"
+    args = [
+        "-s", str(subject_dir), "--image-types", "modality=T1", "modality=T2",
+        "--reg-filters", "modality=T1;acqdim=3D", "--keep-best-res",
+    ]
+    assert Staging.cli(args + ["--plan", str(plan_file)]) is None
+    assert not (subject_dir / "01" / "stage").exists()
+    plan = json.loads(plan_file.read_text())
+    sum_name = "SUBJ-01_01_05-01_BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE-ECHO1_sum"
+    assert plan["sessions"]["01"]["image_sets"][0]["steps"] == [
+        {
+            "plugin": "radifox.modules.staging:MEMPRAGEPlugin",
+            "inputs": [
+                f"nii/SUBJ-01_01_05-0{echo}_BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE-ECHO{echo}.nii.gz"
+                for echo in (2, 1)
+            ],
+            "outputs": [f"stage/{sum_name}.nii.gz"],
+        }
+    ]
+    assert plan["subject_target"] == f"01/stage/{sum_name}_hdrfix.nii.gz"
+
+    # Sessions executed separately (e.g. on different machines) stage what was planned
+    for session in ("02", "01"):
+        Staging.run(**Staging.cli(["--execute", str(plan_file), "--sessions", session]))
+    for session, session_plan in plan["sessions"].items():
+        stage_dir = subject_dir / session / "stage"
+        assert sorted(
+            p.relative_to(subject_dir / session).as_posix() for p in stage_dir.glob("*.nii.gz")
+        ) == sorted(entry["path"] for entry in session_plan["staged"])
+        assert (stage_dir / "session-target").resolve() == (
+            subject_dir / session / session_plan["session_target"]
+        )
+        assert (stage_dir / "subject-target").resolve() == subject_dir / plan["subject_target"]
+
+    # Without a plan hook, plugin outputs are left to execution (--update keeps the target)
+    monkeypatch.setattr(MEMPRAGEPlugin, "plan", staticmethod(lambda images: None))
+    plan = Staging.plan(**Staging.cli(args + ["--update"]))
+    assert plan["sessions"]["01"]["deferred"]
+    assert plan["sessions"]["01"]["staged"] is None
+    assert plan["sessions"]["01"]["session_target"] is None
+    assert plan["subject_target"] == f"01/stage/{sum_name}_hdrfix.nii.gz"
+
+
+def test_execute_checks_plan(tmp_path, capsys):
+    subject_dir = tmp_path / "SUBJ-01"
+    nii_dir = subject_dir / "01" / "nii"
+    make_session(subject_dir / "01", ["BRAIN-T2-FSE-2D-AXIAL-NA", "BRAIN-T2-FSE-2D-CORONAL-NA"])
+    plan_file = tmp_path / "plan.json"
+    args = ["-s", str(subject_dir), "--image-types", "modality=T2", "--keep-best-res"]
+    Staging.cli(args + ["--plan", str(plan_file)])
+    assert json.loads(plan_file.read_text())["sessions"]["01"]["staged"][0]["path"] == (
+        "stage/SUBJ-01_01_02-01_BRAIN-T2-FSE-2D-CORONAL-NA_hdrfix.nii.gz"
+    )
+
+    # A sidecar changed after planning makes another image the best resolution
+    sidecar = nii_dir / "SUBJ-01_01_01-01_BRAIN-T2-FSE-2D-AXIAL-NA.json"
+    info = json.loads(sidecar.read_text())
+    info["SeriesInfo"]["SliceThickness"] = 1.0
+    sidecar.write_text(json.dumps(info))
+    with pytest.raises(SystemExit):
+        Staging.cli(["--execute", str(plan_file)])
+    assert "staged of session 01 no longer match the plan" in capsys.readouterr().err
+    assert not (subject_dir / "01" / "stage").exists()
+
+    # So does a missing input
+    Staging.cli(args + ["--plan", str(plan_file)])
+    (nii_dir / "SUBJ-01_01_02-01_BRAIN-T2-FSE-2D-CORONAL-NA.nii.gz").unlink()
+    with pytest.raises(ValueError, match="no longer exist"):
+        Staging.plan_to_args(json.loads(plan_file.read_text()))
+
+
+def test_uncompressed_staging(tmp_path):
+    subject_dir = tmp_path / "SUBJ-01"
+    session_dir = subject_dir / "01"
+    make_session(session_dir, ["BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE", "BRAIN-T2-FSE-2D-AXIAL-NA"])
+    # A raw image that is itself uncompressed
+    t2_file = session_dir / "nii" / "SUBJ-01_01_02-01_BRAIN-T2-FSE-2D-AXIAL-NA.nii.gz"
+    nib.load(t2_file).to_filename(t2_file.with_name(t2_file.name.replace(".gz", "")))
+    t2_file.unlink()
+
+    args = ["-s", str(subject_dir), "--image-types", "modality=T1", "modality=T2"]
+    outputs = Staging.run(**Staging.cli(args + ["--uncompressed"]))
+    staged = sorted(img.name for img in outputs[0]["staged_files"])
+    assert staged == [
+        "SUBJ-01_01_01-01_BRAIN-T1-IRFSPGR-3D-SAGITTAL-PRE_hdrfix.nii",
+        "SUBJ-01_01_02-01_BRAIN-T2-FSE-2D-AXIAL-NA_hdrfix.nii",
+    ]
+    for img in outputs[0]["staged_files"]:
+        # Memory-mapped on load, with the sidecar of the raw image
+        assert isinstance(nib.load(img.path).dataobj.get_unscaled(), np.memmap)
+        assert img.info.SliceThickness == 1.5
+    assert len(Staging.get_qa_tasks(outputs[0], "staging", Staging.skip_prov_write)) == 2
+
+    # Compressed staging again replaces the uncompressed files
+    outputs = Staging.run(**Staging.cli(args + ["--update"]))
+    assert sorted(p.name for p in (session_dir / "stage").iterdir()) == [
+        name + ".gz" for name in staged
+    ]
+
+
+def test_sum_echoes_memory(tmp_path, monkeypatch):
+    shape = (128, 128, 64)
+    rng = np.random.default_rng(0)
+    echo_paths = []
+    for i in range(4):
+        img = nib.Nifti1Image(rng.integers(0, 4000, size=shape).astype(np.int16), np.eye(4))
+        img.header.set_slope_inter(0.37, 5)
+        img.to_filename(tmp_path / f"echo{i}.nii.gz")
+        echo_paths.append(tmp_path / f"echo{i}.nii.gz")
+    expected = np.sum(
+        [nib.Nifti1Image.load(path).get_fdata(dtype=np.float32) for path in echo_paths], axis=0
+    )
+
+    monkeypatch.setattr(MEMPRAGEPlugin, "slab_bytes", 128 * 128 * 8 * 4)
+    tracemalloc.start()
+    try:
+        sum_data, header = MEMPRAGEPlugin.sum_echoes(echo_paths)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # Bit-identical to summing the loaded echoes, with a peak near one float32 volume
+    np.testing.assert_array_equal(sum_data.view(np.uint32), expected.view(np.uint32))
+    assert header.get_data_shape() == shape
+    assert peak < 1.5 * sum_data.nbytes, peak / sum_data.nbytes
+
+
+@pytest.mark.parametrize("components", [("REA", "IMA"), ("MAG", "PHA")])
+def test_compute_uniden_matches_complex(tmp_path, monkeypatch, components):
+    shape = (20, 22, 15)
+    rng = np.random.default_rng(0)
+    paths, data = [], []
+    for i in range(4):
+        if components == ("MAG", "PHA") and i % 2 == 1:
+            arr = rng.integers(-4096, 4096, size=shape).astype(np.int16)
+        else:
+            arr = (rng.standard_normal(shape) * 30000).astype(np.float32)
+        nib.Nifti1Image(arr, np.eye(4)).to_filename(tmp_path / f"comp{i}.nii.gz")
+        paths.append(tmp_path / f"comp{i}.nii.gz")
+        data.append(arr.astype(np.float32))
+    cpx = []
+    for comp_a, comp_b in (data[:2], data[2:]):
+        if components == ("REA", "IMA"):
+            cpx.append(comp_a + comp_b * 1j)
+        else:
+            comp_b = (comp_b - comp_b.min()) / (comp_b.max() - comp_b.min()) * (2 * np.pi)
+            cpx.append(comp_a * np.exp(comp_b * 1j))
+    expected = np.real(
+        (np.conjugate(cpx[0]) * cpx[1] - 1e9) / (abs(cpx[0]) ** 2 + abs(cpx[1]) ** 2 + 2e9)
+    )
+    expected = np.clip(expected, -0.5, 0.5) + 0.5
+
+    monkeypatch.setattr(MP2RAGEPlugin, "slab_bytes", 20 * 22 * 8 * 4)
+    uniden, header = MP2RAGEPlugin.compute_uniden(paths, components)
+    assert uniden.dtype == np.float32
+    assert header.get_data_shape() == shape
+    np.testing.assert_allclose(uniden, expected, atol=1e-6)